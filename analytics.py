@@ -0,0 +1,350 @@
+"""
+Per-segment route analytics.
+
+The six aggregates of `process_route_internal` say how much a route
+climbs, not where or how hard. This module works on the same
+elevation samples (the route resampled every `RESAMPLE_STEP_METERS`)
+and adds:
+    - A grade histogram: distance spent in each band of slope
+    - Per-kilometre splits: gain, loss, average grade and walking time
+    - The steepest 100 m climb and descent
+    - Walking (Naismith, Tobler) and cycling time estimates
+
+Distances, elevations and their running totals (gain, loss, walking
+time) are kept in flat `array('d')` columns built with
+`itertools.accumulate`. Any stretch of the route is then two
+interpolated lookups in those totals, so the splits and the sliding
+100 m window cost O(n) for the whole route instead of re-summing the
+samples of every split or window.
+
+The analytics `/get-route` computed are stored in `route_analytics`
+when the route is saved (see planning.py). They are dropped by
+triggers when the route's coordinates change, and then recomputed on
+the next request.
+"""
+
+
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from math import asin, cos, exp, radians, sin, sqrt
+
+from helpers import (
+    get_elevations,
+    known_elevations,
+    RESAMPLE_MAX_SAMPLES,
+    RESAMPLE_STEP_METERS,
+    resample_route,
+)
+from metrics import timed
+from planning import route_points
+
+
+
+ANALYTICS_VERSION = 1               # Stored results of older versions are recomputed
+EARTH_RADIUS_METERS = 6371000.0
+SPLIT_METERS = 1000
+CLIMB_WINDOW_METERS = 100
+GRADE_BANDS = (-15, -10, -6, -3, -1, 1, 3, 6, 10, 15)     # Percent, edges between bands
+
+NAISMITH_SPEED_KMH = 5              # 1 hour per 5 km ...
+NAISMITH_CLIMB_M_PER_HOUR = 600     # ... plus 1 hour per 600 m of ascent
+TOBLER_MAX_SPEED_KMH = 6            # Walking speed on a 5% descent
+CYCLING_SPEED_KMH = 18              # Naismith's rule with cycling speeds
+CYCLING_CLIMB_M_PER_HOUR = 500
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS route_analytics (
+    route_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    analytics TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS route_analytics_on_delete
+AFTER DELETE ON routes
+BEGIN
+    DELETE FROM route_analytics WHERE route_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_analytics_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    DELETE FROM route_analytics WHERE route_id = OLD.id;
+END;
+"""
+
+
+
+def init_analytics_schema(connection):
+    """
+    Creates the table of stored route analytics.
+    """
+
+    connection.executescript(ANALYTICS_SCHEMA)
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Profile Columns
+# ===========================================================
+def _distances(samples):
+    """
+    Cumulative distance in meters at every sample.
+    """
+
+    lats = [radians(p["lat"]) for p in samples]
+    lngs = [radians(p["lng"]) for p in samples]
+    cos_lats = [cos(lat) for lat in lats]
+
+    steps = (
+        2 * EARTH_RADIUS_METERS * asin(sqrt(min(1.0, sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lng2 - lng1) / 2) ** 2)))
+        for lat1, lat2, lng1, lng2, cos1, cos2 in zip(
+            lats, lats[1:], lngs, lngs[1:], cos_lats, cos_lats[1:]
+        )
+    )
+    return array("d", accumulate(steps, initial = 0.0))
+
+def _tobler_hours(length, rise):
+    """
+    Walking time over one step with Tobler's hiking function
+    (6 km/h at a 5% descent, slower both steeper and flatter).
+    """
+
+    if length <= 0:
+        return 0.0
+    speed = TOBLER_MAX_SPEED_KMH * exp(-3.5 * abs(rise / length + 0.05))
+    return length / 1000 / speed
+
+def _at(totals, distances, position):
+    """
+    Linear interpolation of a running total at `position` meters.
+    Elevation is linear between two samples, so this is exact for
+    every column built from it.
+    """
+
+    i = bisect_right(distances, position) - 1
+    if i < 0:
+        return totals[0]
+    if i >= len(distances) - 1:
+        return totals[-1]
+    span = distances[i + 1] - distances[i]
+    t = (position - distances[i]) / span if span else 0.0
+    return totals[i] + (totals[i + 1] - totals[i]) * t
+
+
+
+# ===========================================================
+#                    Analytics
+# ===========================================================
+def _grade_histogram(lengths, rises, total):
+    """
+    Distance per grade band. Grades on a band edge count in the
+    steeper band.
+    """
+
+    band_lengths = [0.0] * (len(GRADE_BANDS) + 1)
+    for length, rise in zip(lengths, rises):
+        if length > 0:
+            grade = rise / length * 100
+            band = bisect_left(GRADE_BANDS, grade) if grade < 0 else bisect_right(GRADE_BANDS, grade)
+            band_lengths[band] += length
+
+    edges = (None,) + GRADE_BANDS + (None,)
+    return [
+        {
+            "min_grade": low,
+            "max_grade": high,
+            "distance_km": round(length / 1000, 3),
+            "share": round(length / total, 4) if total else 0
+        }
+        for low, high, length in zip(edges, edges[1:], band_lengths)
+    ]
+
+def _steepest(distances, elevations, window):
+    """
+    Steepest climb and descent over `window` meters, with two pointers
+    sliding along the samples. The whole route is one window when it
+    is shorter.
+
+    Returns:
+        tuple: (climb, descent) dicts, or (None, None) for a flat route.
+    """
+
+    total = distances[-1]
+    if total <= 0:
+        return None, None
+    window = min(window, total)
+
+    best_up = best_down = None
+    end = 0
+    last = len(distances) - 1
+    for start in range(last + 1):
+        target = distances[start] + window
+        if target > total:
+            break
+        while end < last and distances[end] < target:
+            end += 1
+        span = distances[end] - distances[end - 1]
+        t = (target - distances[end - 1]) / span if span else 1.0
+        change = elevations[end - 1] + (elevations[end] - elevations[end - 1]) * t - elevations[start]
+        if best_up is None or change > best_up[1]:
+            best_up = (start, change)
+        if best_down is None or change < best_down[1]:
+            best_down = (start, change)
+
+    def describe(start, change):
+        return {
+            "start_km": round(distances[start] / 1000, 3),
+            "end_km": round((distances[start] + window) / 1000, 3),
+            "grade": round(change / window * 100, 1),
+            "elevation_change": round(change, 1)
+        }
+
+    climb = describe(*best_up) if best_up[1] > 0 else None
+    descent = describe(*best_down) if best_down[1] < 0 else None
+    return climb, descent
+
+def _splits(distances, elevations, gains, losses, hours):
+    """
+    One entry per started kilometre.
+    """
+
+    total = distances[-1]
+    bounds = [float(km * SPLIT_METERS) for km in range(int(total // SPLIT_METERS) + 1)]
+    if total - bounds[-1] > 1e-6:
+        bounds.append(total)
+
+    gain_at = [_at(gains, distances, b) for b in bounds]
+    loss_at = [_at(losses, distances, b) for b in bounds]
+    elevation_at = [_at(elevations, distances, b) for b in bounds]
+    hours_at = [_at(hours, distances, b) for b in bounds]
+
+    return [
+        {
+            "km": i + 1,
+            "distance_km": round((bounds[i + 1] - bounds[i]) / 1000, 3),
+            "elevation_gain": round(gain_at[i + 1] - gain_at[i], 1),
+            "elevation_loss": round(loss_at[i + 1] - loss_at[i], 1),
+            "grade": round((elevation_at[i + 1] - elevation_at[i]) / (bounds[i + 1] - bounds[i]) * 100, 1),
+            "walking_minutes": round((hours_at[i + 1] - hours_at[i]) * 60, 1)
+        }
+        for i in range(len(bounds) - 1)
+    ]
+
+def analyze_profile(samples, elevations):
+    """
+    Computes the analytics of an elevation profile.
+
+    Args:
+        samples (list[dict]): {'lat', 'lng'} points along the route.
+        elevations (list[float]): Elevation in meters of each sample.
+    Returns:
+        dict: 'distance_km', 'grade_histogram', 'splits',
+            'steepest_climb', 'steepest_descent' (None when the route
+            has none) and 'estimated_minutes' by method.
+    """
+
+    distances = _distances(samples)
+    elevations = array("d", elevations)
+    lengths = array("d", (b - a for a, b in zip(distances, distances[1:])))
+    rises = array("d", (b - a for a, b in zip(elevations, elevations[1:])))
+
+    gains = array("d", accumulate((r if r > 0 else 0.0 for r in rises), initial = 0.0))
+    losses = array("d", accumulate((-r if r < 0 else 0.0 for r in rises), initial = 0.0))
+    hours = array("d", accumulate(map(_tobler_hours, lengths, rises), initial = 0.0))
+
+    total = distances[-1]
+    climb, descent = _steepest(distances, elevations, CLIMB_WINDOW_METERS)
+
+    return {
+        "distance_km": round(total / 1000, 3),
+        "grade_histogram": _grade_histogram(lengths, rises, total),
+        "splits": _splits(distances, elevations, gains, losses, hours) if total > 0 else [],
+        "steepest_climb": climb,
+        "steepest_descent": descent,
+        "estimated_minutes": {
+            "walking_naismith": round((total / 1000 / NAISMITH_SPEED_KMH + gains[-1] / NAISMITH_CLIMB_M_PER_HOUR) * 60, 1),
+            "walking_tobler": round(hours[-1] * 60, 1),
+            "cycling": round((total / 1000 / CYCLING_SPEED_KMH + gains[-1] / CYCLING_CLIMB_M_PER_HOUR) * 60, 1)
+        }
+    }
+
+def route_analytics(coordinates, step_meters = RESAMPLE_STEP_METERS, max_samples = RESAMPLE_MAX_SAMPLES):
+    """
+    Computes the analytics of a route, sampled the same way as
+    `process_route_internal` (so its elevations are already cached
+    after that call).
+
+    Args:
+        coordinates (list[dict]): List of {'lat': float, 'lng': float} points.
+    Returns:
+        tuple: (analytics dict, number of samples without an elevation).
+    """
+
+    with timed("route_analytics"):
+        samples = resample_route(coordinates, step_meters, max_samples)
+        get_elevations(samples, batch_size = 100)
+        elevations, missing = known_elevations(samples)
+        return analyze_profile(samples, elevations), missing
+
+
+
+# ===========================================================
+#                    Stored Analytics
+# ===========================================================
+def stored_analytics(connection, route_id):
+    """
+    Stored analytics of a route, or None when they need computing.
+    """
+
+    row = connection.execute(
+        "SELECT analytics FROM route_analytics WHERE route_id = ? AND version = ?",
+        (route_id, ANALYTICS_VERSION)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def store_analytics(connection, route_id, analytics):
+    """
+    Stores the analytics of a route (in the caller's transaction),
+    e.g. the ones `/get-route` computed, when the route is saved.
+    """
+
+    connection.execute(
+        "INSERT OR REPLACE INTO route_analytics (route_id, version, analytics) VALUES (?, ?, ?)",
+        (route_id, ANALYTICS_VERSION, json.dumps(analytics))
+    )
+
+def get_route_analytics(connection, route_id):
+    """
+    Analytics of a stored route: the ones stored when it was saved, or
+    computed on first use from its routed geometry (its key points
+    when that is not stored) and stored. Results with missing
+    elevations are returned but not stored, so they are computed again
+    once the elevation service answers.
+
+    Returns:
+        dict: The analytics, or None when the route does not exist.
+    """
+
+    analytics = stored_analytics(connection, route_id)
+    if analytics is not None:
+        return analytics
+
+    row = connection.execute("SELECT coordinates FROM routes WHERE id = ?", (route_id,)).fetchone()
+    if row is None:
+        return None
+
+    points, _ = route_points(connection, route_id, row[0])
+    analytics, missing = route_analytics(points)
+    if not missing and points:
+        with connection:
+            # Only if the coordinates did not change meanwhile
+            connection.execute(
+                """INSERT OR REPLACE INTO route_analytics (route_id, version, analytics)
+                SELECT id, ?, ? FROM routes WHERE id = ? AND coordinates = ?""",
+                (ANALYTICS_VERSION, json.dumps(analytics), route_id, row[0])
+            )
+    return analytics
@@ -9,65 +9,240 @@ This module includes:
     - Static map generation for route visualization
     - Route data processing (distance, elevation, etc.)
     - API route for calculating route metrics from coordinates
+
+The routes are registered on a blueprint by `create_app`, which builds
+the app from a config object (see config.py). `wsgi.py` holds the app
+served by gunicorn.
 """
 
 
+import gzip
 import json
+import logging
 import os
-from dotenv import load_dotenv
+import tempfile
+import threading
+import time
+import uuid
+import click
+import sqlite3
+from analytics import get_route_analytics, init_analytics_schema, route_analytics, store_analytics
+from backfill import backfill_elevations, init_backfill, init_backfill_schema
+from compression import init_compression
+from config import get_config
 from flask import (
+    Blueprint,
     current_app,
     Flask,
     flash,
+    g,
     jsonify,
     redirect,
     render_template,
     request,
+    Response,
     session,
+    stream_with_context,
     url_for,
 )
 
 from flask_cors import CORS
+from geometry import format_coordinates, GEOMETRY_FORMATS
+from heatmap import (
+    apply_heatmap_changes,
+    heatmap_json,
+    init_heatmap_schema,
+    load_heatmap_tile,
+    rebuild_heatmap,
+    render_cache,
+    render_png,
+    valid_heatmap_tile,
+)
 from helpers import (
-    allowed_files,
+    calculate_distance,
     close_connection,
+    DATABASE,
     generate_route_image,
+    get_local_router,
     get_realistic_route,
     get_country_from_coords,
+    get_db,
+    get_user,
+    invalidate_user,
     login_required,
+    optimize_stop_order,
     parse_float,
     process_route_internal,
+    process_routes_batch,
     query_db,
+    routing_backends,
+    valid_point,
     validate_coordinates,
 )
+from metrics import log_error, log_event, observe, render_prometheus
+from ordering import MAX_ORDER_POINTS
+from passwords import hash_password, init_passwords, needs_rehash, PasswordHasherBusy, verify_password
+from planning import claim_planned_route, init_planning_schema, save_planned_route, store_route_geometry
+from prefetch import cancel_prefetch, init_prefetch, submit_prefetch
+from profiler import init_profiler
+from rate_limit import client_key, init_rate_limit, rate_limited
+from segments import edit_route_geometry, EditConflict, init_segment_schema, InvalidEdit
+from sessions import init_sessions
+from similarity import (
+    ComputedRoutes,
+    DUPLICATE_THRESHOLD,
+    find_similar,
+    fingerprint,
+    index_fingerprints,
+    init_fingerprint_schema,
+    init_similarity,
+    remove_route_image,
+    request_indexing,
+    SIMILAR_THRESHOLD,
+    similar_to_route,
+)
+from startup import preload_modules, record_process_metrics, record_startup
+from stats import get_stats, init_stats, init_stats_schema, list_stats, reconcile_stats
+from tiles import get_tile, init_tile_schema, valid_tile
+from uploads import (
+    AVATAR_MAX_BYTES,
+    InvalidImage,
+    receive_upload,
+    remove_avatar,
+    set_avatar_when_done,
+    submit_avatar,
+)
+from routing import build_graph, RoutingError
+from route_io import (
+    allowed_import_file,
+    claim_job,
+    EXPORT_FORMATS,
+    EXPORTERS,
+    file_hash,
+    get_or_create_job,
+    import_routes_file,
+    init_import_schema,
+    iter_export_rows,
+    recalculate_routes,
+)
 
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)                       # Enables front-end and back-end communication
-app.secret_key = os.urandom(24) # Secure session encryption
+bp = Blueprint("main", __name__, cli_group = None)
+
+# Server-computed results of recent `/get-route` calls (see similarity.py)
+computed_routes = ComputedRoutes()
+
+
+
+# ===========================================================
+#                    Application Factory
+# ===========================================================
+def create_app(config = None):
+    """
+    Builds the Flask app: settings, database schemas, extensions and
+    the routes of this module.
+
+    Nothing here leaves a connection, thread or pool behind, so the app
+    can be built once in a gunicorn master (`--preload`) and forked
+    into workers. The routing, rendering and HTTP libraries are only
+    imported here with `PRELOAD_MODULES` (see startup.py).
+
+    Args:
+        config: Config class or object, or the name of one in
+            `config.CONFIGS`; `APP_CONFIG` when None.
+    Returns:
+        Flask: The app.
+    """
+
+    started = time.perf_counter()
+
+    app = Flask(__name__)
+    app.config.from_object(get_config(config))
+    CORS(app)                       # Enables front-end and back-end communication
+
+    logging.basicConfig(level = app.config['LOG_LEVEL'], format = "%(message)s")
+
+    init_sessions(app)
+    os.makedirs(app.config['ROUTE_IMAGE_FOLDER'], exist_ok = True)
+
+    # The connection is closed with the context, before any fork
+    app.teardown_appcontext(teardown)
+    with app.app_context():
+        init_import_schema(get_db())
+        init_segment_schema(get_db())
+        init_tile_schema(get_db())
+        init_heatmap_schema(get_db())
+        init_stats_schema(get_db())
+        init_planning_schema(get_db())
+        init_fingerprint_schema(get_db())
+        init_backfill_schema(get_db())
+        init_analytics_schema(get_db())
+
+    # Map the offline routing graph now, so workers forked from a preloaded app share it
+    if "local" in routing_backends():
+        try:
+            get_local_router()
+        except RoutingError as e:
+            log_error("routing_graph_unavailable", e)
+
+    init_profiler(app)
+    init_rate_limit(app)
+    init_passwords(app)
+    init_compression(app)
+    init_stats(app, DATABASE)
+    init_prefetch(app)
+    init_backfill(app, DATABASE)
+    init_similarity(app, DATABASE)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.register_blueprint(bp)
+
+    if app.config['PRELOAD_MODULES']:
+        preload_modules()
+
+    record_startup(time.perf_counter() - started)
+    return app
+
 
-load_dotenv()
 
-# Config paths and API keys
-UPLOAD_FOLDER = "static/images/users"
-ROUTE_IMAGE_FOLDER = "static/images/routes"
-ORS_API_KEY = os.getenv("ORS_API_KEY")
+def start_request():
+    """
+    Assigns a request id (reusing X-Request-ID when sent by a proxy)
+    and starts the request timer.
+    """
+
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+
+def finish_request(response):
+    """
+    Records the request latency and logs one structured line per request.
+    """
 
-# Flask app config
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ROUTE_IMAGE_FOLDER'] = ROUTE_IMAGE_FOLDER
-app.config['ORS_API_KEY'] = ORS_API_KEY
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        duration = time.perf_counter() - start
+        # View name without the blueprint, as before the app factory
+        endpoint = (request.endpoint or "unknown").rpartition(".")[2]
+        observe("http_request_duration_seconds", duration, endpoint = endpoint)
+        log_event(
+            "request",
+            method = request.method,
+            path = request.path,
+            status = response.status_code,
+            duration_ms = round(duration * 1000, 2)
+        )
 
-if not os.path.exists(app.config['ROUTE_IMAGE_FOLDER']):
-    os.makedirs(app.config['ROUTE_IMAGE_FOLDER'])
+    response.headers["X-Request-ID"] = getattr(g, "request_id", "")
+    return response
 
 
-@app.teardown_appcontext
 def teardown(exception):
     """
     Closes the database connection at the end of the request lifecycle.
@@ -78,7 +253,7 @@ def teardown(exception):
 # ===========================================================
 #                    Default Route
 # ===========================================================
-@app.route("/")
+@bp.route("/")
 def index():
     user_id = session.get("user_id") 
     return render_template("index.html", user_id = user_id)
@@ -88,7 +263,7 @@ def index():
 # ===========================================================
 #                    Authentication Routes
 # ===========================================================
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     """
     Handles user registration.
@@ -126,7 +301,7 @@ def register():
             flash("Username or email already exists!", "error")
             return redirect("/register")
 
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         default_image = "static/images/users/default_profile_image.png"
 
         query_db(
@@ -143,7 +318,7 @@ def register():
     return render_template("authentication/register.html")
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """
     Handles user login.
@@ -165,8 +340,21 @@ def login():
             (username,)
         )
 
-        if user and check_password_hash(user[0]["password"], password):
+        if user and verify_password(user[0]["password"], password):
+            session.rotate() # New session id after login
             session["user_id"] = user[0]["id"]
+
+            # Upgrade hashes made with older parameters while the password is at hand
+            if needs_rehash(user[0]["password"]):
+                try:
+                    query_db(
+                        "UPDATE users SET password = ? WHERE id = ?",
+                        (hash_password(password), user[0]["id"]),
+                        commit=True
+                    )
+                except PasswordHasherBusy:
+                    pass # Retried on the next login
+
             flash("Login successful!", "success")
             return redirect("/")
         else:
@@ -174,7 +362,25 @@ def login():
 
     return render_template("authentication/login.html")
 
-@app.route("/logout")
+@bp.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """
+    Asks the user to retry when too many password hashes are queued.
+    """
+
+    flash("The server is busy, please try again in a moment.", "error")
+    return redirect(request.path)
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def upload_too_large(error):
+    """
+    Rejects uploads over the size limit before they are read.
+    """
+
+    flash("The uploaded file is too large.", "error")
+    return redirect(request.path)
+
+@bp.route("/logout")
 @login_required
 def logout():
     """
@@ -190,83 +396,104 @@ def logout():
 # ===========================================================
 #                    Profile Management Routes
 # ===========================================================
-@app.route("/profile")
+@bp.route("/profile")
 @login_required
 def profile():
     """
     Displays the current user's profile.
     """
 
-    user = query_db(
-        "SELECT username, email, profile_picture FROM users WHERE id = ?",
-        (session["user_id"],)
-    )
+    user = get_user(session["user_id"])
 
     if not user:
         flash("User not found.", "error")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
     
-    return render_template("profile/profile.html", user = user)
+    return render_template(
+        "profile/profile.html",
+        user = user,
+        stats = get_stats(get_db(), "user", session["user_id"])
+        )
 
-@app.route("/profile/edit", methods=["GET", "POST"])
+@bp.route("/profile/edit", methods=["GET", "POST"])
 @login_required
 def edit_profile():
     """
     Allows the user to update profile details and upload a new profile picture.
     """
 
-    user = query_db(
-        "SELECT username, email, profile_picture FROM users WHERE id = ?",
-        (session["user_id"],)
-    )
+    # Changes are compared against the stored record, not a cached copy
+    if request.method == "POST":
+        invalidate_user(session["user_id"])
+    user = get_user(session["user_id"])
 
     if not user:
         flash("User not found.", "error")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     if request.method == "POST":
+        # Avatars need far less than the app-wide upload limit
+        request.max_content_length = AVATAR_MAX_BYTES + 64 * 1024
+
         username = request.form.get("username").strip()
         email = request.form.get("email").strip()
         file = request.files.get("profile_picture")
 
         if not username or not email:
             flash("Username and email are required.", "error")
-            return redirect(url_for("edit_profile"))
+            return redirect(url_for("main.edit_profile"))
 
         no_changes = (
-            username == user[0]["username"] and
-            email == user[0]["email"] and
+            username == user["username"] and
+            email == user["email"] and
             (not file or file.filename == "")
         )
 
         if no_changes:
             flash("No changes detected.", "info")
-            return redirect(url_for("edit_profile"))
+            return redirect(url_for("main.edit_profile"))
         
-        # Save new profile picture if uploaded
-        if file and allowed_files(file.filename):
-            file_name = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_name).replace("\\", "/")
-            file.save(file_path)
+        # Save new profile picture if uploaded (checked by content, stored by content hash)
+        if file and file.filename != "":
+            try:
+                upload_path, content_hash = receive_upload(file)
+            except InvalidImage as e:
+                flash(str(e), "error")
+                return redirect(url_for("main.edit_profile"))
 
-            query_db(
-                "UPDATE users SET username = ?, email = ?, profile_picture = ? WHERE id = ?",
-                (username, email, file_path, session["user_id"]),
-                commit = True
-            )
-        else:
-            query_db(
-                "UPDATE users SET username = ?, email = ? WHERE id = ?",
-                (username, email, session["user_id"]),
-                commit = True
-            )
+            future = submit_avatar(upload_path, content_hash, current_app.config['UPLOAD_FOLDER'])
+
+            if current_app.config['AVATAR_ASYNC']:
+                set_avatar_when_done(future, session["user_id"], user["profile_picture"])
+                flash("Your new profile picture is being processed.", "info")
+            else:
+                try:
+                    avatar = future.result()
+                except InvalidImage as e:
+                    flash(str(e), "error")
+                    return redirect(url_for("main.edit_profile"))
+
+                query_db(
+                    "UPDATE users SET profile_picture = ? WHERE id = ?",
+                    (avatar, session["user_id"]),
+                    commit = True
+                )
+                if avatar != user["profile_picture"]:
+                    remove_avatar(get_db(), user["profile_picture"])
+
+        query_db(
+            "UPDATE users SET username = ?, email = ? WHERE id = ?",
+            (username, email, session["user_id"]),
+            commit = True
+        )
+        invalidate_user(session["user_id"])
 
         flash("Profile updated successfully!", "success")
-        return redirect(url_for("profile"))
+        return redirect(url_for("main.profile"))
 
     return render_template("/profile/edit_profile.html", user = user)
 
-@app.route("/profile/delete", methods=["GET", "POST"])
+@bp.route("/profile/delete", methods=["GET", "POST"])
 @login_required
 def delete_account():
     """
@@ -298,10 +525,9 @@ def delete_account():
             (user_id,)
         )
 
-        #  Delete comments of those routes and remove associated images 
+        #  Delete comments of those routes 
         for route in user_routes:
             rid = route[0]  # id
-            map_image_url = route[1]  # map_image_url
             # Delete comments on this route
             query_db(
                 "DELETE FROM comments WHERE route_id = ?", 
@@ -309,28 +535,12 @@ def delete_account():
                 commit=True
             )
 
-            # Delete associated image file if it exists
-            if map_image_url:
-                image_path = os.path.join(app.config['ROUTE_IMAGE_FOLDER'], map_image_url)
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-                else:
-                    print(f"File does not exist: {image_path}", flush=True)
-
         #  Delete the user's profile picture if it exists 
         user = query_db(
             "SELECT profile_picture FROM users WHERE id = ?",
             (user_id,)
         )
 
-        if user and user[0][0]:  # profile_picture path
-            profile_picture_path = user[0][0]
-            # Only delete if it's not a default avatar
-            if os.path.exists(profile_picture_path):
-                os.remove(profile_picture_path)
-            else:
-                print(f"Profile picture does not exist: {profile_picture_path}")
-
         #  Delete the user's routes 
         query_db(
             "DELETE FROM routes WHERE user_id = ?", 
@@ -338,6 +548,10 @@ def delete_account():
             commit = True
         )
 
+        # Remove their images once deleted (routes of other users may reuse one)
+        for route in user_routes:
+            remove_route_image(get_db(), route[1], current_app.config['ROUTE_IMAGE_FOLDER'])
+
         #  Delete the user record 
         query_db(
             "DELETE FROM users WHERE id = ?", 
@@ -345,14 +559,19 @@ def delete_account():
             commit = True
         )
 
+        # Remove the picture once no user refers to it (never the default one)
+        if user and user[0][0]:
+            remove_avatar(get_db(), user[0][0])
+
+        invalidate_user(user_id)
         session.pop("user_id", None)
         flash("Your account have been deleted successfully!", "success")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     return render_template("/profile/delete_profile.html")
 
 
-@app.route("/profile/change-password", methods=["GET", "POST"])
+@bp.route("/profile/change-password", methods=["GET", "POST"])
 @login_required
 def change_password():
     """
@@ -365,7 +584,7 @@ def change_password():
 
         if not current_password or not new_password or not confirm_password:
             flash("All fields are required.", "error")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("main.change_password"))
 
         user = query_db(
             "SELECT password FROM users WHERE id = ?",
@@ -374,40 +593,40 @@ def change_password():
 
         if not user:
             flash("User not found.", "error")
-            return redirect(url_for("profile"))
+            return redirect(url_for("main.profile"))
 
         # Verify current password
-        if not check_password_hash(user[0]["password"], current_password):
+        if not verify_password(user[0]["password"], current_password):
             flash("Current password is incorrect.", "error")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("main.change_password"))
 
         # Check new password matches confirmation
         if new_password != confirm_password:
             flash("New passwords do not match.", "error")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("main.change_password"))
         
         if len(new_password) < 8:
             flash("New password must be at least 8 characters long.", "error")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("main.change_password"))
 
-        # Prevent reusing the old password
-        if check_password_hash(user[0]["password"], new_password):
+        # Prevent reusing the old password (already verified above, no need to hash again)
+        if new_password == current_password:
             flash("New password must be different from the current password.", "error")
-            return redirect(url_for("change_password"))
+            return redirect(url_for("main.change_password"))
 
         query_db(
             "UPDATE users SET password = ? WHERE id = ?",
-            (generate_password_hash(new_password), session["user_id"]),
+            (hash_password(new_password), session["user_id"]),
             commit=True
         )
 
         flash("Password updated successfully!", "success")
-        return redirect(url_for("profile"))
+        return redirect(url_for("main.profile"))
 
     return render_template("/profile/change_password.html")
 
 
-@app.route("/my-routes")
+@bp.route("/my-routes")
 @login_required
 def my_routes():
     """
@@ -425,7 +644,7 @@ def my_routes():
 # ===========================================================
 #                    Route Routes
 # ===========================================================
-@app.route("/create", methods=["GET", "POST"])
+@bp.route("/create", methods=["GET", "POST"])
 @login_required
 def create_route():
     """
@@ -446,46 +665,82 @@ def create_route():
         validated_coords = validate_coordinates(raw_coordinates)
         coordinates = json.dumps(validated_coords)
         
-        # Parse numeric data
-        total_distance = parse_float(request.form.get("total_distance", ""))
-        elevation_gain = parse_float(request.form.get("elevation_gain", ""))
-        elevation_loss = parse_float(request.form.get("elevation_loss", ""))
-        max_elevation = parse_float(request.form.get("max_elevation", ""))
-        min_elevation = parse_float(request.form.get("min_elevation", ""))
-        avg_elevation = parse_float(request.form.get("avg_elevation", ""))
-
-        image_filename = request.form.get("map_image_url")
-        country = request.form.get("country", "").strip()
-
         if not name or not coordinates:
             flash("Name and coordinates are required.", "error")
             return redirect("/create")
-        
-        query_db(
-            """
-            INSERT INTO routes (
-                user_id, name, description, coordinates, 
-                elevation_gain, elevation_loss, max_elevation, 
-                min_elevation, avg_elevation, total_distance, 
-                map_image_urL, country
-            ) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                session["user_id"], name, description, coordinates,
-                elevation_gain, elevation_loss, max_elevation,
-                min_elevation, avg_elevation, total_distance, 
-                image_filename, country
-                ),
-                commit = True
-                )
+
+        db = get_db()
+
+        # What /get-route computed for this route, if the form carries its token
+        planned = claim_planned_route(db, request.form.get("route_token"), session["user_id"])
+        if planned:
+            details = planned["details"]
+            total_distance = details["total_distance"]
+            elevation_gain = details["elevation_gain"]
+            elevation_loss = details["elevation_loss"]
+            max_elevation = details["max_elevation"]
+            min_elevation = details["min_elevation"]
+            avg_elevation = details["average_elevation"]
+            image_filename = details.get("map_image_url")
+        else:
+            # Parse numeric data
+            total_distance = parse_float(request.form.get("total_distance", ""))
+            elevation_gain = parse_float(request.form.get("elevation_gain", ""))
+            elevation_loss = parse_float(request.form.get("elevation_loss", ""))
+            max_elevation = parse_float(request.form.get("max_elevation", ""))
+            min_elevation = parse_float(request.form.get("min_elevation", ""))
+            avg_elevation = parse_float(request.form.get("avg_elevation", ""))
+            image_filename = request.form.get("map_image_url")
+
+        country = request.form.get("country", "").strip()
+
+        # Look for the same route before it is stored (and matches itself),
+        # fingerprinted like the index: on the routed geometry when known
+        signature = (planned and planned["signature"]) or fingerprint(
+            planned["geometry"] if planned else validated_coords
+        )[0]
+        duplicates = find_similar(db, signature, DUPLICATE_THRESHOLD, limit = 1)
+
+        with db:
+            route_id = db.execute(
+                """
+                INSERT INTO routes (
+                    user_id, name, description, coordinates, 
+                    elevation_gain, elevation_loss, max_elevation, 
+                    min_elevation, avg_elevation, total_distance, 
+                    map_image_urL, country
+                ) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    session["user_id"], name, description, coordinates,
+                    elevation_gain, elevation_loss, max_elevation,
+                    min_elevation, avg_elevation, total_distance, 
+                    image_filename, country
+                    )
+                ).lastrowid
+
+            if planned:
+                store_route_geometry(db, route_id, planned["geometry"])
+                if planned["details"].get("analytics"):
+                    store_analytics(db, route_id, planned["details"]["analytics"])
+
+        update_heatmap()
+        request_indexing()
+
+        if duplicates:
+            flash(
+                f"This route looks like \"{duplicates[0]['name']}\" "
+                f"({round(duplicates[0]['similarity'] * 100)}% similar).",
+                "info"
+            )
         
         flash("Route created successfully!", "success")
         return redirect("/routes")
 
     return render_template("routes/create_route.html")
 
-@app.route("/routes")
+@bp.route("/routes")
 @login_required
 def all_routes():
     """
@@ -506,7 +761,7 @@ def all_routes():
         user_id = user_id
         )
 
-@app.route("/route/<int:route_id>")
+@bp.route("/route/<int:route_id>")
 @login_required
 def view_route(route_id):
     """
@@ -553,7 +808,7 @@ def view_route(route_id):
         end_point = end_point
         )
 
-@app.route("/route/<int:route_id>/edit", methods=["GET", "POST"])
+@bp.route("/route/<int:route_id>/edit", methods=["GET", "POST"])
 @login_required
 def edit_route(route_id):
     """
@@ -571,7 +826,7 @@ def edit_route(route_id):
 
         if not route:
             flash("Route not found or you do not have permission to edit it.", "error")
-            return redirect(url_for("all_routes"))
+            return redirect(url_for("main.all_routes"))
     
         return render_template(
             "routes/edit_route.html", 
@@ -592,7 +847,7 @@ def edit_route(route_id):
 
         if not name or not coordinates:
             flash("Name and coordinates are required.", "error")
-            return redirect(url_for("edit_route", route_id=route_id))
+            return redirect(url_for("main.edit_route", route_id=route_id))
 
         query_db(
             """UPDATE routes SET
@@ -614,11 +869,49 @@ def edit_route(route_id):
              route_id, session["user_id"]),
             commit = True
         )
+        update_heatmap()
+        request_indexing()
 
         flash("Route updated successfully!", "success")
-        return redirect(url_for("all_routes"))
+        return redirect(url_for("main.all_routes"))
 
-@app.route("/route/<int:route_id>/delete", methods=["GET", "POST"])
+@bp.route("/route/<int:route_id>/geometry", methods=["POST"])
+@login_required
+def edit_route_geometry_api(route_id):
+    """
+    Applies a vertex diff to a route and recomputes its metrics
+    for the changed segments only (see segments.py).
+
+    Expects {"changes": [{"op": "move" | "insert" | "remove",
+    "index": i, "lat": .., "lng": ..}, ...], "expected_points": n}.
+    """
+
+    data = request.get_json(silent = True) or {}
+
+    try:
+        result = edit_route_geometry(
+            get_db(),
+            route_id,
+            session["user_id"],
+            data.get("changes"),
+            expected_points = data.get("expected_points")
+        )
+    except InvalidEdit as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except EditConflict as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+
+    if result is None:
+        return jsonify({
+            "status": "error",
+            "message": "Route not found or permission denied"
+        }), 404
+
+    update_heatmap()
+    request_indexing()
+    return jsonify({"status": "success", **result})
+
+@bp.route("/route/<int:route_id>/delete", methods=["GET", "POST"])
 @login_required
 def delete_route(route_id):
     """
@@ -635,7 +928,7 @@ def delete_route(route_id):
 
     if not route:
         flash("Route not found or permission denied.", "error")
-        return redirect(url_for("all_routes"))
+        return redirect(url_for("main.all_routes"))
     
     map_image_url = route[0]["map_image_url"] or ""
     
@@ -647,12 +940,6 @@ def delete_route(route_id):
             commit = True
         )
 
-        # Delete associated image file
-        if map_image_url:
-            image_path = os.path.join(app.config['ROUTE_IMAGE_FOLDER'], map_image_url)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-
         query_db(
             """DELETE FROM routes WHERE 
             id = ? AND 
@@ -660,9 +947,13 @@ def delete_route(route_id):
             (route_id, session["user_id"]),
             commit=True
         )
+        update_heatmap()
+
+        # Delete associated image file, unless a duplicate route reuses it
+        remove_route_image(get_db(), map_image_url, current_app.config['ROUTE_IMAGE_FOLDER'])
 
         flash("Route deleted successfully!", "success")
-        return redirect(url_for("all_routes"))
+        return redirect(url_for("main.all_routes"))
 
     
     return render_template(
@@ -673,10 +964,157 @@ def delete_route(route_id):
 
 
 
+# ===========================================================
+#                    Route Import
+# ===========================================================
+@bp.route("/routes/import", methods=["GET", "POST"])
+@login_required
+def import_routes():
+    """
+    Bulk import of routes from GPX, GeoJSON, KML or .zip archives.
+
+    GET: Renders the upload form and the user's import jobs.
+    POST: Stores the upload and starts the import in the background.
+          Uploading a file that was partially imported resumes it.
+    """
+
+    user_id = session["user_id"]
+
+    if request.method == "POST":
+        file = request.files.get("routes_file")
+
+        if not file or file.filename == "" or not allowed_import_file(file.filename):
+            flash("Please upload a .gpx, .geojson, .kml or .zip file.", "error")
+            return redirect(url_for("main.import_routes"))
+
+        filename = secure_filename(file.filename)
+        fd, temp_path = tempfile.mkstemp(suffix = "_" + filename)
+        os.close(fd)
+        file.save(temp_path)
+
+        job = get_or_create_job(get_db(), user_id, filename, file_hash(temp_path))
+        if job["status"] == "done":
+            os.remove(temp_path)
+            flash("This file has already been imported.", "info")
+            return redirect(url_for("main.import_routes"))
+
+        # Only one worker may run (or resume) the job
+        if not claim_job(get_db(), job["id"]):
+            os.remove(temp_path)
+            flash("This file is already being imported.", "info")
+            return redirect(url_for("main.import_routes"))
+
+        threading.Thread(
+            target = import_routes_file,
+            args = (user_id, temp_path, filename),
+            kwargs = {
+                "remove_after": True,
+                "claimed": True,
+                "with_images": True,
+                "image_folder": current_app.config["ROUTE_IMAGE_FOLDER"]
+            },
+            daemon = True
+        ).start()
+
+        flash("Import started. Progress is shown below.", "success")
+        return redirect(url_for("main.import_routes"))
+
+    jobs = query_db(
+        "SELECT * FROM import_jobs WHERE user_id = ? ORDER BY id DESC",
+        (user_id,)
+    )
+    return render_template("routes/import_routes.html", jobs = jobs)
+
+@bp.route("/routes/import/<int:job_id>")
+@login_required
+def import_status(job_id):
+    """
+    Returns the progress of an import job as JSON.
+    """
+
+    job = query_db(
+        "SELECT * FROM import_jobs WHERE id = ? AND user_id = ?",
+        (job_id, session["user_id"])
+    )
+
+    if not job:
+        return jsonify({
+            "status": "error",
+            "message": "Import job not found"
+        }), 404
+
+    return jsonify({
+        "status": "success",
+        "job": dict(job[0])
+    })
+
+
+
+# ===========================================================
+#                    Route Export
+# ===========================================================
+def export_response(export_format, filename, where = "", args = ()):
+    """
+    Builds a streaming download of the selected routes.
+    Rows are converted while being read from the cursor,
+    so the first bytes are sent before the query is exhausted.
+    """
+
+    if export_format not in EXPORTERS:
+        flash("Unsupported export format.", "error")
+        return redirect(url_for("main.all_routes"))
+
+    body = EXPORTERS[export_format](iter_export_rows(where, args))
+
+    return Response(
+        stream_with_context(body),
+        mimetype = EXPORT_FORMATS[export_format],
+        headers = {
+            "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+        }
+    )
+
+@bp.route("/route/<int:route_id>/export.<export_format>")
+@login_required
+def export_route(route_id, export_format):
+    """
+    Downloads a single route as GeoJSON or GPX.
+    """
+
+    if not query_db("SELECT id FROM routes WHERE id = ?", (route_id,)):
+        flash("Route not found.", "error")
+        return redirect("/routes")
+
+    return export_response(
+        export_format, f"route_{route_id}", "routes.id = ?", (route_id,)
+    )
+
+@bp.route("/my-routes/export.<export_format>")
+@login_required
+def export_my_routes(export_format):
+    """
+    Downloads all routes of the logged-in user as GeoJSON or GPX.
+    """
+
+    return export_response(
+        export_format, "my_routes", "routes.user_id = ?", (session["user_id"],)
+    )
+
+@bp.route("/routes/export.<export_format>")
+@login_required
+def export_all_routes(export_format):
+    """
+    Downloads the whole route catalogue as GeoJSON or GPX.
+    """
+
+    return export_response(export_format, "all_routes")
+
+
+
 # ===========================================================
 #                    Comment Routes
 # ===========================================================
-@app.route("/route/<int:route_id>/comment", methods=["POST"])
+@bp.route("/route/<int:route_id>/comment", methods=["POST"])
 @login_required
 def post_comment(route_id):
     """
@@ -690,7 +1128,7 @@ def post_comment(route_id):
 
     if not comment:
         flash("Comment cannot be empty.", "error")
-        return redirect(url_for("view_route", route_id = route_id))
+        return redirect(url_for("main.view_route", route_id = route_id))
 
     query_db(
         """INSERT INTO comments 
@@ -701,9 +1139,9 @@ def post_comment(route_id):
     )
 
     flash("Comment added successfully!", "success")
-    return redirect(url_for("view_route", route_id = route_id))
+    return redirect(url_for("main.view_route", route_id = route_id))
 
-@app.route("/route/<int:route_id>/comment/<int:comment_id>/edit", methods = ["GET", "POST"])
+@bp.route("/route/<int:route_id>/comment/<int:comment_id>/edit", methods = ["GET", "POST"])
 @login_required
 def edit_comment(route_id, comment_id):
     """
@@ -725,7 +1163,7 @@ def edit_comment(route_id, comment_id):
 
     if not comment:
         flash("Comment not found or you do not have permission to edit it.", "error")
-        return redirect(url_for("view_route", route_id = route_id))
+        return redirect(url_for("main.view_route", route_id = route_id))
     
     if request.method == "POST":
         new_comment = request.form.get("comment").strip()
@@ -734,7 +1172,7 @@ def edit_comment(route_id, comment_id):
             flash("Comment can not be empty.", "error")
             return redirect(
                 url_for(
-                    "edit_comment", 
+                    "main.edit_comment", 
                     route_id = route_id, 
                     comment_id = comment_id
                     )
@@ -747,7 +1185,7 @@ def edit_comment(route_id, comment_id):
         )
 
         flash("Comment updated succesfully!", "success")
-        return redirect(url_for("view_route", route_id = route_id))
+        return redirect(url_for("main.view_route", route_id = route_id))
     
     return render_template(
         "/routes/edit_comment.html", 
@@ -756,7 +1194,7 @@ def edit_comment(route_id, comment_id):
         comment_id = comment_id
         )
 
-@app.route("/route/<int:route_id>/comment/<int:comment_id>/delete", methods = ["GET", "POST"])
+@bp.route("/route/<int:route_id>/comment/<int:comment_id>/delete", methods = ["GET", "POST"])
 @login_required
 def delete_comment(route_id, comment_id):
     """
@@ -776,7 +1214,7 @@ def delete_comment(route_id, comment_id):
 
     if not comment:
         flash("Comment not found or you do not have permission to delete it.", "error")
-        return redirect(url_for("view_route", route_id = route_id))
+        return redirect(url_for("main.view_route", route_id = route_id))
     
     if request.method == "POST":
         query_db(
@@ -788,7 +1226,7 @@ def delete_comment(route_id, comment_id):
         flash("Comment deleted successfully!", "success")
         return redirect(
             url_for(
-                "view_route", 
+                "main.view_route", 
                 route_id = route_id
                 )
             )
@@ -805,12 +1243,58 @@ def delete_comment(route_id, comment_id):
 # ===========================================================
 #                    Route Data Profile
 # ===========================================================
-@app.route('/get-route', methods=['POST'])
+def _request_points():
+    """
+    Number of coordinates sent to /get-route, used to price the request.
+    """
+
+    data = request.get_json(silent = True) or {}
+    coordinates = data.get("coordinates")
+    return len(coordinates) if isinstance(coordinates, list) else 0
+
+def _batch_points():
+    """
+    Total number of coordinates sent to /get-routes.
+    """
+
+    data = request.get_json(silent = True) or {}
+    routes = data.get("routes")
+    if not isinstance(routes, list):
+        return 0
+    return sum(
+        len(r.get("coordinates", []) if isinstance(r, dict) else r)
+        for r in routes if isinstance(r, (dict, list))
+    )
+
+@bp.route('/get-route', methods=['POST'])
+@rate_limited(_request_points)
 def get_route():
     """
     Processes incoming route coordinates and returns calculated route metrics.
     Uses realistic routing for geocoded routes (with or without waypoints),
     and treats drawn routes as custom polylines.
+
+    The returned geometry is a list of {lat, lng} objects unless the
+    client asks for `"geometry_format": "flat"` or `"polyline"`.
+
+    With `"optimize_order": true` the stops between the first and the
+    last coordinate are reordered to shorten a geocoded route, by
+    straight-line distance or, with `"order_metric": "duration"`, by
+    routed travel time. The response then includes `waypoint_order`,
+    the indexes of the sent coordinates in visiting order.
+
+    Stored routes covering mostly the same cells are listed in
+    `similar_routes` (`duplicate_of` names a likely duplicate). When
+    this worker recently computed a nearly identical route, its
+    elevation metrics, analytics and map image are reused (`reused`)
+    instead of being looked up and rendered again.
+
+    `analytics` holds the grade histogram, per-km splits, steepest
+    100 m and time estimates of the route (see `analytics.py`).
+
+    For a logged-in user the routed geometry, metrics and analytics are
+    kept under `route_token`; `/create` stores them with the route when
+    the form sends that token back (see `planning.py`).
     """
     
     try:
@@ -819,12 +1303,20 @@ def get_route():
         waypoints = data.get('waypoints', [])
         mode = data.get('mode', 'foot-walking')
         route_type = data.get('type', 'geocoded')
+        geometry_format = data.get('geometry_format', 'objects')
+        optimize_order = data.get('optimize_order') is True
+        order_metric = data.get('order_metric', 'distance')
+
+        if geometry_format not in GEOMETRY_FORMATS:
+            return jsonify({
+                "status": "error",
+                "message": f"geometry_format must be one of {', '.join(GEOMETRY_FORMATS)}"
+            }), 400
 
         # Validate coordinates
         if (not coordinates or not 
             all(isinstance(coord, dict) and 
-                'lat' in coord and 
-                'lng' in coord 
+                valid_point(coord.get('lat'), coord.get('lng')) 
                 for coord in coordinates)
                 ):
             return jsonify({
@@ -835,8 +1327,7 @@ def get_route():
         # Validate waypoints
         if (waypoints and not 
             all(isinstance(wp, dict) and 
-                'lat' in wp and 
-                'lng' in wp 
+                valid_point(wp.get('lat'), wp.get('lng')) 
                 for wp in waypoints)
                 ):
             return jsonify({
@@ -844,9 +1335,38 @@ def get_route():
                 "message": "Invalid waypoints format"
             }), 400
 
+        if optimize_order and order_metric not in ("distance", "duration"):
+            return jsonify({
+                "status": "error",
+                "message": "order_metric must be 'distance' or 'duration'"
+            }), 400
+
+        if optimize_order and len(coordinates) > MAX_ORDER_POINTS:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_ORDER_POINTS} coordinates can be reordered"
+            }), 400
+
+        order_details = {}
+
         # Geocoded mode (routing)
         if route_type == "geocoded":
             api_key = current_app.config["ORS_API_KEY"]
+
+            # Visit the stops in the shortest order found
+            if optimize_order:
+                order, order_metric = optimize_stop_order(
+                    coordinates,
+                    api_key,
+                    profile = mode,
+                    metric = order_metric,
+                    time_budget = current_app.config["ROUTE_ORDER_TIME_BUDGET"]
+                )
+                coordinates = [coordinates[i] for i in order]
+                order_details = {
+                    "waypoint_order": order,
+                    "order_metric": order_metric
+                }
             
             try:
                 route_geometry = get_realistic_route(
@@ -872,17 +1392,52 @@ def get_route():
         elif route_type == "drawn":
             waypoints = []
 
-        # Calculate route metrics
-        route_details = process_route_internal(coordinates)
+        # A near-identical route computed here already has the elevation and the image.
+        # The signature (~0.2 s for a 600 km route) is kept for /create with route_token.
+        signature, _ = fingerprint(coordinates)
+        similar = find_similar(get_db(), signature, limit = 5)
+        similar_details = {
+            "similar_routes": similar,
+            "duplicate_of": similar[0]["route_id"] if similar and similar[0]["similarity"] >= DUPLICATE_THRESHOLD else None,
+            "reused": False
+        }
+
+        route_details = find_reusable_route(signature)
+        if route_details:
+            route_details["total_distance"] = calculate_distance(coordinates)
+            similar_details["reused"] = True
+            log_event("route_reused", map_image_url = route_details["map_image_url"])
+        else:
+            # Calculate route metrics
+            route_details = process_route_internal(coordinates)
+
+            # Generate static map image
+            image_filename = generate_route_image(
+                validated_coords=[(coord['lat'], coord['lng']) for coord in coordinates],
+                waypoints=[(wp['lat'], wp['lng']) for wp in waypoints] if waypoints else [],
+                save_folder='static/images/routes'
+            )
 
-        # Generate static map image
-        image_filename = generate_route_image(
-            validated_coords=[(coord['lat'], coord['lng']) for coord in coordinates],
-            waypoints=[(wp['lat'], wp['lng']) for wp in waypoints] if waypoints else [],
-            save_folder='static/images/routes'
-        )
+            route_details["map_image_url"] = image_filename
 
-        route_details["map_image_url"] = image_filename
+            # Splits and grades, from the elevations cached above
+            try:
+                route_details["analytics"] = route_analytics(coordinates)[0]
+            except Exception as e:
+                log_error("route_analytics_failed", e)
+                route_details["analytics"] = None
+
+            if image_filename and route_details["analytics"] and not route_details["elevation_missing"]:
+                computed_routes.add(signature, route_details)
+
+        # Kept for /create, which only receives the key points
+        if "user_id" in session:
+            try:
+                route_details["route_token"] = save_planned_route(
+                    get_db(), session["user_id"], coordinates, route_details, signature
+                )
+            except Exception as e:
+                log_error("planned_route_failed", e)
 
         # Get country from first coordinate
         if coordinates and isinstance(coordinates[0], dict):
@@ -893,23 +1448,500 @@ def get_route():
 
         return jsonify({
             "status": "success",
-            "coordinates": coordinates,
+            "coordinates": format_coordinates(coordinates, geometry_format),
+            "coordinates_format": geometry_format,
             "country": country,
+            **order_details,
+            **similar_details,
             **route_details
         })
 
     except Exception as e:
-        print(f"Route error: {str(e)}")
+        log_error("get_route_failed", e)
         return jsonify({
             "status": "error",
             "message": f"Server error: {str(e)}"
         }), 500
 
+@bp.route('/prefetch-route', methods=['POST', 'DELETE'])
+@rate_limited(_request_points)
+def prefetch_route():
+    """
+    Starts warming the caches `/get-route` will read for a route that
+    is still being planned (see prefetch.py) and returns at once.
+
+    POST takes the body `/get-route` will receive (coordinates, mode,
+    optimize_order, order_metric) and replaces the caller's previous
+    prefetch. DELETE cancels it. Prefetches are priced like
+    `/get-route` calls, since they do the same routing and lookups.
+    """
+
+    if request.method == "DELETE":
+        cancel_prefetch(client_key())
+        return jsonify({"status": "cancelled"})
+
+    data = request.get_json(silent = True) or {}
+    coordinates = data.get('coordinates', [])
+    mode = data.get('mode', 'foot-walking')
+    optimize_order = data.get('optimize_order') is True
+    order_metric = data.get('order_metric', 'distance')
+
+    if (not isinstance(coordinates, list) or not 2 <= len(coordinates) <= MAX_ORDER_POINTS or not
+        all(isinstance(coord, dict) and
+            valid_point(coord.get('lat'), coord.get('lng'))
+            for coord in coordinates)
+            ):
+        return jsonify({
+            "status": "error",
+            "message": "Invalid coordinates format"
+        }), 400
+
+    if order_metric not in ("distance", "duration"):
+        return jsonify({
+            "status": "error",
+            "message": "order_metric must be 'distance' or 'duration'"
+        }), 400
+
+    result = submit_prefetch(
+        current_app.config,
+        client_key(),
+        coordinates,
+        current_app.config["ORS_API_KEY"],
+        profile = mode,
+        optimize_order = optimize_order,
+        order_metric = order_metric
+    )
+    return jsonify({"status": result}), 202 if result == "queued" else 200
+
+MAX_BATCH_ROUTES = 500
+
+@bp.route('/get-routes', methods=['POST'])
+@rate_limited(_batch_points)
+def get_routes():
+    """
+    Calculates metrics for many routes in one call.
+
+    Expects {"routes": [[{lat, lng}, ...], ...]} (or a list of
+    {"coordinates": [...]} objects). Shared coordinates are fetched
+    once for all routes. No routing, images or geocoding are done.
+    """
+
+    data = request.get_json(silent = True) or {}
+    routes = data.get("routes", [])
+
+    if not isinstance(routes, list) or not routes:
+        return jsonify({
+            "status": "error",
+            "message": "Expected a non-empty 'routes' list"
+        }), 400
+
+    if len(routes) > MAX_BATCH_ROUTES:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {MAX_BATCH_ROUTES} routes per request"
+        }), 400
+
+    routes = [r.get("coordinates", []) if isinstance(r, dict) else r for r in routes]
+
+    for coordinates in routes:
+        if (not isinstance(coordinates, list) or not coordinates or not
+            all(isinstance(coord, dict) and
+                valid_point(coord.get('lat'), coord.get('lng'))
+                for coord in coordinates)
+                ):
+            return jsonify({
+                "status": "error",
+                "message": "Invalid coordinates: expected numeric lat in [-90, 90] and lng in [-180, 180]"
+            }), 400
+
+    return jsonify({
+        "status": "success",
+        "routes": process_routes_batch(routes)
+    })
+
+
+
+# ===========================================================
+#                    Route Tiles
+# ===========================================================
+@bp.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+@login_required
+def route_tile(z, x, y):
+    """
+    Serves a Mapbox Vector Tile with the lines of all stored routes.
+    Tiles are cached gzipped on disk; clients that do not accept gzip
+    get them decompressed.
+    """
+
+    if not valid_tile(z, x, y, current_app.config['TILE_MAX_ZOOM']):
+        return jsonify({
+            "status": "error",
+            "message": "Tile out of range"
+        }), 404
+
+    data = get_tile(get_db(), z, x, y, current_app.config['TILE_CACHE_DIR'])
+
+    response = current_app.response_class(mimetype = "application/vnd.mapbox-vector-tile")
+    if "gzip" in request.accept_encodings:
+        response.set_data(data)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response.set_data(gzip.decompress(data))
+    response.vary.add("Accept-Encoding")
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['TILE_MAX_AGE']
+    return response
+
+
+
+# ===========================================================
+#                    Heatmap
+# ===========================================================
+def update_heatmap():
+    """
+    Folds the routes changed by this request into the heatmap grids.
+    A failure only delays the update: the changes stay queued.
+    """
+
+    try:
+        apply_heatmap_changes(get_db())
+    except Exception as e:
+        log_error("heatmap_update_failed", e)
+
+@bp.route("/heatmap/<int:z>/<int:x>/<int:y>.<heatmap_format>")
+@login_required
+def heatmap_tile(z, x, y, heatmap_format):
+    """
+    Serves one tile of the route density grid as a PNG overlay or as
+    sparse JSON cells. Responses carry an ETag, so unchanged tiles
+    cost a 304.
+    """
+
+    if heatmap_format not in ("png", "json") or not valid_heatmap_tile(z, x, y):
+        return jsonify({
+            "status": "error",
+            "message": "Heatmap tile not found"
+        }), 404
+
+    update_heatmap()
+    counts, etag, max_count = load_heatmap_tile(get_db(), z, x, y)
+
+    if heatmap_format == "json":
+        response = jsonify(heatmap_json(counts, max_count, z, x, y))
+        # Compressed after the view (see compression.py), 304s included
+        response.vary.add("Accept-Encoding")
+    else:
+        data = render_cache.get(etag)
+        if data is None:
+            data = render_png(counts, max_count)
+            render_cache.set(etag, data)
+        response = current_app.response_class(data, mimetype = "image/png")
+
+    response.set_etag(f"{etag}.{heatmap_format}")
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['HEATMAP_MAX_AGE']
+    return response.make_conditional(request)
+
+
+
+# ===========================================================
+#                    Statistics
+# ===========================================================
+@bp.route("/stats")
+@login_required
+def site_stats():
+    """
+    Totals of all routes (count, km, climb), read from the summary table.
+    """
+
+    return jsonify({"status": "success", **get_stats(get_db(), "global")})
+
+@bp.route("/stats/users/<int:user_id>")
+@login_required
+def user_stats(user_id):
+    """
+    Totals of one user's routes. Users only see their own.
+    """
+
+    if user_id != session["user_id"]:
+        return jsonify({"status": "error", "message": "Permission denied"}), 403
+
+    return jsonify({"status": "success", "user_id": user_id, **get_stats(get_db(), "user", user_id)})
+
+@bp.route("/stats/countries")
+@login_required
+def country_stats():
+    """
+    Totals per country, largest first (`?order_by=total_distance&limit=20`).
+    """
+
+    try:
+        countries = list_stats(
+            get_db(),
+            "country",
+            order_by = request.args.get("order_by", "route_count"),
+            limit = min(request.args.get("limit", 100, type = int), 500)
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return jsonify({
+        "status": "success",
+        "countries": [{"country": c.pop("key"), **c} for c in countries]
+    })
+
+@bp.route("/stats/countries/<country>")
+@login_required
+def single_country_stats(country):
+    """
+    Totals of the routes in one country.
+    """
+
+    return jsonify({"status": "success", "country": country, **get_stats(get_db(), "country", country)})
+
+
+
+# ===========================================================
+#                    Similar Routes
+# ===========================================================
+def find_reusable_route(signature):
+    """
+    Metrics, analytics and map image computed for a near-identical
+    route by this worker, if its image still exists.
+
+    Returns:
+        dict: A copy of the route details, or None.
+    """
+
+    details = computed_routes.find(signature)
+    if details is None or not os.path.exists(
+            os.path.join(current_app.config['ROUTE_IMAGE_FOLDER'], details["map_image_url"])):
+        return None
+    return details
+
+@bp.route("/route/<int:route_id>/similar")
+@login_required
+def similar_routes(route_id):
+    """
+    Routes that mostly follow the same streets as this one
+    (`?threshold=0.5&limit=10`).
+    """
+
+    threshold = request.args.get("threshold", SIMILAR_THRESHOLD, type = float)
+    limit = min(request.args.get("limit", 10, type = int), 100)
+    if not 0 < threshold <= 1:
+        return jsonify({"status": "error", "message": "threshold must be in (0, 1]"}), 400
+
+    if not query_db("SELECT 1 FROM routes WHERE id = ?", (route_id,)):
+        return jsonify({"status": "error", "message": "Route not found"}), 404
+
+    similar = similar_to_route(get_db(), route_id, threshold, limit)
+    if similar is None:
+        return jsonify({"status": "error", "message": "Route not indexed yet, try again"}), 503
+
+    return jsonify({"status": "success", "route_id": route_id, "similar_routes": similar})
+
+
+
+# ===========================================================
+#                    Route Analytics
+# ===========================================================
+@bp.route("/route/<int:route_id>/analytics")
+@login_required
+def route_analytics_api(route_id):
+    """
+    Grade histogram, per-km splits, steepest 100 m climb and descent,
+    and walking/cycling time estimates of a stored route: the ones
+    `/get-route` computed, stored when the route was saved, or else
+    computed on first request and stored until its coordinates change.
+    """
+
+    try:
+        analytics = get_route_analytics(get_db(), route_id)
+    except Exception as e:
+        log_error("route_analytics_failed", e, route_id = route_id)
+        return jsonify({"status": "error", "message": "Could not compute the route analytics"}), 500
+
+    if analytics is None:
+        return jsonify({"status": "error", "message": "Route not found"}), 404
+
+    return jsonify({"status": "success", "route_id": route_id, "analytics": analytics})
+
+
+
+# ===========================================================
+#                    Metrics
+# ===========================================================
+@bp.route("/metrics")
+def metrics():
+    """
+    Exposes stage latencies, cache hit counts, external error counts
+    and memory usage in the Prometheus text format (per worker process).
+    """
+
+    record_process_metrics()
+    return Response(render_prometheus(), mimetype = "text/plain; version=0.0.4")
+
+
+
+# ===========================================================
+#                    CLI Commands
+# ===========================================================
+@bp.cli.command("import-routes")
+@click.argument("path", type = click.Path(exists = True, dir_okay = False))
+@click.option("--user-id", type = int, required = True, help = "Owner of the imported routes.")
+@click.option("--batch-size", type = int, default = 50, show_default = True)
+@click.option("--images/--no-images", default = False, help = "Render a static map per route.")
+@click.option("--country/--no-country", default = False, help = "Reverse geocode each route (one Nominatim request each).")
+def import_routes_command(path, user_id, batch_size, images, country):
+    """
+    Imports every track of a GPX/GeoJSON/KML file or .zip archive.
+    Running it again on the same file resumes an interrupted import.
+    """
+
+    def progress(tracks_done, routes_created):
+        click.echo(f"{tracks_done} tracks read, {routes_created} routes created")
+
+    job = import_routes_file(
+        user_id,
+        path,
+        batch_size = batch_size,
+        with_images = images,
+        with_country = country,
+        image_folder = current_app.config["ROUTE_IMAGE_FOLDER"],
+        progress = progress
+    )
+
+    click.echo(f"Import {job['status']}: {job['routes_created']} routes created.")
+    if job["error"]:
+        click.echo(f"Error: {job['error']}", err = True)
+
+
+
+@bp.cli.command("recalculate-routes")
+@click.option("--user-id", type = int, default = None, help = "Only routes of this user.")
+@click.option("--batch-size", type = int, default = 200, show_default = True)
+def recalculate_routes_command(user_id, batch_size):
+    """
+    Recomputes elevation metrics (and the distance of routes with a
+    routed geometry) of stored routes, e.g. after changing the
+    elevation provider.
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        updated, skipped = recalculate_routes(
+            connection,
+            "user_id = ?" if user_id else "",
+            (user_id,) if user_id else (),
+            batch_size = batch_size,
+            progress = lambda n: click.echo(f"{n} routes updated")
+        )
+    finally:
+        connection.close()
+
+    click.echo(f"Done: {updated} routes recalculated.")
+    if skipped:
+        click.echo(f"Skipped {skipped} routes with missing elevation samples.")
 
 
 
+@bp.cli.command("build-routing-graph")
+@click.argument("extract", type = click.Path(exists = True, dir_okay = False))
+@click.argument("output", default = "routing.graph")
+def build_routing_graph_command(extract, output):
+    """
+    Builds the offline routing graph from an OSM XML extract
+    (.osm, .osm.gz or .osm.bz2). Enable it with ROUTING_BACKEND=local.
+    """
+
+    stats = build_graph(extract, output)
+    click.echo(f"{stats['nodes']} nodes written to {output}")
+    for profile, edges in stats["edges"].items():
+        click.echo(f"  {profile}: {edges} edges")
+
+
+
+@bp.cli.command("rebuild-heatmap")
+@click.option("--workers", type = int, default = None, help = "Processes (default: CPU count).")
+def rebuild_heatmap_command(workers):
+    """
+    Recomputes the route density heatmap from all stored routes.
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        routes, tiles = rebuild_heatmap(connection, workers)
+    finally:
+        connection.close()
+
+    click.echo(f"Done: {routes} routes rasterized into {tiles} tiles.")
+
+
+
+@bp.cli.command("reconcile-stats")
+def reconcile_stats_command():
+    """
+    Recomputes the materialized route statistics and fixes any drift.
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        corrected = reconcile_stats(connection)
+    finally:
+        connection.close()
+
+    click.echo(f"Done: {corrected} summary rows corrected.")
+
+
+
+@bp.cli.command("backfill-elevations")
+@click.option("--batch-size", type = int, default = 50, show_default = True)
+def backfill_elevations_command(batch_size):
+    """
+    Recomputes the elevation of routes saved without elevation data
+    (those due for a retry), batch after batch until none is left.
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        updated = retried = 0
+        while True:
+            done, failed = backfill_elevations(connection, limit = batch_size)
+            updated += done
+            retried += failed
+            if not done and not failed:
+                break
+            click.echo(f"{updated} routes updated, {retried} left for a retry")
+    finally:
+        connection.close()
+
+    click.echo(f"Done: {updated} routes backfilled, {retried} still without elevation.")
+
+
+
+@bp.cli.command("index-fingerprints")
+def index_fingerprints_command():
+    """
+    Fingerprints every route not indexed yet for similar-route lookups
+    (each worker's indexer thread otherwise drains the queue).
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        total = 0
+        while True:
+            indexed = index_fingerprints(connection, limit = 500)
+            if not indexed:
+                break
+            total += indexed
+            click.echo(f"{total} routes indexed")
+    finally:
+        connection.close()
+
+    click.echo(f"Done: {total} routes fingerprinted.")
 
 
 
 if __name__ == "__main__":
-    app.run(debug = True)
\ No newline at end of file
+    create_app("development").run(debug = True)
\ No newline at end of file
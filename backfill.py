@@ -0,0 +1,200 @@
+"""
+Backfill of routes saved without elevation data.
+
+When the elevation service is down, a route is saved with zero
+elevation metrics. The backfill looks for such routes and recomputes
+their elevation once the elevation lookups succeed again. It runs from
+a background thread in at most one worker per interval, and from
+`flask backfill-elevations`.
+
+Elevation is sampled along a route's routed geometry when one is
+stored (see planning.py), else along its stored points. Only the
+elevation columns are written; the stored distance is kept.
+
+Routes whose elevation still cannot be resolved are retried with an
+exponential backoff. A route resolved to a real zero elevation (e.g.
+at sea level) is remembered, so it is not looked up again until its
+coordinates change.
+"""
+
+
+import time
+
+from background import BackgroundJob
+from helpers import process_routes_batch
+from metrics import increment, log_event
+from planning import route_points
+from resilience import get_breaker
+
+
+
+DEFAULTS = {
+    "ELEVATION_BACKFILL_INTERVAL": 600,     # Seconds between runs; 0 disables
+}
+
+BACKFILL_BATCH_SIZE = 50
+RETRY_BASE_DELAY = 600                      # First retry after 10 minutes,
+RETRY_MAX_DELAY = 86400                     # doubling up to once a day
+
+BACKFILL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS elevation_backfill (
+    route_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_at REAL                           -- NULL once the elevation was resolved
+);
+
+CREATE TABLE IF NOT EXISTS elevation_backfill_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    ran_at REAL NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS elevation_backfill_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    DELETE FROM elevation_backfill WHERE route_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS elevation_backfill_on_delete
+AFTER DELETE ON routes
+BEGIN
+    DELETE FROM elevation_backfill WHERE route_id = OLD.id;
+END;
+"""
+
+# Routes with no elevation data that are due for a (re)try
+PENDING_ROUTES = """
+SELECT routes.id, routes.coordinates FROM routes
+LEFT JOIN elevation_backfill ON elevation_backfill.route_id = routes.id
+WHERE coalesce(CAST(routes.max_elevation AS REAL), 0) = 0
+    AND coalesce(CAST(routes.min_elevation AS REAL), 0) = 0
+    AND coalesce(CAST(routes.elevation_gain AS REAL), 0) = 0
+    AND (elevation_backfill.route_id IS NULL OR elevation_backfill.retry_at <= ?)
+ORDER BY routes.id
+LIMIT ?
+"""
+
+
+
+def init_backfill_schema(connection):
+    """
+    Creates the table tracking backfill attempts.
+    """
+
+    connection.executescript(BACKFILL_SCHEMA)
+    connection.execute("INSERT OR IGNORE INTO elevation_backfill_meta (id, ran_at) VALUES (1, 0)")
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Backfill
+# ===========================================================
+def backfill_elevations(connection, limit = BACKFILL_BATCH_SIZE):
+    """
+    Recomputes the elevation metrics of up to `limit` routes saved
+    without elevation. A route is only updated when every elevation
+    sample was resolved and its coordinates did not change meanwhile.
+
+    Returns:
+        tuple: (routes updated, routes left for a later retry).
+    """
+
+    if connection.in_transaction:
+        connection.commit()
+
+    now = time.time()
+    while True:
+        rows = connection.execute(PENDING_ROUTES, (now, limit)).fetchall()
+        if not rows:
+            return 0, 0
+        routes = [
+            (route_id, coordinates_json, route_points(connection, route_id, coordinates_json)[0])
+            for route_id, coordinates_json in rows
+        ]
+
+        # A route without a line has no elevation to find
+        skipped = [(route[0],) for route in routes if len(route[2]) < 2]
+        if skipped:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO elevation_backfill (route_id, attempts, retry_at) VALUES (?, 0, NULL)",
+                    skipped
+                )
+
+        routes = [route for route in routes if len(route[2]) >= 2]
+        if routes:
+            break
+
+    metrics = process_routes_batch([points for _, _, points in routes])
+
+    updated = retried = 0
+    with connection:
+        for (route_id, coordinates_json, _), m in zip(routes, metrics):
+            if m["elevation_missing"]:
+                attempts = connection.execute(
+                    "SELECT attempts FROM elevation_backfill WHERE route_id = ?", (route_id,)
+                ).fetchone()
+                attempts = attempts[0] + 1 if attempts else 1
+                delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+                connection.execute(
+                    "INSERT OR REPLACE INTO elevation_backfill (route_id, attempts, retry_at) VALUES (?, ?, ?)",
+                    (route_id, attempts, now + delay)
+                )
+                retried += 1
+                continue
+
+            changed = connection.execute(
+                """UPDATE routes SET
+                elevation_gain = ?,
+                elevation_loss = ?,
+                max_elevation = ?,
+                min_elevation = ?,
+                avg_elevation = ?
+                WHERE id = ? AND coordinates = ?""",
+                (
+                    m["elevation_gain"], m["elevation_loss"],
+                    m["max_elevation"], m["min_elevation"],
+                    m["average_elevation"], route_id, coordinates_json
+                )
+            ).rowcount
+            if changed:
+                connection.execute(
+                    "INSERT OR REPLACE INTO elevation_backfill (route_id, attempts, retry_at) VALUES (?, 0, NULL)",
+                    (route_id,)
+                )
+                updated += 1
+
+    increment("elevation_backfill_routes_total", updated, result = "updated")
+    increment("elevation_backfill_routes_total", retried, result = "retry")
+    log_event("elevation_backfill", updated = updated, retried = retried)
+    return updated, retried
+
+def backfill_if_due(connection, interval):
+    """
+    Runs one backfill batch unless another worker did so in the last
+    `interval` seconds or the elevation service is known to be down.
+    """
+
+    if get_breaker("opentopodata").is_open():
+        return None
+
+    claimed = connection.execute(
+        "UPDATE elevation_backfill_meta SET ran_at = ? WHERE id = 1 AND ran_at < ?",
+        (time.time(), time.time() - interval)
+    ).rowcount
+    connection.commit()
+    return backfill_elevations(connection) if claimed else None
+
+backfiller = BackgroundJob("elevation-backfill", backfill_if_due)
+
+def init_backfill(app, database):
+    """
+    Fills in the backfill settings and starts the backfill thread with
+    the first request of each worker.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    backfiller.init_app(app, database, app.config["ELEVATION_BACKFILL_INTERVAL"])
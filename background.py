@@ -0,0 +1,88 @@
+"""
+Periodic background jobs.
+
+A job runs in one daemon thread per worker process. The thread is
+started by the first request each worker serves, and the pid is checked
+so that it also runs in workers forked after the app was imported
+(threads do not survive a fork). Every run opens its own database
+connection, and the sleep between runs is jittered so the workers do not
+wake up together. Jobs that must run in one worker only claim their run
+in the database themselves (see `reconcile_if_due` in stats.py).
+"""
+
+
+import os
+import random
+import sqlite3
+import threading
+
+from metrics import log_error
+
+
+
+class BackgroundJob:
+    """
+    A function run every `interval` seconds in a background thread.
+
+    Args:
+        name (str): Thread name, also used in the error event
+            (`<name>_failed`).
+        job (callable): Called as `job(connection, interval)`.
+    """
+
+    def __init__(self, name, job):
+        self.name = name
+        self.job = job
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def _loop(self, database, interval):
+        while True:
+            # Jitter keeps the workers from waking up together
+            self._wake.wait(interval * random.uniform(0.5, 1.0))
+            self._wake.clear()
+            try:
+                connection = sqlite3.connect(database, timeout = 30)
+                try:
+                    self.job(connection, interval)
+                finally:
+                    connection.close()
+            except Exception as e:
+                log_error(f"{self.name.replace('-', '_')}_failed", e)
+
+    def start(self, database, interval):
+        """
+        Starts this process's thread, once per pid. Does nothing when
+        `interval` is 0.
+        """
+
+        if not interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(
+                target = self._loop,
+                args = (database, interval),
+                name = self.name,
+                daemon = True
+            ).start()
+
+    def wake(self):
+        """
+        Runs the job now instead of at its next interval, if this
+        worker's thread is started. Never blocks.
+        """
+
+        self._wake.set()
+
+    def init_app(self, app, database, interval):
+        """
+        Starts the thread with the first request of each worker,
+        unless `interval` is 0.
+        """
+
+        if interval:
+            app.before_request(lambda: self.start(database, interval))
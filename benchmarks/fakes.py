@@ -0,0 +1,191 @@
+"""
+Local stand-ins for every external service the app talks to.
+
+A single threaded HTTP server answers, with an optional artificial
+latency per service:
+    - OpenRouteService directions   POST /ors/v2/directions/<profile>/geojson
+    - OpenTopoData elevation        GET  /elevation?locations=lat,lng|...
+    - Nominatim reverse geocoding   GET  /nominatim/reverse
+    - Map tiles                     GET  /tiles/<z>/<x>/<y>.png
+
+`FakeServices.env()` returns the environment variables that point the
+app at the stand-ins (see the URL settings in `helpers` and `elevation`).
+"""
+
+
+import io
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+
+POINTS_PER_LEG = 50
+
+
+
+def fake_elevation(lat, lng):
+    """
+    Deterministic, smooth terrain so elevation stats are stable across runs.
+    """
+
+    return round(500 + 300 * math.sin(lat * 40) * math.cos(lng * 40), 1)
+
+def _tile_png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (256, 256), (230, 230, 220)).save(buffer, format = "PNG")
+    return buffer.getvalue()
+
+def _interpolate_legs(coordinates, points_per_leg = POINTS_PER_LEG):
+    """
+    Builds a fake routed geometry: each leg between consecutive input
+    points becomes `points_per_leg` points with a slight zig-zag.
+    """
+
+    geometry = []
+    for (lng1, lat1), (lng2, lat2) in zip(coordinates, coordinates[1:]):
+        for i in range(points_per_leg):
+            t = i / points_per_leg
+            wiggle = 0.0005 * math.sin(i)
+            geometry.append([lng1 + (lng2 - lng1) * t + wiggle, lat1 + (lat2 - lat1) * t])
+    geometry.append(coordinates[-1])
+    return geometry
+
+class FakeServices:
+    """
+    Runs the stand-in server in a background thread.
+
+    Args:
+        latency (dict|float): Seconds of delay per service
+            ('ors', 'elevation', 'nominatim', 'tiles'), or one value for all.
+        error_rate (float): Fraction of requests answered with HTTP 503.
+    """
+
+    SERVICES = ("ors", "elevation", "nominatim", "tiles")
+
+    def __init__(self, latency = 0.0, error_rate = 0.0, host = "127.0.0.1", port = 0):
+        if not isinstance(latency, dict):
+            latency = {service: latency for service in self.SERVICES}
+        self.latency = {service: latency.get(service, 0.0) for service in self.SERVICES}
+        self.error_rate = error_rate
+        self.requests = {service: 0 for service in self.SERVICES}
+        self._lock = threading.Lock()
+        self._tile = _tile_png()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """
+        Environment variables pointing the app at the stand-ins.
+        """
+
+        return {
+            "ORS_API_KEY": "fake-key",
+            "ORS_BASE_URL": f"{self.url}/ors",
+            "ELEVATION_API_URL": f"{self.url}/elevation",
+            "NOMINATIM_URL": f"{self.url}/nominatim/reverse",
+            "TILE_URL_TEMPLATE": f"{self.url}/tiles/{{z}}/{{x}}/{{y}}.png",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, service):
+        with self._lock:
+            self.requests[service] += 1
+            count = self.requests[service]
+        time.sleep(self.latency[service])
+        # Deterministic error injection: every 1/error_rate-th request fails
+        return bool(self.error_rate) and count % max(int(1 / self.error_rate), 1) == 0
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type = "application/json"):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+
+                if url.path.startswith("/elevation"):
+                    if services._count("elevation"):
+                        return self._send(503, {"error": "unavailable"})
+                    locations = query.get("locations", [""])[0].split("|")
+                    results = []
+                    for location in locations:
+                        lat, lng = (float(v) for v in location.split(","))
+                        results.append({
+                            "elevation": fake_elevation(lat, lng),
+                            "location": {"lat": lat, "lng": lng}
+                        })
+                    return self._send(200, {"results": results, "status": "OK"})
+
+                if url.path.startswith("/nominatim"):
+                    if services._count("nominatim"):
+                        return self._send(503, {"error": "unavailable"})
+                    return self._send(200, {"address": {"country": "Portugal"}})
+
+                if url.path.startswith("/tiles"):
+                    if services._count("tiles"):
+                        return self._send(503, b"", "image/png")
+                    return self._send(200, services._tile, "image/png")
+
+                self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+
+                if url.path.startswith("/ors/v2/directions"):
+                    if services._count("ors"):
+                        return self._send(503, {"error": "unavailable"})
+                    geometry = _interpolate_legs(payload.get("coordinates", []))
+                    return self._send(200, {
+                        "type": "FeatureCollection",
+                        "features": [{
+                            "type": "Feature",
+                            "properties": {},
+                            "geometry": {"type": "LineString", "coordinates": geometry}
+                        }]
+                    })
+
+                self._send(404, {"error": "not found"})
+
+        return Handler
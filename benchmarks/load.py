@@ -0,0 +1,347 @@
+"""
+Load-testing harness for sizing a gunicorn deployment.
+
+Starts the local service stand-ins (with configurable latency), a
+seeded database and the app under gunicorn, then runs concurrent
+virtual users through scripted journeys:
+
+    register -> login -> create route (/get-route + /create)
+             -> list routes -> view route -> comment
+
+and reports throughput and p50/p95/p99 latency per endpoint.
+
+Usage (from the repository root):
+    python -m benchmarks.load --users 20 --duration 60 --workers 4
+    python -m benchmarks.load --ors-latency 0.3 --elevation-latency 0.1
+    python -m benchmarks.load --target http://127.0.0.1:8000   # existing server
+"""
+
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from benchmarks.fakes import FakeServices
+from benchmarks.synthetic import seed_database, synthetic_route
+
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+
+# ===========================================================
+#                    Recording
+# ===========================================================
+class Recorder:
+    """
+    Collects (endpoint, latency, status) samples from all virtual users.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        return report
+
+def percentile(ordered, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+
+# ===========================================================
+#                    Virtual Users
+# ===========================================================
+class VirtualUser:
+    """
+    One browser-like client with its own cookie session.
+    Redirects are not followed, so every request is timed on its own.
+    """
+
+    def __init__(self, base_url, recorder, user_number, route_count, think_time):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.number = user_number
+        self.route_count = route_count
+        self.think_time = think_time
+        self.rng = random.Random(user_number)
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(
+                method, self.base_url + path, allow_redirects = False, timeout = 60, **kwargs
+            )
+            # A redirect to /login means the session was lost (e.g. the
+            # workers do not share a secret key), so count it as a failure
+            logged_out = response.headers.get("Location", "").endswith("/login")
+            ok = response.status_code < 400 and not (logged_out and endpoint != "POST /register")
+            return response
+        except requests.RequestException:
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok)
+            if self.think_time:
+                time.sleep(self.rng.uniform(0, self.think_time))
+
+    def register_and_login(self):
+        username = f"load_{os.getpid()}_{self.number}_{self.rng.randint(0, 10**9)}"
+        password = "load-test-password"
+        self.request("POST /register", "POST", "/register", data = {
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": password,
+        })
+        self.request("POST /login", "POST", "/login", data = {
+            "username": username,
+            "password": password,
+        })
+
+    def create_route(self):
+        start = (self.rng.uniform(37.0, 42.0), self.rng.uniform(-9.0, -6.5))
+        key_points = synthetic_route(3, seed = self.rng.randint(0, 10**6), start = start, step_meters = 2000)
+
+        response = self.request("POST /get-route", "POST", "/get-route", json = {
+            "coordinates": key_points,
+            "waypoints": key_points[1:-1],
+            "mode": "foot-walking",
+            "type": "geocoded",
+        })
+        if response is None or response.status_code != 200:
+            return
+
+        data = response.json()
+        self.request("POST /create", "POST", "/create", data = {
+            "name": f"Load test route {self.number}",
+            "description": "Created by the load-testing harness",
+            "coordinates": json.dumps([[p["lat"], p["lng"]] for p in key_points]),
+            "total_distance": data.get("total_distance", ""),
+            "elevation_gain": data.get("elevation_gain", ""),
+            "elevation_loss": data.get("elevation_loss", ""),
+            "max_elevation": data.get("max_elevation", ""),
+            "min_elevation": data.get("min_elevation", ""),
+            "avg_elevation": data.get("average_elevation", ""),
+            "map_image_url": data.get("map_image_url", ""),
+            "country": data.get("country", ""),
+        })
+
+    def browse(self):
+        self.request("GET /routes", "GET", "/routes")
+        route_id = self.rng.randint(1, self.route_count)
+        self.request("GET /route/<id>", "GET", f"/route/{route_id}")
+        self.request("POST /route/<id>/comment", "POST", f"/route/{route_id}/comment", data = {
+            "comment": "Great route!"
+        })
+
+    def run(self, deadline, create_ratio):
+        self.register_and_login()
+        while time.monotonic() < deadline:
+            if self.rng.random() < create_ratio:
+                self.create_route()
+            self.browse()
+
+
+
+# ===========================================================
+#                    Server
+# ===========================================================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(env, workdir, workers, threads, preload = False):
+    """
+    Starts the app under gunicorn and waits until it answers.
+    With `preload`, the app is built in the master before forking.
+    """
+
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--pythonpath", ROOT,
+            "--workers", str(workers),
+            "--threads", str(threads),
+            "--bind", f"127.0.0.1:{port}",
+            "--log-level", "warning",
+            *(["--preload"] if preload else []),
+            "wsgi:app",
+        ],
+        cwd = workdir,
+        env = env,
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(base_url + "/", timeout = 1)
+            return process, base_url
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+
+# ===========================================================
+#                    Reporting
+# ===========================================================
+def print_report(report, elapsed):
+    width = max(len(endpoint) for endpoint in report) + 2
+    print(
+        f"{'endpoint':<{width}}{'reqs':>8}{'errors':>8}{'req/s':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    total = 0
+    for endpoint, stats in report.items():
+        total += stats["requests"]
+        print(
+            f"{endpoint:<{width}}{stats['requests']:>8}{stats['errors']:>8}"
+            f"{stats['throughput_rps']:>9}{stats['p50_ms']:>10}"
+            f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        )
+    print(f"\nTotal: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Load test the route manager app.")
+    parser.add_argument("--users", type = int, default = 10, help = "Concurrent virtual users.")
+    parser.add_argument("--duration", type = float, default = 30, help = "Seconds to run.")
+    parser.add_argument("--create-ratio", type = float, default = 0.3,
+                        help = "Probability that a journey iteration creates a route.")
+    parser.add_argument("--think-time", type = float, default = 0.0,
+                        help = "Max random pause between requests, in seconds.")
+    parser.add_argument("--workers", type = int, default = 2, help = "gunicorn workers.")
+    parser.add_argument("--threads", type = int, default = 1, help = "gunicorn threads per worker.")
+    parser.add_argument("--preload", action = "store_true", help = "Start gunicorn with --preload.")
+    parser.add_argument("--routes", type = int, default = 5_000, help = "Routes in the seeded database.")
+    parser.add_argument("--ors-latency", type = float, default = 0.2)
+    parser.add_argument("--elevation-latency", type = float, default = 0.1)
+    parser.add_argument("--nominatim-latency", type = float, default = 0.1)
+    parser.add_argument("--tile-latency", type = float, default = 0.02)
+    parser.add_argument("--error-rate", type = float, default = 0.0,
+                        help = "Fraction of fake service calls that fail with 503.")
+    parser.add_argument("--target", help = "Base URL of an already running server.")
+    parser.add_argument("--output", help = "Where to write the JSON report.")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, "load-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    ))
+
+    latency = {
+        "ors": args.ors_latency,
+        "elevation": args.elevation_latency,
+        "nominatim": args.nominatim_latency,
+        "tiles": args.tile_latency,
+    }
+
+    process = None
+    with FakeServices(latency = latency, error_rate = args.error_rate) as fakes:
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            workdir = tempfile.mkdtemp(prefix = "route_load_")
+            database = os.path.join(workdir, "load.db")
+            seed_database(database, routes = args.routes, comments = args.routes * 3)
+
+            env = dict(os.environ, **fakes.env())
+            env.update({"DATABASE_PATH": database, "LOG_LEVEL": "WARNING"})
+            env.pop("DEM_DIRECTORY", None)
+            process, base_url = start_gunicorn(env, workdir, args.workers, args.threads, args.preload)
+
+        recorder = Recorder()
+        deadline = time.monotonic() + args.duration
+        started = time.monotonic()
+
+        try:
+            with ThreadPoolExecutor(max_workers = args.users) as pool:
+                futures = [
+                    pool.submit(
+                        VirtualUser(base_url, recorder, i, args.routes, args.think_time).run,
+                        deadline,
+                        args.create_ratio
+                    )
+                    for i in range(args.users)
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout = 10)
+
+        elapsed = time.monotonic() - started
+        service_calls = dict(fakes.requests)
+
+    report = recorder.report(elapsed)
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    with open(output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec = "seconds"),
+                "users": args.users,
+                "duration": round(elapsed, 2),
+                "workers": args.workers,
+                "threads": args.threads,
+                "preload": args.preload,
+                "latency": latency,
+                "error_rate": args.error_rate,
+                "target": args.target,
+                "service_calls": service_calls,
+            },
+            "endpoints": report,
+        }, f, indent = 2)
+
+    print_report(report, elapsed)
+    print(f"Report written to {output}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Benchmark suite for route processing and the web request paths.
+
+Usage (from the repository root):
+    python -m benchmarks.run                    # full run
+    python -m benchmarks.run --quick            # smaller sizes, fewer repeats
+    python -m benchmarks.run --filter distance  # only matching benchmarks
+    python -m benchmarks.run --compare benchmarks/results/<old>.json
+
+Every external service is replaced by the local stand-ins of
+`benchmarks.fakes`, and the web benchmarks run against a seeded
+database in a temporary directory, so results are comparable
+between runs and machines. Results are written as JSON.
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fakes import FakeServices, fake_elevation
+from benchmarks.synthetic import seed_database, synthetic_route
+
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+QUICK_SIZES = [10, 1_000, 10_000]
+
+
+
+# ===========================================================
+#                    Timing
+# ===========================================================
+def measure(fn, repeat = 5, number = 1, setup = None):
+    """
+    Runs `fn` `number` times per sample, `repeat` samples,
+    and returns per-call statistics in seconds.
+    """
+
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+
+    samples.sort()
+    return {
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": samples[-1],
+        "repeat": repeat,
+        "number": number,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, text = True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+# ===========================================================
+#                    Benchmarks
+# ===========================================================
+def micro_benchmarks(helpers, sizes, repeat, image_folder):
+    """
+    Yields (name, run) for the pure route-processing functions;
+    calling `run()` measures the benchmark and returns its stats.
+    """
+
+    pair = ({"lat": 38.7223, "lng": -9.1393}, {"lat": 41.1579, "lng": -8.6291})
+    yield "haversine", lambda: measure(lambda: helpers.haversine(*pair), repeat, number = 10_000)
+
+    for n in sizes:
+        coords = synthetic_route(n, seed = n)
+        number = max(1, 10_000 // n)
+        profile = [{"elevation": fake_elevation(c["lat"], c["lng"])} for c in coords]
+        coords_json = json.dumps([[c["lat"], c["lng"]] for c in coords])
+        pairs = [(c["lat"], c["lng"]) for c in coords]
+
+        yield f"calculate_distance[{n}]", lambda: measure(
+            lambda: helpers.calculate_distance(coords), repeat, number
+        )
+        yield f"calculate_distances[{n}]", lambda: measure(
+            lambda: helpers.calculate_distances([coords]), repeat, number
+        )
+        yield f"calculate_elevation_stats[{n}]", lambda: measure(
+            lambda: helpers.calculate_elevation_stats(profile), repeat, number
+        )
+        yield f"validate_coordinates[{n}]", lambda: measure(
+            lambda: helpers.validate_coordinates(coords_json), repeat, number
+        )
+        yield f"resample_route[{n}]", lambda: measure(
+            lambda: helpers.resample_route(coords), repeat, number
+        )
+        yield f"process_route_internal_cold[{n}]", lambda: measure(
+            lambda: helpers.process_route_internal(coords),
+            repeat,
+            setup = helpers.elevation_cache.clear
+        )
+        yield f"process_route_internal_warm[{n}]", lambda: measure(
+            lambda: helpers.process_route_internal(coords), repeat, number
+        )
+        yield f"generate_route_image[{n}]", lambda: measure(
+            lambda: helpers.generate_route_image(pairs, save_folder = image_folder),
+            max(1, repeat // 2)
+        )
+
+def web_benchmarks(app, repeat):
+    """
+    Yields (name, run) for end-to-end requests through the Flask test client.
+    """
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+
+    def get(path):
+        def run():
+            response = client.get(path)
+            response.get_data()  # Drain streamed bodies
+            assert response.status_code == 200, (path, response.status_code)
+        return run
+
+    yield "GET /", lambda: measure(get("/"), repeat, number = 10)
+    yield "GET /routes", lambda: measure(get("/routes"), repeat)
+    yield "GET /route/<id>", lambda: measure(get("/route/1"), repeat, number = 10)
+    yield "GET /my-routes", lambda: measure(get("/my-routes"), repeat, number = 10)
+    yield "GET /routes/export.geojson", lambda: measure(get("/routes/export.geojson"), max(1, repeat // 2))
+
+    key_points = [
+        {"lat": 38.7223, "lng": -9.1393},
+        {"lat": 38.75, "lng": -9.15},
+        {"lat": 38.80, "lng": -9.20},
+    ]
+
+    def get_route(route_type):
+        def run():
+            response = client.post("/get-route", json = {
+                "coordinates": key_points,
+                "waypoints": key_points[1:-1],
+                "mode": "foot-walking",
+                "type": route_type,
+            })
+            assert response.status_code == 200, response.get_data(as_text = True)
+        return run
+
+    yield "POST /get-route (geocoded)", lambda: measure(get_route("geocoded"), repeat)
+    yield "POST /get-route (drawn)", lambda: measure(get_route("drawn"), repeat)
+
+
+
+# ===========================================================
+#                    Reporting
+# ===========================================================
+def print_results(results, previous = None):
+    width = max(len(name) for name in results) + 2
+    header = f"{'benchmark':<{width}}{'median':>14}{'min':>14}"
+    if previous:
+        header += f"{'previous':>14}{'change':>10}"
+    print(header)
+
+    for name, stats in results.items():
+        line = f"{name:<{width}}{stats['median'] * 1e3:>12.4f}ms{stats['min'] * 1e3:>12.4f}ms"
+        old = previous.get(name) if previous else None
+        if old:
+            change = (stats["median"] - old["median"]) / old["median"] * 100
+            line += f"{old['median'] * 1e3:>12.4f}ms{change:>+9.1f}%"
+        print(line)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action = "store_true", help = "Smaller sizes and fewer repeats.")
+    parser.add_argument("--filter", default = "", help = "Only run benchmarks containing this text.")
+    parser.add_argument("--output", help = "Where to write the JSON results.")
+    parser.add_argument("--compare", help = "Previous results file to compare against.")
+    parser.add_argument("--routes", type = int, default = 10_000, help = "Routes in the seeded database.")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    ))
+    compare = os.path.abspath(args.compare) if args.compare else None
+    sizes = QUICK_SIZES if args.quick else SIZES
+    repeat = 3 if args.quick else 7
+    workdir = tempfile.mkdtemp(prefix = "route_bench_")
+    database = os.path.join(workdir, "bench.db")
+
+    seeded = seed_database(database, routes = args.routes, comments = args.routes * 3)
+
+    with FakeServices() as fakes:
+        os.environ.update(fakes.env())
+        os.environ["DATABASE_PATH"] = database
+        os.environ["LOG_LEVEL"] = "WARNING"
+        os.environ.pop("DEM_DIRECTORY", None)
+
+        sys.path.insert(0, ROOT)
+        import helpers
+        from app import create_app
+
+        app = create_app()
+
+        # Route images and other relative paths go to the temp directory
+        os.chdir(workdir)
+
+        results = {}
+        suites = [
+            micro_benchmarks(helpers, sizes, repeat, os.path.join(workdir, "images")),
+            web_benchmarks(app, repeat),
+        ]
+        for suite in suites:
+            for name, run in suite:
+                if args.filter and args.filter not in name:
+                    continue
+                stats = results[name] = run()
+                print(f"  {name}: {stats['median'] * 1e3:.4f} ms", file = sys.stderr)
+
+        service_calls = dict(fakes.requests)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec = "seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "database": seeded,
+            "service_calls": service_calls,
+        },
+        "results": results,
+    }
+
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent = 2)
+
+    previous = None
+    if compare:
+        with open(compare) as f:
+            previous = json.load(f)["results"]
+
+    print_results(results, previous)
+    print(f"\nResults written to {output}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Startup time and per-worker memory of the app.
+
+Measures:
+    - Building the app in a fresh interpreter (`import app` then
+      `create_app()`), with the heavy libraries imported on first use
+      and with `PRELOAD_MODULES=1`, as the median of several runs.
+    - The memory of every gunicorn worker (RSS, and PSS / shared /
+      private from /proc) without `--preload`, with it, and with it
+      plus `PRELOAD_MODULES=1`: once the workers are up, and again
+      after they served heatmap PNGs (which load Pillow).
+
+PSS splits each shared page among the processes mapping it, so the
+PSS of the master and the workers adds up to the memory they really
+use together. The memory figures need Linux.
+
+Usage (from the repository root):
+    python -m benchmarks.startup
+    python -m benchmarks.startup --workers 4 --runs 10
+"""
+
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import requests
+
+from benchmarks.load import RESULTS_DIR, ROOT, start_gunicorn
+from benchmarks.synthetic import seed_database
+
+
+
+# Run in a fresh interpreter, so nothing is imported beforehand
+BUILD_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+built = time.perf_counter()
+from startup import loaded_modules, memory_usage
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_ms": (built - imported) * 1000,
+    "total_ms": (built - started) * 1000,
+    "rss_mb": memory_usage()["rss"] / 2 ** 20,
+    "heavy_modules": len(loaded_modules()),
+}))
+"""
+
+# (name, gunicorn --preload, PRELOAD_MODULES)
+VARIANTS = (
+    ("lazy", False, "0"),
+    ("preload", True, "0"),
+    ("preload+modules", True, "1"),
+)
+
+
+
+# ===========================================================
+#                    App Build Time
+# ===========================================================
+def measure_build(env, workdir, runs):
+    """
+    Median build time and memory of the app, by `PRELOAD_MODULES`.
+    """
+
+    results = {}
+    for name, preload_modules in (("lazy", "0"), ("preload+modules", "1")):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", BUILD_SCRIPT],
+                cwd = workdir,
+                env = dict(env, PRELOAD_MODULES = preload_modules, PYTHONPATH = ROOT),
+                capture_output = True,
+                text = True,
+                check = True
+            ).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+        results[name] = {
+            key: round(statistics.median(sample[key] for sample in samples), 1)
+            for key in samples[0]
+        }
+    return results
+
+
+
+# ===========================================================
+#                    Worker Memory
+# ===========================================================
+def children(pid):
+    """
+    Process ids whose parent is `pid`.
+    """
+
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # After the command name: state, parent pid, ...
+        if int(stat.rpartition(")")[2].split()[1]) == pid:
+            found.append(int(entry))
+    return found
+
+def process_memory(pid):
+    """
+    RSS, PSS, shared and private memory of a process, in MB.
+    """
+
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            parts = value.split()
+            if len(parts) == 2 and parts[1] == "kB":
+                fields[name] = int(parts[0]) / 1024
+
+    return {
+        "rss_mb": fields.get("Rss", 0),
+        "pss_mb": fields.get("Pss", 0),
+        "shared_mb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_mb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+def summarize(master, workers):
+    """
+    Mean memory per worker, the master's, and the PSS of all of them.
+    """
+
+    per_worker = {
+        key: round(statistics.mean(worker[key] for worker in workers), 1)
+        for key in workers[0]
+    }
+    return {
+        "per_worker": per_worker,
+        "master": {key: round(value, 1) for key, value in master.items()},
+        "total_pss_mb": round(master["pss_mb"] + sum(worker["pss_mb"] for worker in workers), 1),
+    }
+
+def measure_workers(env, workdir, workers, requests_per_worker, settle):
+    """
+    Worker memory of every variant, idle and after serving requests.
+    """
+
+    results = {}
+    for name, preload, preload_modules in VARIANTS:
+        process, base_url = start_gunicorn(
+            dict(env, PRELOAD_MODULES = preload_modules), workdir, workers, 1, preload
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while len(children(process.pid)) < workers and time.monotonic() < deadline:
+                time.sleep(0.1)
+            # Workers started without --preload are still building the app
+            time.sleep(settle)
+
+            pids = children(process.pid)
+            idle = summarize(process_memory(process.pid), [process_memory(pid) for pid in pids])
+
+            for i in range(requests_per_worker * workers):
+                requests.get(f"{base_url}/heatmap/2/{i % 4}/{i // 4 % 4}.png", timeout = 10)
+            served = summarize(process_memory(process.pid), [process_memory(pid) for pid in pids])
+        finally:
+            process.terminate()
+            process.wait(timeout = 10)
+
+        results[name] = {"idle": idle, "after_requests": served}
+    return results
+
+
+
+# ===========================================================
+#                    Reporting
+# ===========================================================
+def print_report(build, memory):
+    print(f"{'app build':<18}{'import ms':>11}{'create ms':>11}{'total ms':>10}{'RSS MB':>9}{'heavy':>7}")
+    for name, stats in build.items():
+        print(
+            f"{name:<18}{stats['import_ms']:>11}{stats['create_ms']:>11}"
+            f"{stats['total_ms']:>10}{stats['rss_mb']:>9}{stats['heavy_modules']:>7}"
+        )
+
+    print(f"\n{'workers':<18}{'state':<16}{'RSS MB':>9}{'PSS MB':>9}{'shared':>9}{'private':>9}{'total PSS':>11}")
+    for name, states in memory.items():
+        for state, stats in states.items():
+            worker = stats["per_worker"]
+            print(
+                f"{name:<18}{state:<16}{worker['rss_mb']:>9}{worker['pss_mb']:>9}"
+                f"{worker['shared_mb']:>9}{worker['private_mb']:>9}{stats['total_pss_mb']:>11}"
+            )
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Measure the startup time and worker memory of the app.")
+    parser.add_argument("--runs", type = int, default = 5, help = "App builds timed per variant.")
+    parser.add_argument("--workers", type = int, default = 2, help = "gunicorn workers.")
+    parser.add_argument("--requests", type = int, default = 5, help = "Heatmap requests per worker.")
+    parser.add_argument("--settle", type = float, default = 2.0,
+                        help = "Seconds to wait for the workers to finish starting.")
+    parser.add_argument("--routes", type = int, default = 1_000, help = "Routes in the seeded database.")
+    parser.add_argument("--output", help = "Where to write the JSON report.")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, "startup-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    ))
+
+    workdir = tempfile.mkdtemp(prefix = "route_startup_")
+    database = os.path.join(workdir, "startup.db")
+    seed_database(database, routes = args.routes, comments = args.routes)
+
+    env = dict(os.environ, DATABASE_PATH = database, LOG_LEVEL = "WARNING")
+    env.pop("DEM_DIRECTORY", None)
+
+    build = measure_build(env, workdir, args.runs)
+    memory = measure_workers(env, workdir, args.workers, args.requests, args.settle)
+
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    with open(output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec = "seconds"),
+                "runs": args.runs,
+                "workers": args.workers,
+                "requests_per_worker": args.requests,
+                "python": sys.version.split()[0],
+            },
+            "build": build,
+            "workers": memory,
+        }, f, indent = 2)
+
+    print_report(build, memory)
+    print(f"Report written to {output}")
+
+
+
+if __name__ == "__main__":
+    main()
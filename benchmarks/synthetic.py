@@ -0,0 +1,148 @@
+"""
+Synthetic data for benchmarks and load tests.
+
+This module includes:
+    - Random-walk routes of any size (10 to 100k+ points)
+    - A seeded SQLite database with the app's schema and
+      realistic numbers of users, routes and comments
+"""
+
+
+import json
+import math
+import os
+import random
+import sqlite3
+
+from werkzeug.security import generate_password_hash
+
+
+
+SCHEMA_SOURCE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "route_manager.db")
+DEFAULT_PASSWORD = "benchmark-password"
+COUNTRIES = ["Portugal", "Spain", "France", "Italy", "Switzerland", "Austria"]
+
+
+
+def synthetic_route(points, seed = 0, start = (38.7223, -9.1393), step_meters = 20):
+    """
+    Generates a smooth random-walk route.
+
+    Args:
+        points (int): Number of points.
+        seed (int): Random seed, so runs are reproducible.
+        start (tuple): (lat, lng) of the first point.
+        step_meters (float): Approximate distance between points.
+    Returns:
+        list[dict]: {'lat': float, 'lng': float} points.
+    """
+
+    rng = random.Random(seed)
+    lat, lng = start
+    heading = rng.uniform(0, 2 * math.pi)
+    step = step_meters / 111_000
+    route = []
+
+    for _ in range(points):
+        route.append({"lat": round(lat, 6), "lng": round(lng, 6)})
+        heading += rng.gauss(0, 0.2)
+        lat += step * math.cos(heading)
+        lng += step * math.sin(heading) / math.cos(math.radians(lat))
+
+    return route
+
+def create_schema(connection):
+    """
+    Copies the table definitions of the bundled `route_manager.db`
+    into `connection`, so benchmarks always run against the real schema.
+
+    Virtual tables (the tiles' R*Tree) are copied without the shadow
+    tables SQLite creates for them (`<name>_node`, `<name>_rowid`, ...),
+    which would otherwise already exist.
+    """
+
+    source = sqlite3.connect(SCHEMA_SOURCE)
+    try:
+        rows = source.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'index') "
+            "AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+    finally:
+        source.close()
+
+    virtual = [name for name, sql in rows if sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    statements = [
+        sql for name, sql in rows
+        if not any(name.startswith(f"{table}_") for table in virtual)
+    ]
+
+    for statement in statements:
+        connection.execute(statement)
+    connection.commit()
+
+def seed_database(path, users = 500, routes = 10_000, comments = 30_000, long_route_ratio = 0.05, seed = 42):
+    """
+    Creates (or replaces) a database at `path` filled with synthetic data.
+
+    Most routes store a handful of key points, like routes created in
+    the UI; `long_route_ratio` of them store 500-point tracks, like
+    imported GPX files.
+
+    Returns:
+        dict: Counts of the inserted rows.
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    create_schema(connection)
+
+    password = generate_password_hash(DEFAULT_PASSWORD)
+    connection.executemany(
+        "INSERT INTO users (id, username, email, password, profile_picture) VALUES (?, ?, ?, ?, ?)",
+        [
+            (i, f"user{i}", f"user{i}@example.com", password,
+             "static/images/users/default_profile_image.png")
+            for i in range(1, users + 1)
+        ]
+    )
+
+    route_rows = []
+    for i in range(1, routes + 1):
+        size = 500 if rng.random() < long_route_ratio else rng.randint(2, 7)
+        start = (rng.uniform(37.0, 47.0), rng.uniform(-9.0, 15.0))
+        coords = synthetic_route(size, seed = i, start = start, step_meters = 200 if size < 10 else 20)
+        gain = rng.uniform(0, 2000)
+        route_rows.append((
+            i, rng.randint(1, users), f"Route {i}", f"Synthetic route number {i}",
+            json.dumps([[c["lat"], c["lng"]] for c in coords]),
+            round(gain, 2), round(gain * rng.uniform(0.5, 1.5), 2),
+            round(rng.uniform(500, 3000), 2), round(rng.uniform(0, 500), 2),
+            round(rng.uniform(200, 1500), 2), round(rng.uniform(1, 120), 2),
+            None, rng.choice(COUNTRIES)
+        ))
+
+    connection.executemany(
+        """INSERT INTO routes (
+            id, user_id, name, description, coordinates,
+            elevation_gain, elevation_loss, max_elevation,
+            min_elevation, avg_elevation, total_distance,
+            map_image_url, country
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        route_rows
+    )
+
+    connection.executemany(
+        "INSERT INTO comments (route_id, user_id, comment) VALUES (?, ?, ?)",
+        [
+            (rng.randint(1, routes), rng.randint(1, users), f"Nice route! #{i}")
+            for i in range(comments)
+        ]
+    )
+
+    connection.commit()
+    connection.close()
+
+    return {"users": users, "routes": routes, "comments": comments}
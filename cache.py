@@ -0,0 +1,61 @@
+"""
+Small in-process caches.
+
+Each gunicorn worker keeps its own copy, so entries must either be
+safe to serve slightly stale (bounded by the TTL) or be invalidated
+by the code that changes them.
+"""
+
+
+import threading
+import time
+from collections import OrderedDict
+
+
+
+class TTLCache:
+    """
+    Thread-safe mapping whose entries expire `ttl` seconds after being
+    stored. When full, the least recently used entry is evicted.
+
+    Args:
+        ttl (float): Seconds an entry stays valid.
+        max_size (int): Maximum number of entries.
+    """
+
+    def __init__(self, ttl, max_size = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last = False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,92 @@
+"""
+Response compression for the JSON and GeoJSON endpoints.
+
+Responses larger than `COMPRESS_MIN_SIZE` are compressed with brotli
+(when the optional `brotli` package is installed) or gzip, according
+to the client's Accept-Encoding. Streamed responses (exports) are left
+alone.
+
+A compressed response is a different representation, so its ETag gets
+the encoding appended (`"tag"` becomes `"tag-gzip"`) and the request's
+conditional headers are checked again against that tag.
+"""
+
+
+import gzip
+
+from flask import request
+
+from metrics import increment
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"application/json", "application/geo+json"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+
+def _accepted_encodings():
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+def compress_response(response):
+    """
+    `after_request` hook compressing eligible responses in place.
+    """
+
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.mimetype not in COMPRESS_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = _accepted_encodings()
+    if brotli is not None and "br" in accepted:
+        encoding = "br"
+        compressed = brotli.compress(data, quality = BROTLI_QUALITY)
+    elif "gzip" in accepted:
+        encoding = "gzip"
+        compressed = gzip.compress(data, compresslevel = GZIP_LEVEL, mtime = 0)
+    else:
+        return response
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+        response.make_conditional(request)
+
+    increment("compressed_response_bytes_total", len(data), encoding = encoding, size = "original")
+    increment("compressed_response_bytes_total", len(compressed), encoding = encoding, size = "compressed")
+    return response
+
+def init_compression(app):
+    """
+    Registers the compression hook unless `COMPRESS_RESPONSES` is False.
+    """
+
+    if app.config.get("COMPRESS_RESPONSES", True):
+        app.after_request(compress_response)
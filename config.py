@@ -0,0 +1,125 @@
+"""
+Configuration objects for `create_app`.
+
+`Config` reads every setting from the environment (and `.env`) once,
+when this module is imported. The other classes override it for one
+use:
+    - `DevelopmentConfig`: debug mode, as started by `python app.py`
+    - `TestingConfig`: no rate limits, prefetching or background
+      threads, so tests only do what they ask for
+
+`create_app` picks the class named by `APP_CONFIG` ('default',
+'development' or 'testing') unless it is given one.
+"""
+
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+
+class Config:
+    # Paths and API keys
+    UPLOAD_FOLDER = "static/images/users"
+    ROUTE_IMAGE_FOLDER = "static/images/routes"
+    ORS_API_KEY = os.getenv("ORS_API_KEY")
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_UPLOAD_MB", "64")) * 1024 * 1024
+    COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "1") == "1"
+    AVATAR_ASYNC = os.getenv("AVATAR_ASYNC") == "1"
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+    # Sessions are stored server-side and shared by all workers (see sessions.py)
+    SECRET_KEY_FILE = os.getenv("SECRET_KEY_FILE", ".secret_key")
+    SESSION_DATABASE = os.getenv("SESSION_DATABASE", "sessions.db")
+
+    # Profiler config (see profiler.py); off unless enabled in the environment
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1"
+    PROFILER_HEADER_ENABLED = os.getenv("PROFILER_HEADER_ENABLED") == "1"
+    PROFILER_PATHS = [p for p in os.getenv("PROFILER_PATHS", "").split(",") if p]
+    PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "1.0"))
+    PROFILER_MODE = os.getenv("PROFILER_MODE", "cprofile")
+    PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+    ADMIN_USER_IDS = [int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i]
+
+    # Password hashing config (see passwords.py)
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+    # Rate limit config (see rate_limit.py)
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+    RATE_LIMIT_DATABASE = os.getenv("RATE_LIMIT_DATABASE", "rate_limit.db")
+    RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0.5"))
+    RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "30"))
+    MAX_CONCURRENT_ROUTES = int(os.getenv("MAX_CONCURRENT_ROUTES", "8"))
+
+    # Waypoint order optimization
+    ROUTE_ORDER_TIME_BUDGET = float(os.getenv("ROUTE_ORDER_TIME_BUDGET", "0.2"))
+
+    # Speculative prefetch while a route is being planned
+    PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+    PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "1"))
+    PREFETCH_QUEUE = int(os.getenv("PREFETCH_QUEUE", "8"))
+
+    # Route vector tiles
+    TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", "tile_cache")
+    TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "16"))
+    TILE_MAX_AGE = int(os.getenv("TILE_MAX_AGE", "60"))
+    HEATMAP_MAX_AGE = int(os.getenv("HEATMAP_MAX_AGE", "300"))
+
+    # Materialized statistics
+    STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+
+    # Elevation backfill of routes saved while the elevation service was down
+    ELEVATION_BACKFILL_INTERVAL = int(os.getenv("ELEVATION_BACKFILL_INTERVAL", "600"))
+
+    # Fingerprinting of created and edited routes for similar-route lookups
+    FINGERPRINT_INDEX_INTERVAL = int(os.getenv("FINGERPRINT_INDEX_INTERVAL", "30"))
+
+    # Import the routing, rendering and HTTP libraries while the app is
+    # built rather than on first use (see startup.py)
+    PRELOAD_MODULES = os.getenv("PRELOAD_MODULES") == "1"
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+class TestingConfig(Config):
+    TESTING = True
+    RATE_LIMIT_ENABLED = False
+    PREFETCH_ENABLED = False
+    AVATAR_ASYNC = False
+    PROFILER_ENABLED = False
+    STATS_RECONCILE_INTERVAL = 0
+    ELEVATION_BACKFILL_INTERVAL = 0
+    FINGERPRINT_INDEX_INTERVAL = 0
+
+CONFIGS = {
+    "default": Config,
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+}
+
+
+
+def get_config(config = None):
+    """
+    Resolves the `create_app` argument to a config object.
+
+    Args:
+        config: A config class or object, the name of one in `CONFIGS`,
+            or None for the one named by `APP_CONFIG`.
+    Raises:
+        ValueError: The name is not in `CONFIGS`.
+    """
+
+    if config is None:
+        config = os.getenv("APP_CONFIG", "default")
+    if isinstance(config, str):
+        if config not in CONFIGS:
+            raise ValueError(f"APP_CONFIG must be one of {', '.join(CONFIGS)}")
+        config = CONFIGS[config]
+    return config
@@ -0,0 +1,402 @@
+"""
+Pluggable elevation providers used by `helpers.get_elevations`.
+
+This module includes:
+    - Local SRTM `.hgt` tiles read through memory maps
+    - Local uncompressed GeoTIFF tiles read through memory maps
+    - The OpenTopoData remote API
+    - A chain provider that falls back to the next provider for
+      points the previous one could not resolve
+
+Every provider answers `lookup(points)` with one elevation per
+(lat, lng) point, or None when the point is not covered.
+"""
+
+
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from metrics import increment, log_error
+from resilience import CircuitOpenError, external_timeout, get_breaker
+
+
+
+ELEVATION_API_URL = "https://api.opentopodata.org/v1/mapzen"
+HGT_VOID = -32768
+HGT_NAME = re.compile(r"^([NS])(\d{2})([EW])(\d{3})\.hgt$", re.IGNORECASE)
+MAX_OPEN_TILES = 64                     # .hgt tiles kept mapped per provider (up to 25 MB each)
+
+
+
+# ===========================================================
+#                    Interpolation
+# ===========================================================
+def bilinear(v00, v01, v10, v11, row_frac, col_frac):
+    """
+    Bilinear interpolation between four neighbouring samples.
+    v00 is the top-left sample, v11 the bottom-right one.
+    Returns None if any sample is missing.
+    """
+
+    if None in (v00, v01, v10, v11):
+        return None
+
+    top = v00 + (v01 - v00) * col_frac
+    bottom = v10 + (v11 - v10) * col_frac
+    return top + (bottom - top) * row_frac
+
+
+
+# ===========================================================
+#                    Memory-Mapped Grids
+# ===========================================================
+class _Grid:
+    """
+    A north-up raster of elevation samples stored in a memory-mapped file.
+
+    Subclasses set the geometry (`rows`, `cols`, `north`, `west`,
+    `lat_step`, `lng_step`) and implement `_sample(row, col)`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def contains(self, lat, lng):
+        south = self.north - (self.rows - 1) * self.lat_step
+        east = self.west + (self.cols - 1) * self.lng_step
+        return south <= lat <= self.north and self.west <= lng <= east
+
+    def elevation(self, lat, lng):
+        """
+        Returns the bilinearly interpolated elevation at (lat, lng).
+        """
+
+        row_pos = (self.north - lat) / self.lat_step
+        col_pos = (lng - self.west) / self.lng_step
+
+        row = min(int(row_pos), self.rows - 2)
+        col = min(int(col_pos), self.cols - 2)
+
+        return bilinear(
+            self._sample(row, col),
+            self._sample(row, col + 1),
+            self._sample(row + 1, col),
+            self._sample(row + 1, col + 1),
+            row_pos - row,
+            col_pos - col
+        )
+
+class HGTTile(_Grid):
+    """
+    An SRTM `.hgt` tile: big-endian int16 samples covering 1x1 degree,
+    1201x1201 (3 arc-second) or 3601x3601 (1 arc-second).
+    """
+
+    def __init__(self, path, lat, lng):
+        super().__init__(path)
+        size = int(math.isqrt(len(self._map) // 2))
+        if size * size * 2 != len(self._map):
+            raise ValueError(f"Not an SRTM tile: {path}")
+
+        self.rows = self.cols = size
+        self.north = lat + 1
+        self.west = lng
+        self.lat_step = self.lng_step = 1 / (size - 1)
+
+    def _sample(self, row, col):
+        value = struct.unpack_from(">h", self._map, (row * self.cols + col) * 2)[0]
+        return None if value == HGT_VOID else value
+
+class GeoTIFFTile(_Grid):
+    """
+    A single-band, uncompressed GeoTIFF in geographic coordinates.
+
+    Supports strip and tile layouts with 16-bit integer or 32-bit
+    float samples, which covers the usual SRTM/Copernicus DEM exports.
+    """
+
+    TAG_WIDTH = 256
+    TAG_HEIGHT = 257
+    TAG_BITS = 258
+    TAG_COMPRESSION = 259
+    TAG_STRIP_OFFSETS = 273
+    TAG_ROWS_PER_STRIP = 278
+    TAG_TILE_WIDTH = 322
+    TAG_TILE_LENGTH = 323
+    TAG_TILE_OFFSETS = 324
+    TAG_SAMPLE_FORMAT = 339
+    TAG_PIXEL_SCALE = 33550
+    TAG_TIEPOINT = 33922
+    TAG_NODATA = 42113
+
+    TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 11: 4, 12: 8, 16: 8}
+    TYPE_CODES = {1: "B", 2: "s", 3: "H", 4: "I", 5: "II", 11: "f", 12: "d", 16: "Q"}
+
+    def __init__(self, path):
+        super().__init__(path)
+        tags = self._read_tags()
+
+        if tags.get(self.TAG_COMPRESSION, [1])[0] != 1:
+            raise ValueError(f"Compressed GeoTIFF is not supported: {path}")
+
+        self.rows = tags[self.TAG_HEIGHT][0]
+        self.cols = tags[self.TAG_WIDTH][0]
+        scale = tags[self.TAG_PIXEL_SCALE]
+        tiepoint = tags[self.TAG_TIEPOINT]
+        self.lng_step, self.lat_step = scale[0], scale[1]
+        # Sample centres, so the grid is addressed like an .hgt tile
+        self.west = tiepoint[3] - tiepoint[0] * self.lng_step + self.lng_step / 2
+        self.north = tiepoint[4] + tiepoint[1] * self.lat_step - self.lat_step / 2
+
+        bits = tags.get(self.TAG_BITS, [16])[0]
+        sample_format = tags.get(self.TAG_SAMPLE_FORMAT, [1])[0]
+        if sample_format == 3 and bits == 32:
+            code = "f"
+        elif bits == 16:
+            code = "h" if sample_format == 2 else "H"
+        else:
+            raise ValueError(f"Unsupported GeoTIFF sample type in {path}")
+
+        self._sample_size = bits // 8
+        self._sample_fmt = self._endian + code
+
+        nodata = tags.get(self.TAG_NODATA)
+        self._nodata = float(nodata.rstrip("\x00")) if nodata else None
+
+        if self.TAG_TILE_OFFSETS in tags:
+            self._tile_width = tags[self.TAG_TILE_WIDTH][0]
+            self._tile_length = tags[self.TAG_TILE_LENGTH][0]
+            self._offsets = tags[self.TAG_TILE_OFFSETS]
+        else:
+            self._tile_width = self.cols
+            self._tile_length = tags.get(self.TAG_ROWS_PER_STRIP, [self.rows])[0]
+            self._offsets = tags[self.TAG_STRIP_OFFSETS]
+
+    def _read_tags(self):
+        byte_order = self._map[:2]
+        if byte_order == b"II":
+            self._endian = "<"
+        elif byte_order == b"MM":
+            self._endian = ">"
+        else:
+            raise ValueError(f"Not a TIFF file: {self.path}")
+
+        magic, ifd_offset = struct.unpack_from(self._endian + "HI", self._map, 2)
+        if magic != 42:
+            raise ValueError(f"BigTIFF is not supported: {self.path}")
+
+        tags = {}
+        (count,) = struct.unpack_from(self._endian + "H", self._map, ifd_offset)
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag, field_type, n = struct.unpack_from(self._endian + "HHI", self._map, entry)
+            if field_type not in self.TYPE_SIZES:
+                continue
+
+            size = self.TYPE_SIZES[field_type] * n
+            if size > 4:
+                (value_offset,) = struct.unpack_from(self._endian + "I", self._map, entry + 8)
+            else:
+                value_offset = entry + 8
+
+            if field_type == 2:
+                tags[tag] = bytes(self._map[value_offset:value_offset + n]).decode("ascii")
+            else:
+                code = self.TYPE_CODES[field_type]
+                tags[tag] = list(struct.unpack_from(
+                    self._endian + code * n, self._map, value_offset
+                ))
+
+        return tags
+
+    def _sample(self, row, col):
+        tiles_across = -(-self.cols // self._tile_width)
+        index = (row // self._tile_length) * tiles_across + col // self._tile_width
+        inner = (row % self._tile_length) * self._tile_width + col % self._tile_width
+
+        offset = self._offsets[index] + inner * self._sample_size
+        value = struct.unpack_from(self._sample_fmt, self._map, offset)[0]
+
+        if self._nodata is not None and value == self._nodata:
+            return None
+        return value
+
+
+
+# ===========================================================
+#                    Providers
+# ===========================================================
+class ElevationProvider(ABC):
+    """
+    Base class for elevation providers.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def lookup(self, points):
+        """
+        Args:
+            points (list[tuple]): (lat, lng) pairs.
+        Returns:
+            list[float|None]: Elevation in meters per point, None if unknown.
+        """
+
+class LocalDEMProvider(ElevationProvider):
+    """
+    Reads elevations from a directory of `.hgt` and `.tif` tiles.
+
+    Tiles are opened (memory-mapped) on first use and kept open, so a
+    whole route is sampled locally with a handful of page reads. At most
+    `max_open_tiles` .hgt tiles stay open; the least recently used one
+    is closed to make room. Lookups hold a lock, so threads never open a
+    tile twice or read one that another thread closed.
+    """
+
+    name = "local"
+
+    def __init__(self, directory, max_open_tiles = MAX_OPEN_TILES):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        self._hgt = {}
+        self._tiffs = []
+        self._open_tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+        for filename in sorted(os.listdir(directory)):
+            match = HGT_NAME.match(filename)
+            path = os.path.join(directory, filename)
+            if match:
+                lat = int(match.group(2)) * (1 if match.group(1).upper() == "N" else -1)
+                lng = int(match.group(4)) * (1 if match.group(3).upper() == "E" else -1)
+                self._hgt[(lat, lng)] = path
+            elif filename.lower().endswith((".tif", ".tiff")):
+                try:
+                    self._tiffs.append(GeoTIFFTile(path))
+                except (ValueError, KeyError, struct.error) as e:
+                    log_error("dem_tile_skipped", e, tile = filename)
+
+    def _hgt_tile(self, lat, lng):
+        key = (math.floor(lat), math.floor(lng))
+        tile = self._open_tiles.get(key)
+        if tile is not None:
+            self._open_tiles.move_to_end(key)
+            return tile
+
+        path = self._hgt.get(key)
+        if path is None:
+            return None
+
+        tile = self._open_tiles[key] = HGTTile(path, *key)
+        while len(self._open_tiles) > self.max_open_tiles:
+            self._open_tiles.popitem(last = False)[1].close()
+        return tile
+
+    def _tile_for(self, lat, lng):
+        tile = self._hgt_tile(lat, lng)
+        if tile is not None:
+            return tile
+        for tiff in self._tiffs:
+            if tiff.contains(lat, lng):
+                return tiff
+        return None
+
+    def lookup(self, points):
+        results = []
+        with self._lock:
+            for lat, lng in points:
+                tile = self._tile_for(lat, lng)
+                results.append(tile.elevation(lat, lng) if tile else None)
+        return results
+
+class OpenTopoDataProvider(ElevationProvider):
+    """
+    Queries the OpenTopoData API in batches of `batch_size` locations.
+    Points of a failed batch are returned as None, at once while the
+    service's circuit breaker is open.
+    """
+
+    name = "opentopodata"
+
+    def __init__(self, url = ELEVATION_API_URL, batch_size = 100):
+        self.url = url
+        self.batch_size = batch_size
+
+    def lookup(self, points):
+        results = []
+        for i in range(0, len(points), self.batch_size):
+            batch = points[i:i + self.batch_size]
+            try:
+                elevations = get_breaker(self.name).call(self._fetch, batch)
+            except CircuitOpenError:
+                elevations = []
+            except Exception as e:
+                increment("external_errors_total", service = "opentopodata")
+                log_error("elevation_api_failed", e, batch_size = len(batch))
+                elevations = []
+
+            elevations += [None] * (len(batch) - len(elevations))
+            results.extend(elevations)
+        return results
+
+    def _fetch(self, batch):
+        import requests
+
+        locations_str = "|".join(f"{lat},{lng}" for lat, lng in batch)
+        response = requests.get(self.url, params={"locations": locations_str}, timeout = external_timeout())
+        response.raise_for_status()
+        data = response.json().get("results", [])
+        return [r.get("elevation") for r in data]
+
+class ChainProvider(ElevationProvider):
+    """
+    Asks each provider in turn, passing on only the points
+    the previous providers could not resolve.
+    """
+
+    name = "chain"
+
+    def __init__(self, providers):
+        self.providers = providers
+
+    def lookup(self, points):
+        results = [None] * len(points)
+        pending = list(range(len(points)))
+
+        for provider in self.providers:
+            if not pending:
+                break
+            found = provider.lookup([points[i] for i in pending])
+            still_pending = []
+            for i, value in zip(pending, found):
+                if value is None:
+                    still_pending.append(i)
+                else:
+                    results[i] = value
+            pending = still_pending
+
+        return results
+
+def provider_from_env():
+    """
+    Builds the default provider: local tiles from `DEM_DIRECTORY`
+    (when set) with the remote API as fallback.
+    """
+
+    remote = OpenTopoDataProvider(os.getenv("ELEVATION_API_URL", ELEVATION_API_URL))
+    directory = os.getenv("DEM_DIRECTORY")
+
+    if directory and os.path.isdir(directory):
+        return ChainProvider([LocalDEMProvider(directory), remote])
+    return remote
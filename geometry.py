@@ -0,0 +1,103 @@
+"""
+Compact encodings for route geometry.
+
+This module includes:
+    - Google encoded polyline encoding and decoding
+    - Conversion of {lat, lng} coordinate lists to the wire format
+      requested by a client ('objects', 'flat' or 'polyline')
+"""
+
+
+
+POLYLINE_PRECISION = 5
+GEOMETRY_FORMATS = ("objects", "flat", "polyline")
+
+
+
+# ===========================================================
+#                    Encoded Polyline
+# ===========================================================
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+def encode_polyline(coordinates, precision = POLYLINE_PRECISION):
+    """
+    Encodes (lat, lng) pairs with the encoded polyline algorithm.
+
+    Args:
+        coordinates (iterable): (lat, lng) pairs.
+        precision (int): Decimal places kept (5 is about 1 m).
+    Returns:
+        str: The encoded polyline.
+    """
+
+    factor = 10 ** precision
+    out = []
+    previous_lat = previous_lng = 0
+
+    for lat, lng in coordinates:
+        lat = round(lat * factor)
+        lng = round(lng * factor)
+        _encode_value(lat - previous_lat, out)
+        _encode_value(lng - previous_lng, out)
+        previous_lat, previous_lng = lat, lng
+
+    return "".join(out)
+
+def decode_polyline(encoded, precision = POLYLINE_PRECISION):
+    """
+    Decodes an encoded polyline.
+
+    Returns:
+        list[tuple]: (lat, lng) pairs.
+    """
+
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    length = len(encoded)
+
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / factor, lng / factor))
+
+    return coordinates
+
+
+
+# ===========================================================
+#                    Wire Formats
+# ===========================================================
+def format_coordinates(coordinates, geometry_format = "objects"):
+    """
+    Converts [{'lat', 'lng'}, ...] to the requested wire format.
+
+    Args:
+        coordinates (list[dict]): Route coordinates.
+        geometry_format (str): 'objects' (unchanged), 'flat'
+            ([lat1, lng1, lat2, lng2, ...]) or 'polyline'.
+    Returns:
+        list | str: The encoded coordinates.
+    """
+
+    if geometry_format == "polyline":
+        return encode_polyline((c["lat"], c["lng"]) for c in coordinates)
+    if geometry_format == "flat":
+        return [value for c in coordinates for value in (c["lat"], c["lng"])]
+    return coordinates
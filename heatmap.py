@@ -0,0 +1,406 @@
+"""
+Route density heatmap ("popular areas").
+
+Every zoom level from 0 to `HEATMAP_MAX_ZOOM` has a density grid of
+`GRID_SIZE` x `GRID_SIZE` cells per map tile. A cell counts how many
+routes pass through it. The grids are stored per tile, so serving an
+overlay tile reads one small row instead of parsing every route. Each
+tile also stores its busiest cell, and the colour scale of a zoom (its
+busiest cell overall) is read from an index on those peaks per request,
+so it also falls when routes are deleted.
+
+This module includes:
+    - Rasterizing a route into the grid cells it crosses, at every zoom
+    - The `heatmap_tiles` table and a change queue filled by triggers on
+      `routes`. Applying the queue adds or removes only the changed
+      routes' cells.
+    - A bulk rebuild that rasterizes all routes in a process pool
+    - PNG and JSON rendering of one tile of the grid
+"""
+
+
+import io
+import json
+import os
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from math import floor, inf, log1p
+
+from cache import TTLCache
+from metrics import increment, log_event, timed
+from tiles import mercator_line
+
+
+
+GRID_SIZE = 64                  # Cells per tile side (4 px cells on a 256 px tile)
+HEATMAP_MAX_ZOOM = 14
+TILE_PIXELS = 256
+MAX_CHANGES_PER_APPLY = 500
+REBUILD_CHUNK_SIZE = 200
+RENDER_CACHE_TTL = 300
+
+HEATMAP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS heatmap_tiles (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    counts BLOB NOT NULL,
+    peak INTEGER NOT NULL,
+    PRIMARY KEY (z, x, y)
+);
+
+CREATE INDEX IF NOT EXISTS heatmap_tiles_peak ON heatmap_tiles (z, peak);
+
+CREATE TABLE IF NOT EXISTS heatmap_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    old_coordinates TEXT,
+    new_coordinates TEXT
+);
+
+CREATE TRIGGER IF NOT EXISTS heatmap_on_insert
+AFTER INSERT ON routes
+BEGIN
+    INSERT INTO heatmap_changes (old_coordinates, new_coordinates) VALUES (NULL, NEW.coordinates);
+END;
+
+CREATE TRIGGER IF NOT EXISTS heatmap_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    INSERT INTO heatmap_changes (old_coordinates, new_coordinates) VALUES (OLD.coordinates, NEW.coordinates);
+END;
+
+CREATE TRIGGER IF NOT EXISTS heatmap_on_delete
+AFTER DELETE ON routes
+BEGIN
+    INSERT INTO heatmap_changes (old_coordinates, new_coordinates) VALUES (OLD.coordinates, NULL);
+END;
+"""
+
+# Rendered PNGs by ETag
+render_cache = TTLCache(RENDER_CACHE_TTL, max_size = 2048)
+
+
+
+def init_heatmap_schema(connection):
+    """
+    Creates the heatmap tables and triggers. The first time, every
+    existing route is queued so the grids fill in on first use
+    (`flask rebuild-heatmap` does the same in parallel).
+    """
+
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(heatmap_tiles)")]
+    created = "peak" not in columns
+    if columns and created:
+        # Grids stored before tiles kept their peak: they are derived data, so refill them
+        connection.executescript(
+            "DROP TABLE heatmap_tiles; DROP TABLE IF EXISTS heatmap_levels; DELETE FROM heatmap_changes;"
+        )
+
+    connection.executescript(HEATMAP_SCHEMA)
+    if created:
+        connection.execute(
+            "INSERT INTO heatmap_changes (old_coordinates, new_coordinates) SELECT NULL, coordinates FROM routes"
+        )
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Rasterization
+# ===========================================================
+def _segment_cells(x0, y0, x1, y1, cells):
+    """
+    Adds every grid cell the segment passes through (Amanatides-Woo
+    traversal; coordinates in cell units).
+    """
+
+    cx, cy = floor(x0), floor(y0)
+    end_x, end_y = floor(x1), floor(y1)
+    cells.add((cx, cy))
+    if cx == end_x and cy == end_y:
+        return
+
+    dx, dy = x1 - x0, y1 - y0
+    step_x = 1 if dx > 0 else -1
+    step_y = 1 if dy > 0 else -1
+    t_max_x = ((cx + (step_x > 0)) - x0) / dx if dx else inf
+    t_max_y = ((cy + (step_y > 0)) - y0) / dy if dy else inf
+    t_delta_x = abs(1 / dx) if dx else inf
+    t_delta_y = abs(1 / dy) if dy else inf
+
+    for _ in range(abs(end_x - cx) + abs(end_y - cy)):
+        if t_max_x < t_max_y:
+            cx += step_x
+            t_max_x += t_delta_x
+        else:
+            cy += step_y
+            t_max_y += t_delta_y
+        cells.add((cx, cy))
+
+def route_cells(coordinates_json, max_zoom = HEATMAP_MAX_ZOOM):
+    """
+    The grid cells a stored route crosses, per zoom.
+
+    The line is traversed once at `max_zoom`. Cells nest (each cell is
+    4 cells of the next zoom), so every lower zoom is derived by halving
+    the cell coordinates of the one above.
+
+    Returns:
+        dict: {(z, tile_x, tile_y): {cell index: 1}} with each cell
+            counted once per route.
+    """
+
+    try:
+        coordinates = json.loads(coordinates_json) if coordinates_json else []
+        line = mercator_line(coordinates)
+    except (TypeError, ValueError):
+        return {}
+
+    tiles = {}
+    if not line:
+        return tiles
+
+    size = GRID_SIZE * 2 ** max_zoom
+    last = size - 1
+    cells = set()
+    x0, y0 = min(max(line[0][0] * size, 0), last), min(max(line[0][1] * size, 0), last)
+    cells.add((floor(x0), floor(y0)))
+    for x, y in line[1:]:
+        x1, y1 = min(max(x * size, 0), last), min(max(y * size, 0), last)
+        _segment_cells(x0, y0, x1, y1, cells)
+        x0, y0 = x1, y1
+
+    for z in range(max_zoom, -1, -1):
+        for cx, cy in cells:
+            key = (z, cx // GRID_SIZE, cy // GRID_SIZE)
+            tiles.setdefault(key, {})[(cy % GRID_SIZE) * GRID_SIZE + cx % GRID_SIZE] = 1
+        cells = {(cx >> 1, cy >> 1) for cx, cy in cells}
+
+    return tiles
+
+def _merge(total, tiles, sign = 1):
+    for key, cells in tiles.items():
+        target = total.setdefault(key, {})
+        for index, count in cells.items():
+            target[index] = target.get(index, 0) + sign * count
+    return total
+
+def _rasterize_chunk(coordinate_jsons):
+    """
+    Process-pool task: summed cells of a chunk of routes.
+    """
+
+    total = {}
+    for coordinates_json in coordinate_jsons:
+        _merge(total, route_cells(coordinates_json))
+    return total
+
+
+
+# ===========================================================
+#                    Storage
+# ===========================================================
+def _unpack(blob):
+    counts = array("i")
+    counts.frombytes(zlib.decompress(blob))
+    return counts
+
+def _pack(counts):
+    return zlib.compress(counts.tobytes(), 6)
+
+def _write_deltas(connection, deltas):
+    """
+    Adds per-cell deltas to the stored tiles (inside the caller's
+    transaction), keeping each tile's peak.
+    """
+
+    for (z, x, y), cells in deltas.items():
+        row = connection.execute(
+            "SELECT counts FROM heatmap_tiles WHERE z = ? AND x = ? AND y = ?", (z, x, y)
+        ).fetchone()
+        counts = _unpack(row[0]) if row else array("i", bytes(4 * GRID_SIZE * GRID_SIZE))
+
+        for index, delta in cells.items():
+            counts[index] = max(0, counts[index] + delta)
+
+        peak = max(counts)
+        if peak == 0:
+            connection.execute("DELETE FROM heatmap_tiles WHERE z = ? AND x = ? AND y = ?", (z, x, y))
+            continue
+
+        connection.execute(
+            """INSERT INTO heatmap_tiles (z, x, y, counts, peak) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (z, x, y) DO UPDATE SET counts = excluded.counts, peak = excluded.peak""",
+            (z, x, y, _pack(counts), peak)
+        )
+
+def apply_heatmap_changes(connection, limit = MAX_CHANGES_PER_APPLY):
+    """
+    Applies queued route changes to the grids: the old geometry's cells
+    are decremented and the new geometry's incremented. The queue is
+    read and emptied in one write transaction, so concurrent workers
+    never apply a change twice.
+
+    Returns:
+        int: Number of changes applied.
+    """
+
+    if connection.in_transaction:
+        connection.commit()
+
+    # Cheap read first: most calls find the queue empty and take no write lock
+    if connection.execute("SELECT 1 FROM heatmap_changes LIMIT 1").fetchone() is None:
+        return 0
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute(
+            "SELECT id, old_coordinates, new_coordinates FROM heatmap_changes ORDER BY id LIMIT ?",
+            (limit,)
+        ).fetchall()
+        if not rows:
+            connection.rollback()
+            return 0
+
+        with timed("heatmap_apply"):
+            deltas = {}
+            for _, old_coordinates, new_coordinates in rows:
+                _merge(deltas, route_cells(old_coordinates), -1)
+                _merge(deltas, route_cells(new_coordinates), 1)
+            _write_deltas(connection, deltas)
+            connection.execute("DELETE FROM heatmap_changes WHERE id <= ?", (rows[-1][0],))
+
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    increment("heatmap_changes_applied_total", len(rows))
+    return len(rows)
+
+def rebuild_heatmap(connection, workers = None):
+    """
+    Recomputes every grid from the stored routes, rasterizing chunks of
+    routes in a process pool.
+
+    The routes and the queue position are read in one snapshot. Changes
+    queued after it stay queued and are applied on top of the rebuilt
+    grids.
+
+    Returns:
+        tuple: (routes rasterized, tiles written).
+    """
+
+    if connection.in_transaction:
+        connection.commit()
+
+    connection.execute("BEGIN")
+    last_change = connection.execute("SELECT coalesce(max(id), 0) FROM heatmap_changes").fetchone()[0]
+    routes = [row[0] for row in connection.execute("SELECT coordinates FROM routes")]
+    connection.commit()
+
+    chunks = [routes[i:i + REBUILD_CHUNK_SIZE] for i in range(0, len(routes), REBUILD_CHUNK_SIZE)]
+    workers = workers or os.cpu_count() or 1
+
+    with timed("heatmap_rebuild"):
+        total = {}
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers = min(workers, len(chunks))) as pool:
+                for partial in pool.map(_rasterize_chunk, chunks):
+                    _merge(total, partial)
+        else:
+            for chunk in chunks:
+                _merge(total, _rasterize_chunk(chunk))
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM heatmap_tiles")
+            _write_deltas(connection, total)
+            connection.execute("DELETE FROM heatmap_changes WHERE id <= ?", (last_change,))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    log_event("heatmap_rebuilt", routes = len(routes), tiles = len(total), workers = workers)
+    return len(routes), len(total)
+
+
+
+# ===========================================================
+#                    Rendering
+# ===========================================================
+def valid_heatmap_tile(z, x, y):
+    return 0 <= z <= HEATMAP_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def load_heatmap_tile(connection, z, x, y):
+    """
+    Returns:
+        tuple: (counts array or None, ETag, max count at this zoom).
+            The ETag changes whenever the grid or the zoom's scale does.
+            The max count is one lookup in the `heatmap_tiles_peak` index.
+    """
+
+    row = connection.execute(
+        "SELECT counts FROM heatmap_tiles WHERE z = ? AND x = ? AND y = ?", (z, x, y)
+    ).fetchone()
+    max_count = connection.execute(
+        "SELECT coalesce(max(peak), 0) FROM heatmap_tiles WHERE z = ?", (z,)
+    ).fetchone()[0]
+
+    if row is None:
+        return None, f"{z}-{x}-{y}-empty-{max_count}", max_count
+    return _unpack(row[0]), f"{z}-{x}-{y}-{zlib.crc32(row[0]):08x}-{max_count}", max_count
+
+def _palette():
+    """
+    256 RGBA colours from transparent through blue and yellow to red.
+    """
+
+    stops = [(0.0, (0, 0, 255, 0)), (0.25, (0, 90, 255, 140)), (0.55, (255, 220, 0, 190)), (1.0, (220, 20, 20, 230))]
+    colours = []
+    for i in range(256):
+        t = i / 255
+        for (t0, c0), (t1, c1) in zip(stops, stops[1:]):
+            if t <= t1:
+                f = (t - t0) / (t1 - t0)
+                colours.append(bytes(round(a + (b - a) * f) for a, b in zip(c0, c1)))
+                break
+    return colours
+
+PALETTE = _palette()
+
+def render_png(counts, max_count):
+    """
+    Colours a grid on a log scale relative to the busiest cell at this
+    zoom, upscaled to a 256 px tile.
+    """
+
+    from PIL import Image
+
+    image = Image.new("RGBA", (GRID_SIZE, GRID_SIZE), (0, 0, 0, 0))
+    if counts is not None and max_count > 0:
+        scale = 255 / log1p(max_count)
+        pixels = b"".join(
+            PALETTE[min(255, round(log1p(count) * scale))] if count else PALETTE[0]
+            for count in counts
+        )
+        image = Image.frombytes("RGBA", (GRID_SIZE, GRID_SIZE), pixels)
+
+    image = image.resize((TILE_PIXELS, TILE_PIXELS), Image.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, format = "PNG", optimize = False)
+    return output.getvalue()
+
+def heatmap_json(counts, max_count, z, x, y):
+    """
+    Sparse JSON form of a grid: [column, row, count] for non-empty cells.
+    """
+
+    cells = [] if counts is None else [
+        [index % GRID_SIZE, index // GRID_SIZE, count]
+        for index, count in enumerate(counts) if count
+    ]
+    return {"z": z, "x": x, "y": y, "size": GRID_SIZE, "max_count": max_count, "cells": cells}
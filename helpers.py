@@ -5,29 +5,56 @@ database interaction, validation, and static map generation.
 This module includes:
     - SQLite database helpers
     - Authentication decorators
-    - Elevation data handling and caching
+    - Elevation data handling and caching (via `elevation` providers)
     - Haversine distance calculations
+    - Distance-based route resampling
+    - Single and batch route metric processing
     - Coordinate validation
     - Static map image generation
+
+The routing client, HTTP and map rendering libraries are imported on
+first use (see startup.py).
 """ 
 
 
 import json
 import os
-import openrouteservice
 import sqlite3
+import time
+import uuid
 from datetime import datetime
 from functools import wraps
-from math import atan2, cos, radians, sin, sqrt
-import requests
+from itertools import accumulate
+from math import asin, atan2, cos, radians, sin, sqrt
+from cache import TTLCache
+from elevation import provider_from_env
 from flask import flash, g, redirect, session
-from staticmap import CircleMarker, Line, StaticMap
-
-
-
-DATABASE = "route_manager.db"
-ELEVATION_API_URL = "https://api.opentopodata.org/v1/mapzen"
-elevation_cache = {}
+from metrics import increment, log_error, observe, timed
+from ordering import DEFAULT_TIME_BUDGET, haversine_matrix, optimize_order
+from resilience import external_timeout, get_breaker, NEGATIVE_CACHE_TTL, StaleCache
+from routing import load_graph, RoutingError
+
+
+
+DATABASE = os.getenv("DATABASE_PATH", "route_manager.db")
+ORS_BASE_URL = "https://api.openrouteservice.org"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+TILE_URL_TEMPLATE = "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
+ROUTING_GRAPH = "routing.graph"
+ROUTING_BACKENDS = ("local", "ors")
+RESAMPLE_STEP_METERS = 25
+RESAMPLE_MAX_SAMPLES = 1000
+USER_CACHE_TTL = 60
+ROUTE_CACHE_TTL = 3600                  # Routed geometries: fresh for an hour,
+ROUTE_CACHE_STALE_TTL = 86400           # then served stale for a day while refreshed
+COUNTRY_CACHE_TTL = 7 * 86400
+COUNTRY_CACHE_STALE_TTL = 30 * 86400
+elevation_cache = {}                    # Real elevations only
+elevation_misses = TTLCache(ttl = NEGATIVE_CACHE_TTL, max_size = 100_000)
+elevation_provider = None
+user_cache = TTLCache(ttl = USER_CACHE_TTL, max_size = 4096)
+route_cache = StaleCache("ors_route", ROUTE_CACHE_TTL, ROUTE_CACHE_STALE_TTL, max_size = 512)
+country_cache = StaleCache("country", COUNTRY_CACHE_TTL, COUNTRY_CACHE_STALE_TTL, max_size = 4096)
 
 
 
@@ -68,20 +95,59 @@ def query_db(query, args = (), commit = False):
         list[sqlite3.Row] or None: Query results or None if committing.
     """
 
-    connection = get_db()
-    current = connection.cursor()
-    current.execute(query, args)
-    
-    if commit:
-        connection.commit()
-    else:
-        return current.fetchall()
+    start = time.perf_counter()
+    statement = query.lstrip().split(None, 1)[0].upper() if query.strip() else "EMPTY"
+
+    try:
+        connection = get_db()
+        current = connection.cursor()
+        current.execute(query, args)
+
+        if commit:
+            connection.commit()
+        else:
+            return current.fetchall()
+    finally:
+        observe("db_query_duration_seconds", time.perf_counter() - start, statement = statement)
     
 
 
 # ===========================================================
 #                    Authentication
 # ===========================================================
+def get_user(user_id):
+    """
+    Returns the public fields of a user, cached per worker for
+    `USER_CACHE_TTL` seconds.
+
+    Args:
+        user_id (int): The user's id.
+    Returns:
+        dict | None: {'id', 'username', 'email', 'profile_picture'},
+            or None if there is no such user.
+    """
+
+    user = user_cache.get(user_id)
+    increment("cache_requests_total", cache = "user", result = "miss" if user is None else "hit")
+    if user is None:
+        rows = query_db(
+            "SELECT id, username, email, profile_picture FROM users WHERE id = ?",
+            (user_id,)
+        )
+        if not rows:
+            return None
+        user = dict(rows[0])
+        user_cache.set(user_id, user)
+    return user
+
+def invalidate_user(user_id):
+    """
+    Drops a user from this worker's cache after their record changes.
+    Other workers pick up the change within `USER_CACHE_TTL`.
+    """
+
+    user_cache.pop(user_id)
+
 def login_required(f):
     """
     Flask route decorator to ensure user is logged in.
@@ -170,43 +236,203 @@ def calculate_distance(coords):
 
     return round(total_distance, 2)
 
+def calculate_distances(routes):
+    """
+    Calculates the total distance of many routes at once.
+
+    The points of all routes are converted to column lists of radians
+    (and latitude cosines) together, and every segment of every route
+    is computed in a single `zip` pass into running totals. Each route's
+    distance is then the difference of two totals. The segments joining
+    one route's last point to the next route's first are computed too,
+    but fall outside every route's range.
+
+    Args:
+        routes (list[list[dict]]): One list of {'lat', 'lng'} points per route.
+    Returns:
+        list[float]: Distance of each route in kilometers, rounded to 2 decimals.
+    """
+
+    R = 6371.0  # Earth's radius in km
+
+    lats = [radians(c["lat"]) for coords in routes for c in coords]
+    lngs = [radians(c["lng"]) for coords in routes for c in coords]
+    cos_lats = [cos(lat) for lat in lats]
+
+    # asin(sqrt(a)) == atan2(sqrt(a), sqrt(1 - a)) for 0 <= a <= 1
+    totals = list(accumulate(
+        (
+            asin(sqrt(min(1.0, sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lng2 - lng1) / 2) ** 2)))
+            for lat1, lat2, lng1, lng2, cos1, cos2 in zip(
+                lats, lats[1:], lngs, lngs[1:], cos_lats, cos_lats[1:]
+            )
+        ),
+        initial = 0.0
+    ))
+
+    distances = []
+    start = 0
+    for coords in routes:
+        end = start + len(coords)
+        # Segments start .. end - 2 belong to this route
+        distances.append(round(2 * R * (totals[max(end - 1, start)] - totals[start]), 2))
+        start = end
+
+    return distances
+
+
+
+# ===========================================================
+#                    Route Resampling 
+# ===========================================================
+def resample_route(coordinates, step_meters = RESAMPLE_STEP_METERS, max_samples = RESAMPLE_MAX_SAMPLES):
+    """
+    Interpolates a route at a fixed distance step.
+
+    Sparse routes get intermediate points every `step_meters`, dense
+    routes are thinned to the same spacing. When the route is too long
+    for `max_samples` points the step is widened so the count is capped.
+    The first and last points are always kept.
+
+    Args:
+        coordinates (list[dict]): List of {'lat': float, 'lng': float} points.
+        step_meters (float): Target distance between samples.
+        max_samples (int): Maximum number of samples returned.
+    Returns:
+        list[dict]: Resampled {'lat', 'lng'} points, rounded to 6 decimals.
+    """
+
+    if len(coordinates) < 2:
+        return [
+            {"lat": round(c["lat"], 6), "lng": round(c["lng"], 6)}
+            for c in coordinates
+        ]
+
+    segment_lengths = [
+        haversine(coordinates[i], coordinates[i + 1]) * 1000
+        for i in range(len(coordinates) - 1)
+    ]
+    total_length = sum(segment_lengths)
+
+    if total_length == 0:
+        return [{"lat": round(coordinates[0]["lat"], 6), "lng": round(coordinates[0]["lng"], 6)}]
+
+    step = max(step_meters, total_length / max(max_samples - 1, 1))
+
+    samples = []
+    segment = 0
+    segment_start = 0.0
+    target = 0.0
+
+    while target < total_length:
+        while (segment < len(segment_lengths) - 1 and
+               segment_start + segment_lengths[segment] < target):
+            segment_start += segment_lengths[segment]
+            segment += 1
+
+        a, b = coordinates[segment], coordinates[segment + 1]
+        length = segment_lengths[segment]
+        t = (target - segment_start) / length if length else 0.0
+
+        samples.append({
+            "lat": round(a["lat"] + (b["lat"] - a["lat"]) * t, 6),
+            "lng": round(a["lng"] + (b["lng"] - a["lng"]) * t, 6)
+        })
+        target += step
+
+    samples.append({
+        "lat": round(coordinates[-1]["lat"], 6),
+        "lng": round(coordinates[-1]["lng"], 6)
+    })
+    return samples
+
 
 
 # ===========================================================
 #                    Elevation Calculations 
 # ===========================================================
+def get_elevation_provider():
+    """
+    Returns the elevation provider used by `get_elevations`.
+    Built on first use from the environment (see `elevation.provider_from_env`),
+    so `.env` values loaded after import are honoured.
+    """
+
+    global elevation_provider
+    if elevation_provider is None:
+        elevation_provider = provider_from_env()
+    return elevation_provider
+
+def set_elevation_provider(provider):
+    """
+    Replaces the elevation provider (e.g. local DEM tiles or a test stub).
+    """
+
+    global elevation_provider
+    elevation_provider = provider
+
 def get_elevations(coordinates, batch_size = 100):
     """
     Fetches elevation data for a list of coordinates using batch requests.
     Splits requests into batches to avoid exceeding URL length limits.
     Caches results in `elevation_cache` to avoid redundant requests.
+    Lookups go through the configured elevation provider (local DEM
+    tiles first when available, the remote API otherwise).
+
+    Points the provider could not resolve (e.g. the API is down) are
+    left out of `elevation_cache` and remembered in `elevation_misses`
+    for `NEGATIVE_CACHE_TTL` seconds, after which they are retried.
     """
-    uncached = [
-        (coord["lat"], coord["lng"]) 
-        for coord in coordinates 
+    missing = [
+        (coord["lat"], coord["lng"])
+        for coord in coordinates
         if (coord["lat"], coord["lng"]) not in elevation_cache
     ]
+    uncached = [
+        point for point in dict.fromkeys(missing)
+        if elevation_misses.get(point) is None
+    ]
+
+    increment("cache_requests_total", len(coordinates) - len(missing), cache = "elevation", result = "hit")
+    increment("cache_requests_total", len(uncached), cache = "elevation", result = "miss")
+    increment("cache_requests_total", len(missing) - len(uncached), cache = "elevation", result = "negative")
 
     if not uncached:
-        return  # All elevations already cached
+        return  # All elevations already cached (or recently failed)
+
+    provider = get_elevation_provider()
 
     for i in range(0, len(uncached), batch_size):
         batch = uncached[i:i + batch_size]
-        locations_str = "|".join(f"{lat},{lng}" for lat, lng in batch)
-        try:
-            response = requests.get(ELEVATION_API_URL, params={"locations": locations_str})
-            response.raise_for_status()
-            data = response.json()
-            
-            results = data.get("results", [])
-            for (lat, lng), result in zip(batch, results):
-                elevation = result.get("elevation", 0)
-                elevation_cache[(lat, lng)] = elevation
-        
-        except Exception as e:
-            print(f"Elevation API batch error: {e}")
-            for lat, lng in batch:
-                elevation_cache[(lat, lng)] = 0
+        with timed("elevation_batch", provider = provider.name):
+            elevations = provider.lookup(batch)
+
+        for point, elevation in zip(batch, elevations):
+            if elevation is None:
+                elevation_misses.set(point, True)
+            else:
+                elevation_cache[point] = elevation
+
+def known_elevations(points):
+    """
+    Cached elevations of `points`. A point without one takes the
+    previous known elevation (the next one at the start of the list),
+    so gaps add no fake climb; 0 when none is known.
+
+    Returns:
+        tuple: (elevations, number of points without an elevation).
+    """
+
+    elevations = [elevation_cache.get((p["lat"], p["lng"])) for p in points]
+    missing = elevations.count(None)
+    if missing:
+        last = next((e for e in elevations if e is not None), 0)
+        for i, elevation in enumerate(elevations):
+            if elevation is None:
+                elevations[i] = last
+            else:
+                last = elevation
+    return elevations, missing
 
 
 
@@ -248,54 +474,141 @@ def calculate_elevation_stats(elevation_profile):
 # ===========================================================
 #                    Route Processing 
 # ===========================================================
-def process_route_internal(coordinates):
+def _empty_metrics():
+    return {
+        "total_distance": 0,
+        "elevation_gain": 0,
+        "elevation_loss": 0,
+        "max_elevation": 0,
+        "min_elevation": 0,
+        "average_elevation": 0,
+        "elevation_missing": 0
+    }
+
+def _route_metrics(distance, samples):
+    """
+    Builds the metrics dict of a route from its distance and its
+    elevation samples (looked up in `elevation_cache`). Samples with
+    no elevation are counted in `elevation_missing`.
+    """
+
+    elevations, missing = known_elevations(samples)
+    elevation_profile = [{
+        "lat": coord["lat"],
+        "lng": coord["lng"],
+        "elevation": elevation
+    } for coord, elevation in zip(samples, elevations)]
+
+    total_elevation = sum(p['elevation'] for p in elevation_profile)
+    avg_elevation = total_elevation / len(elevation_profile) if elevation_profile else 0
+    gain, loss, max_elev, min_elev = calculate_elevation_stats(elevation_profile)
+
+    return {
+        "total_distance": distance,
+        "elevation_gain": gain,
+        "elevation_loss": loss,
+        "max_elevation": max_elev,
+        "min_elevation": min_elev,
+        "average_elevation": round(avg_elevation, 2),
+        "elevation_missing": missing
+    }
+
+def process_route_internal(coordinates, step_meters = RESAMPLE_STEP_METERS, max_samples = RESAMPLE_MAX_SAMPLES):
     """
     Calculates route metrics such as distance and elevation profile.
+    Elevation is sampled on the route resampled every `step_meters`
+    (see `resample_route`), so the number of lookups does not depend
+    on how dense the input geometry is.
 
     Args:
         coordinates (list[dict]): List of {'lat': float, 'lng': float} points.
+        step_meters (float): Distance between elevation samples.
+        max_samples (int): Maximum number of elevation samples.
     Returns:
         dict: Calculated metrics (distance, elevation gain/loss, min/max/avg elevation).
     """
     try:
         distance = calculate_distance(coordinates)
+        samples = resample_route(coordinates, step_meters, max_samples)
 
         # Fetch all elevations in batches of 100
-        get_elevations(coordinates, batch_size = 100)
-
-        elevation_profile = [{
-            "lat": coord["lat"],
-            "lng": coord["lng"],
-            "elevation": elevation_cache.get((coord["lat"], coord["lng"]), 0)
-        } for coord in coordinates]
-
-        total_elevation = sum(p['elevation'] for p in elevation_profile)
-        avg_elevation = total_elevation / len(elevation_profile) if elevation_profile else 0
-        gain, loss, max_elev, min_elev = calculate_elevation_stats(elevation_profile)
-
-        return {
-            "total_distance": distance,
-            "elevation_gain": gain,
-            "elevation_loss": loss,
-            "max_elevation": max_elev,
-            "min_elevation": min_elev,
-            "average_elevation": round(avg_elevation, 2)
-        }
+        get_elevations(samples, batch_size = 100)
+
+        return _route_metrics(distance, samples)
 
     except Exception as e:
-        print(f"Error processing route internally: {e}")
-        return {
-            "total_distance": 0,
-            "elevation_gain": 0,
-            "elevation_loss": 0,
-            "max_elevation": 0,
-            "min_elevation": 0,
-            "average_elevation": 0
-        }
+        log_error("process_route_failed", e)
+        return _empty_metrics()
+
+def process_routes_batch(routes, step_meters = RESAMPLE_STEP_METERS, max_samples = RESAMPLE_MAX_SAMPLES):
+    """
+    Calculates metrics for many routes in one pass.
+
+    All routes are resampled first; the elevation samples of every
+    route are then deduplicated and fetched with a single
+    `get_elevations` call, and distances are computed together by
+    `calculate_distances`. A route that fails gets zeroed metrics
+    without affecting the others.
+
+    Args:
+        routes (list[list[dict]]): One list of {'lat', 'lng'} points per route.
+        step_meters (float): Distance between elevation samples.
+        max_samples (int): Maximum number of elevation samples per route.
+    Returns:
+        list[dict]: Metrics per route, in the same order as `routes`.
+    """
+
+    distances = calculate_distances(routes)
+    samples = [resample_route(coords, step_meters, max_samples) for coords in routes]
+
+    try:
+        get_elevations(
+            [point for route_samples in samples for point in route_samples],
+            batch_size = 100
+        )
+    except Exception as e:
+        log_error("batch_elevations_failed", e)
+
+    results = []
+    for distance, route_samples in zip(distances, samples):
+        try:
+            results.append(_route_metrics(distance, route_samples))
+        except Exception as e:
+            log_error("process_route_failed", e)
+            results.append(_empty_metrics())
+    return results
+
+def routing_backends():
+    """
+    Routing backends to try in order, from ROUTING_BACKEND
+    ('ors' by default, 'local', or e.g. 'local,ors').
+
+    Raises:
+        ValueError: A name is not in `ROUTING_BACKENDS`.
+    """
+
+    backends = [b.strip() for b in os.getenv("ROUTING_BACKEND", "ors").split(",") if b.strip()]
+    unknown = [b for b in backends if b not in ROUTING_BACKENDS]
+    if unknown or not backends:
+        raise ValueError(
+            f"Unknown routing backend {', '.join(unknown) or '(none)'}; "
+            f"ROUTING_BACKEND takes {', '.join(ROUTING_BACKENDS)}"
+        )
+    return backends
+
+def get_local_router():
+    """
+    Returns the local routing graph (see `routing`), mapped on first use.
+    """
+
+    return load_graph(os.getenv("ROUTING_GRAPH", ROUTING_GRAPH))
 
 def get_realistic_route(points, api_key, profile = "foot-walking"):
     """
-    Calls OpenRouteService Directions API to get a realistic route geometry.
+    Gets a realistic route geometry from the configured routing backends:
+    the local OSM graph and/or the OpenRouteService Directions API.
+    A backend that fails hands over to the next one.
+
     Args:
         points (list): List of {'lat': float, 'lng': float} dicts (start, waypoints, end)
         api_key (str): ORS API key.
@@ -304,9 +617,79 @@ def get_realistic_route(points, api_key, profile = "foot-walking"):
         list[dict]: List of {'lat': float, 'lng': float} points along the route.
     """
 
-    client = openrouteservice.Client(key = api_key)
+    backends = routing_backends()
+
+    for i, backend in enumerate(backends):
+        try:
+            if backend == "local":
+                with timed("local_route", profile = profile):
+                    return get_local_router().route(points, profile)
+            return _ors_route(points, api_key, profile)
+        except RoutingError as e:
+            increment("routing_fallbacks_total", backend = backend)
+            if i == len(backends) - 1:
+                raise
+            log_error(f"{backend}_route_failed", e, profile = profile)
+
+def _ors_client(api_key):
+    """
+    OpenRouteService client that fails after `EXTERNAL_TIMEOUT` seconds
+    instead of retrying rate-limited calls for a minute.
+    """
+
+    import openrouteservice
+
+    return openrouteservice.Client(
+        key = api_key,
+        base_url = os.getenv("ORS_BASE_URL", ORS_BASE_URL),
+        timeout = external_timeout(),
+        retry_over_query_limit = False
+    )
+
+def _ors_unhealthy(error):
+    """
+    Whether an ORS error counts against its circuit breaker: network
+    errors, rate limiting and server errors do, a request ORS rejects
+    (e.g. no route between the points) does not.
+    """
+
+    status = getattr(error, "status", None)
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+def _ors_route(points, api_key, profile):
+    """
+    Gets a route geometry from OpenRouteService, cached in `route_cache`
+    (stale geometries are served while being refreshed).
+    """
+
+    key = (profile, tuple((p["lat"], p["lng"]) for p in points))
+    try:
+        return route_cache.get(key, lambda: _ors_directions(points, api_key, profile))
+    except RoutingError:
+        raise
+    except Exception as e:
+        # API errors, timeouts and an open breaker: let the next backend try
+        raise RoutingError(f"OpenRouteService: {e}") from e
+
+def _ors_directions(points, api_key, profile):
+    """
+    Calls OpenRouteService Directions API to get a realistic route geometry.
+    """
+
+    client = _ors_client(api_key)
     coords = [[p["lng"], p["lat"]] for p in points] 
-    route = client.directions(coords, profile = profile, format = "geojson")
+
+    with timed("ors_directions", profile = profile):
+        try:
+            route = get_breaker("ors").call(
+                client.directions, coords,
+                profile = profile, format = "geojson",
+                is_failure = _ors_unhealthy
+            )
+        except Exception:
+            increment("external_errors_total", service = "ors")
+            raise
+
     geometry = route['features'][0]['geometry']['coordinates']
     
     return [
@@ -318,10 +701,109 @@ def get_realistic_route(points, api_key, profile = "foot-walking"):
     ]
 
 
+def get_travel_time_matrix(points, api_key, profile = "foot-walking"):
+    """
+    Gets the routed travel times between all pairs of points from the
+    configured routing backends, falling back like `get_realistic_route`.
+
+    Returns:
+        list[list[float]]: Seconds from points[i] to points[j]
+            (inf where the backend found no path).
+    """
+
+    backends = routing_backends()
+
+    for i, backend in enumerate(backends):
+        try:
+            if backend == "local":
+                with timed("local_matrix", profile = profile):
+                    return get_local_router().matrix(points, profile)
+            return _ors_matrix(points, api_key, profile)
+        except RoutingError as e:
+            increment("routing_fallbacks_total", backend = backend)
+            if i == len(backends) - 1:
+                raise
+            log_error(f"{backend}_matrix_failed", e, profile = profile)
+
+def _ors_matrix(points, api_key, profile):
+    """
+    Calls the OpenRouteService Matrix API for a duration matrix.
+    """
+
+    client = _ors_client(api_key)
+    coords = [[p["lng"], p["lat"]] for p in points]
+
+    with timed("ors_matrix", profile = profile):
+        try:
+            response = get_breaker("ors").call(
+                client.distance_matrix, coords,
+                profile = profile, metrics = ["duration"],
+                is_failure = _ors_unhealthy
+            )
+        except Exception as e:
+            increment("external_errors_total", service = "ors")
+            # API errors, timeouts and an open breaker: let the next backend try
+            raise RoutingError(f"OpenRouteService: {e}") from e
+
+    return [
+        [float("inf") if seconds is None else seconds for seconds in row]
+        for row in response["durations"]
+    ]
+
+
+def optimize_stop_order(points, api_key, profile = "foot-walking", metric = "distance", time_budget = DEFAULT_TIME_BUDGET):
+    """
+    Reorders the stops between the start and the end of a route to
+    shorten it (see `ordering`).
+
+    With metric 'duration' the travel times come from the routing
+    backends; if they fail, straight-line distances are used instead.
+
+    Args:
+        points (list[dict]): {'lat', 'lng'} start, stops and end.
+        api_key (str): ORS API key.
+        profile (str): Routing profile, e.g., 'foot-walking'.
+        metric (str): 'distance' (straight line) or 'duration' (routed).
+        time_budget (float): Seconds allowed for the local search.
+    Returns:
+        tuple: (order as indexes into `points`, metric actually used).
+    """
+
+    matrix = None
+    if metric == "duration":
+        try:
+            matrix = get_travel_time_matrix(points, api_key, profile)
+        except Exception as e:
+            log_error("travel_time_matrix_failed", e, profile = profile)
+            metric = "distance"
+
+    if matrix is None:
+        matrix = haversine_matrix(points)
+
+    with timed("optimize_order", metric = metric):
+        order, before, after = optimize_order(matrix, time_budget)
+
+    if before > 0:
+        observe("optimize_order_saving_ratio", 1 - after / before, metric = metric)
+    return order, metric
+
+
 
 # ===========================================================
 #                    Coordinate Validation 
 # ===========================================================
+def valid_point(lat, lng):
+    """
+    Whether a latitude and longitude are numbers (not booleans) within
+    [-90, 90] and [-180, 180].
+    """
+
+    return (
+        all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (lat, lng)) and
+        -90 <= lat <= 90 and
+        -180 <= lng <= 180
+    )
+
 def validate_coordinates(coordinates_json):
     """
     Validates and sanitizes raw coordinate JSON 
@@ -345,7 +827,7 @@ def validate_coordinates(coordinates_json):
             if (
                 isinstance(pair, list) and
                 len(pair) == 2 and
-                all(isinstance(p, (int, float)) for p in pair)
+                valid_point(*pair)
             ):
                 valid_coords.append([round(float(pair[0]), 6), round(float(pair[1]), 6)])
             else:
@@ -369,10 +851,29 @@ def get_country_from_coords(lat, lng):
     """
     Uses Nominatim to reverse geocode a coordinate to a country name.
     Returns the country name as a string, or None if not found.
+
+    Answers are cached per ~1 km cell in `country_cache`; failures
+    (including an open circuit breaker) are cached briefly and give None.
     """
 
     try:
-        url = "https://nominatim.openstreetmap.org/reverse"
+        return country_cache.get(
+            (round(lat, 2), round(lng, 2)),
+            lambda: get_breaker("nominatim").call(_reverse_geocode, lat, lng)
+        )
+    except Exception as e:
+        log_error("reverse_geocoding_failed", e, lat = lat, lng = lng)
+        return None
+
+def _reverse_geocode(lat, lng):
+    """
+    Calls the Nominatim reverse geocoding API.
+    """
+
+    import requests
+
+    try:
+        url = os.getenv("NOMINATIM_URL", NOMINATIM_URL)
         params = {
             "lat": lat,
             "lon": lng,
@@ -384,15 +885,16 @@ def get_country_from_coords(lat, lng):
             "User-Agent": "RouteAppManager/1.0 (your@email.com)"
         }
 
-        resp = requests.get(url, params = params, headers = headers, timeout = 5)
-        resp.raise_for_status()
-        data = resp.json()
+        with timed("nominatim_reverse"):
+            resp = requests.get(url, params = params, headers = headers, timeout = min(5, external_timeout()))
+            resp.raise_for_status()
+            data = resp.json()
 
         return data.get("address", {}).get("country")
     
-    except Exception as e:
-        print(f"Reverse geocoding failed: {e}")
-        return None
+    except Exception:
+        increment("external_errors_total", service = "nominatim")
+        raise
 
 
     
@@ -420,7 +922,9 @@ def generate_route_image(validated_coords, waypoints = None, save_folder = 'stat
     if not validated_coords or len(validated_coords) < 2:
         return None
 
-    m = StaticMap(600, 400)
+    from staticmap import CircleMarker, Line, StaticMap
+
+    m = StaticMap(600, 400, url_template = os.getenv("TILE_URL_TEMPLATE", TILE_URL_TEMPLATE))
 
     start_lat, start_lng = validated_coords[0]
     m.add_marker(CircleMarker((start_lng, start_lat), 'green', 12))
@@ -435,14 +939,17 @@ def generate_route_image(validated_coords, waypoints = None, save_folder = 'stat
     line_coords = [(lng, lat) for lat, lng in validated_coords]
     m.add_line(Line(line_coords, 'blue', 3))
 
-    image = m.render()
+    with timed("tile_download"):
+        image = m.render()
 
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    filename = f"route_{timestamp}.png"
+    # Suffixed, since imports render several maps per second
+    filename = f"route_{timestamp}_{uuid.uuid4().hex[:8]}.png"
     file_path = os.path.join(save_folder, filename)
 
     os.makedirs(save_folder, exist_ok=True)
-    image.save(file_path, format='PNG')
+    with timed("png_encode"):
+        image.save(file_path, format='PNG')
     
     return filename
 
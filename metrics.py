@@ -0,0 +1,213 @@
+"""
+Lightweight in-process instrumentation for the hot paths of the app.
+
+This module includes:
+    - Thread-safe counters, gauges and latency histograms
+    - A `timed` context manager / decorator for stage timings
+    - Prometheus text exposition for the `/metrics` endpoint
+    - Structured (JSON) logging carrying the current request id
+
+Metrics live in the memory of each worker process; with several
+gunicorn workers every scrape reflects the worker that answered it.
+"""
+
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("route_manager")
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_help = {}
+
+
+
+# ===========================================================
+#                    Recording
+# ===========================================================
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def describe(name, text):
+    """
+    Registers the HELP text shown for a metric.
+    """
+
+    _help[name] = text
+
+def increment(name, amount = 1, **labels):
+    """
+    Adds `amount` to the counter `name` with the given labels.
+    """
+
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    """
+    Sets the gauge `name` with the given labels to `value`.
+    """
+
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def observe(name, value, **labels):
+    """
+    Records one observation (in seconds) in the histogram `name`.
+    """
+
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+
+        buckets = histogram[0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+@contextmanager
+def timed(stage, **labels):
+    """
+    Times the enclosed block into the `stage_duration_seconds` histogram.
+    Exceptions are counted in `stage_errors_total` and re-raised.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment("stage_errors_total", stage = stage, **labels)
+        raise
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - start, stage = stage, **labels)
+
+def reset():
+    """
+    Clears all recorded metrics.
+    """
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+
+
+
+# ===========================================================
+#                    Exposition
+# ===========================================================
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra = None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    body = ",".join(
+        f'{k}="{_escape(v)}"'
+        for k, v in items
+    )
+    return "{" + body + "}"
+
+def render_prometheus():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+
+    lines = []
+    seen = set()
+
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+
+# ===========================================================
+#                    Structured Logging
+# ===========================================================
+def current_request_id():
+    """
+    Returns the id of the request being served, or None outside a request.
+    """
+
+    if has_request_context():
+        return getattr(g, "request_id", None)
+    return None
+
+def log_event(event, level = logging.INFO, **fields):
+    """
+    Logs a single JSON line with the event name, the request id and `fields`.
+    """
+
+    record = {"event": event, "request_id": current_request_id(), **fields}
+    logger.log(level, json.dumps(record, default = str))
+
+def log_error(event, error, **fields):
+    """
+    Logs an error event and counts it in `errors_total`.
+    """
+
+    increment("errors_total", event = event)
+    log_event(event, logging.ERROR, error = str(error), **fields)
+
+
+
+describe("stage_duration_seconds", "Duration of instrumented processing stages.")
+describe("stage_errors_total", "Exceptions raised inside instrumented stages.")
+describe("external_errors_total", "Failed calls to external services.")
+describe("cache_requests_total", "Cache lookups by cache and result (hit/miss).")
+describe("db_query_duration_seconds", "Duration of query_db calls by statement type.")
+describe("http_request_duration_seconds", "Duration of HTTP requests by endpoint.")
+describe("errors_total", "Errors logged by event.")
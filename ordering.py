@@ -0,0 +1,221 @@
+"""
+Waypoint order optimization for multi-destination routes.
+
+The start and the end of a route stay where the user put them, and the
+stops in between are reordered to make the trip shorter (an open
+travelling salesman path). Exact solutions are out of reach beyond a
+dozen stops. A nearest-neighbour tour improved by 2-opt and Or-opt
+moves gets within a few percent of optimal for dozens of stops in
+milliseconds.
+
+This module includes:
+    - A straight-line (haversine) distance matrix
+    - Nearest-neighbour construction
+    - 2-opt and Or-opt local search, stopped by a time budget
+"""
+
+
+import time
+from math import asin, cos, isfinite, radians, sin, sqrt
+
+
+
+DEFAULT_TIME_BUDGET = 0.2       # Seconds of local search per request
+MAX_ORDER_POINTS = 100
+OR_OPT_MAX_SEGMENT = 3
+UNREACHABLE = 1e12              # Cost used for pairs the router could not connect
+EPSILON = 1e-9
+
+
+
+def haversine_matrix(points):
+    """
+    Straight-line distances between all pairs of points. Every point is
+    converted to radians (and latitude cosine) once, so each entry is a
+    few float operations.
+
+    Args:
+        points (list[dict]): {'lat', 'lng'} points.
+    Returns:
+        list[list[float]]: Distances in kilometers.
+    """
+
+    R = 6371.0  # Earth's radius in km
+
+    lats = [radians(p["lat"]) for p in points]
+    lngs = [radians(p["lng"]) for p in points]
+    cos_lats = [cos(lat) for lat in lats]
+    columns = list(zip(lats, lngs, cos_lats))
+
+    return [
+        [
+            2 * R * asin(sqrt(min(1.0, sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lng2 - lng1) / 2) ** 2)))
+            for lat2, lng2, cos2 in columns
+        ]
+        for lat1, lng1, cos1 in columns
+    ]
+
+def path_cost(matrix, order):
+    """
+    Cost of visiting `order` from first to last.
+    """
+
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+
+# ===========================================================
+#                    Construction
+# ===========================================================
+def nearest_neighbour(matrix):
+    """
+    Builds a path from point 0 to the last point, always moving to the
+    closest unvisited stop.
+    """
+
+    last = len(matrix) - 1
+    order = [0]
+    remaining = list(range(1, last))
+
+    while remaining:
+        row = matrix[order[-1]]
+        closest = min(remaining, key = row.__getitem__)
+        remaining.remove(closest)
+        order.append(closest)
+
+    order.append(last)
+    return order
+
+
+
+# ===========================================================
+#                    Local Search
+# ===========================================================
+def _prefix_costs(matrix, order):
+    """
+    Running costs of the path walked forwards and backwards, so that
+    reversing any stretch is priced in O(1) even when the matrix is
+    asymmetric (one-way streets in a routed matrix).
+    """
+
+    forward, backward = [0.0], [0.0]
+    for a, b in zip(order, order[1:]):
+        forward.append(forward[-1] + matrix[a][b])
+        backward.append(backward[-1] + matrix[b][a])
+    return forward, backward
+
+def two_opt(matrix, order, deadline):
+    """
+    Reverses stretches of the path while that shortens it.
+
+    Returns:
+        bool: Whether any move was applied.
+    """
+
+    n = len(order)
+    improved = False
+    forward, backward = _prefix_costs(matrix, order)
+
+    for i in range(1, n - 2):
+        if time.perf_counter() > deadline:
+            break
+        before = order[i - 1]
+        for j in range(i + 1, n - 1):
+            after = order[j + 1]
+            delta = (
+                matrix[before][order[j]] + (backward[j] - backward[i]) + matrix[order[i]][after]
+                - matrix[before][order[i]] - (forward[j] - forward[i]) - matrix[order[j]][after]
+            )
+            if delta < -EPSILON:
+                order[i:j + 1] = order[i:j + 1][::-1]
+                forward, backward = _prefix_costs(matrix, order)
+                improved = True
+
+    return improved
+
+def or_opt(matrix, order, deadline):
+    """
+    Moves runs of 1 to `OR_OPT_MAX_SEGMENT` consecutive stops (possibly
+    reversed) to the place in the path where they cost the least.
+
+    Returns:
+        bool: Whether any move was applied.
+    """
+
+    improved = False
+
+    for length in range(1, OR_OPT_MAX_SEGMENT + 1):
+        i = 1
+        while i + length < len(order):
+            if time.perf_counter() > deadline:
+                return improved
+
+            n = len(order)
+            first, last = order[i], order[i + length - 1]
+            before, after = order[i - 1], order[i + length]
+            inner = path_cost(matrix, order[i:i + length])
+            inner_reversed = path_cost(matrix, order[i:i + length][::-1])
+            removal_gain = matrix[before][first] + matrix[last][after] - matrix[before][after]
+
+            best_delta, best_move = -EPSILON, None
+            for p in range(n - 1):
+                if i - 1 <= p < i + length:
+                    continue
+                a, b = order[p], order[p + 1]
+                edge = matrix[a][b]
+                delta = matrix[a][first] + matrix[last][b] - edge - removal_gain
+                if delta < best_delta:
+                    best_delta, best_move = delta, (p, False)
+                delta = matrix[a][last] + matrix[first][b] - edge + inner_reversed - inner - removal_gain
+                if delta < best_delta:
+                    best_delta, best_move = delta, (p, True)
+
+            if best_move is None:
+                i += 1
+                continue
+
+            p, reverse = best_move
+            segment = order[i:i + length]
+            if reverse:
+                segment.reverse()
+            del order[i:i + length]
+            position = p + 1 if p < i else p - length + 1
+            order[position:position] = segment
+            improved = True
+
+    return improved
+
+def optimize_order(matrix, time_budget = DEFAULT_TIME_BUDGET):
+    """
+    Orders the stops between the first and the last point.
+
+    Args:
+        matrix (list[list[float]]): Cost from point i to point j
+            (distance or travel time; may be asymmetric, inf if unreachable).
+        time_budget (float): Seconds allowed for local search. The
+            nearest-neighbour path is always built first.
+    Returns:
+        tuple: (order as point indexes starting with 0 and ending with
+            the last point, cost in the original order, cost in the new order).
+    """
+
+    n = len(matrix)
+    identity = list(range(n))
+    if n <= 3:
+        cost = path_cost(matrix, identity)
+        return identity, cost, cost
+
+    matrix = [[c if isfinite(c) else UNREACHABLE for c in row] for row in matrix]
+    deadline = time.perf_counter() + time_budget
+
+    order = nearest_neighbour(matrix)
+    if path_cost(matrix, identity) < path_cost(matrix, order):
+        order = identity[:]
+
+    while time.perf_counter() < deadline:
+        changed = two_opt(matrix, order, deadline)
+        changed = or_opt(matrix, order, deadline) or changed
+        if not changed:
+            break
+
+    return order, path_cost(matrix, identity), path_cost(matrix, order)
@@ -0,0 +1,147 @@
+"""
+Password hashing off the request threads.
+
+This module includes:
+    - A bounded worker pool for hashing and verifying passwords,
+      so a burst of logins uses at most a fixed number of cores
+    - Configurable Werkzeug hash method and cost parameters
+    - Detection of hashes made with older parameters (rehash on login)
+    - Hash latency and queue wait metrics
+
+Werkzeug hashes with `hashlib.scrypt` / `hashlib.pbkdf2_hmac`, which
+release the GIL, so a thread pool is enough to run them in parallel
+while keeping other request threads responsive.
+"""
+
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from metrics import increment, observe
+
+
+
+DEFAULTS = {
+    "PASSWORD_HASH_METHOD": "scrypt:32768:8:1",  # Werkzeug method string
+    "PASSWORD_HASH_WORKERS": 2,                  # Hashes running at once
+    "PASSWORD_HASH_QUEUE": 32,                   # Hashes waiting before rejecting
+}
+
+_executor = None
+_executor_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when more password hashes are queued than `PASSWORD_HASH_QUEUE`.
+    """
+
+
+
+# ===========================================================
+#                    Worker Pool
+# ===========================================================
+def _pool():
+    """
+    Returns the worker pool, (re)created after a fork so that every
+    gunicorn worker gets its own threads.
+    """
+
+    global _executor, _executor_pid, _slots
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                config = current_app.config
+                workers = config["PASSWORD_HASH_WORKERS"]
+                _executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "password-hash")
+                _slots = threading.BoundedSemaphore(workers + config["PASSWORD_HASH_QUEUE"])
+                _executor_pid = os.getpid()
+    return _executor, _slots
+
+def _run(operation, fn, *args):
+    """
+    Runs `fn(*args)` in the pool and waits for the result, recording
+    the time spent queued and hashing.
+    """
+
+    executor, slots = _pool()
+    if not slots.acquire(blocking = False):
+        increment("password_hash_rejected_total", operation = operation)
+        raise PasswordHasherBusy("Too many password hashes in progress")
+
+    method = current_app.config["PASSWORD_HASH_METHOD"].split(":")[0]
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        observe("password_hash_wait_seconds", started - submitted, operation = operation)
+        try:
+            return fn(*args)
+        finally:
+            observe("password_hash_duration_seconds", time.perf_counter() - started,
+                    operation = operation, method = method)
+
+    try:
+        return executor.submit(job).result()
+    finally:
+        slots.release()
+
+
+
+# ===========================================================
+#                    Hashing
+# ===========================================================
+def hash_password(password):
+    """
+    Hashes `password` with the configured method.
+
+    Returns:
+        str: Werkzeug hash string ('method$salt$hash').
+    """
+
+    return _run("hash", generate_password_hash, password, current_app.config["PASSWORD_HASH_METHOD"])
+
+def verify_password(password_hash, password):
+    """
+    Checks `password` against a stored hash.
+
+    Returns:
+        bool: True if the password matches.
+    """
+
+    return _run("verify", check_password_hash, password_hash, password)
+
+@lru_cache(maxsize = 8)
+def _method_prefix(method):
+    """
+    The method part of a hash made with `method`. Werkzeug writes it
+    out in full (e.g. 'scrypt' becomes 'scrypt:32768:8:1'), so it is
+    taken from one real hash, made once per process.
+    """
+
+    return generate_password_hash("", method).split("$", 1)[0]
+
+def needs_rehash(password_hash):
+    """
+    Returns True if `password_hash` was made with a method or cost
+    parameters other than the configured ones.
+    """
+
+    return password_hash.split("$", 1)[0] != _method_prefix(current_app.config["PASSWORD_HASH_METHOD"])
+
+def init_passwords(app):
+    """
+    Fills in the password settings missing from `app.config`.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
@@ -0,0 +1,186 @@
+"""
+Hand-off of `/get-route` results to `/create`, and the routed geometry
+of saved routes.
+
+The create form only sends the route's key points (start, waypoints,
+end) plus metrics the client could have changed. What the server
+computed for the route in `/get-route` (the routed geometry, metrics,
+analytics and fingerprint) is therefore kept here under a random
+token returned as `route_token`. `/create` claims it with that token
+and stores the routed geometry next to the route, so analytics,
+fingerprints, backfills and recalculations work on the same geometry
+`/get-route` measured, not on straight lines between the key points.
+
+This module includes:
+    - The `planned_routes` table (results waiting for `/create`)
+    - The `route_geometries` table, dropped by triggers when the
+      route's key points change or the route is deleted
+    - `route_points`, the geometry to measure a stored route on
+"""
+
+
+import json
+import time
+import uuid
+from array import array
+
+
+
+PLANNED_ROUTE_TTL = 24 * 3600           # Seconds a /get-route result waits for /create
+
+PLANNING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS planned_routes (
+    token TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    geometry TEXT NOT NULL,
+    details TEXT NOT NULL,
+    signature BLOB
+);
+
+CREATE TABLE IF NOT EXISTS route_geometries (
+    route_id INTEGER PRIMARY KEY,
+    geometry TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS route_geometries_on_delete
+AFTER DELETE ON routes
+BEGIN
+    DELETE FROM route_geometries WHERE route_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_geometries_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    DELETE FROM route_geometries WHERE route_id = OLD.id;
+END;
+"""
+
+
+
+def init_planning_schema(connection):
+    """
+    Creates the planned route and route geometry tables.
+    """
+
+    connection.executescript(PLANNING_SCHEMA)
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Planned Routes
+# ===========================================================
+def _encode(points):
+    return json.dumps([[round(p["lat"], 6), round(p["lng"], 6)] for p in points])
+
+def _decode(geometry):
+    return [{"lat": lat, "lng": lng} for lat, lng in json.loads(geometry)]
+
+def save_planned_route(connection, user_id, geometry, details, signature = None):
+    """
+    Keeps a `/get-route` result until the user saves the route.
+    Expired results are dropped on the way.
+
+    Args:
+        geometry (list[dict]): Routed {'lat', 'lng'} points.
+        details (dict): Metrics and analytics the server computed.
+        signature (list[int]): MinHash signature of the geometry.
+    Returns:
+        str: The token `/create` claims it with.
+    """
+
+    token = uuid.uuid4().hex
+    with connection:
+        connection.execute(
+            "DELETE FROM planned_routes WHERE created_at < ?",
+            (time.time() - PLANNED_ROUTE_TTL,)
+        )
+        connection.execute(
+            """INSERT INTO planned_routes
+            (token, user_id, created_at, geometry, details, signature)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (
+                token, user_id, time.time(), _encode(geometry), json.dumps(details),
+                array("Q", signature).tobytes() if signature else None
+            )
+        )
+    return token
+
+def claim_planned_route(connection, token, user_id):
+    """
+    Takes (and deletes) the `/get-route` result of a token, if it
+    belongs to `user_id` and has not expired. Runs in the caller's
+    transaction, which must commit it.
+
+    Returns:
+        dict: {'geometry', 'details', 'signature'} (signature may be
+            None), or None.
+    """
+
+    if not token:
+        return None
+
+    row = connection.execute(
+        """SELECT geometry, details, signature FROM planned_routes
+        WHERE token = ? AND user_id = ? AND created_at >= ?""",
+        (token, user_id, time.time() - PLANNED_ROUTE_TTL)
+    ).fetchone()
+    if row is None:
+        return None
+
+    connection.execute("DELETE FROM planned_routes WHERE token = ?", (token,))
+    geometry, details, signature = row
+    return {
+        "geometry": _decode(geometry),
+        "details": json.loads(details),
+        "signature": list(array("Q", signature)) if signature else None
+    }
+
+
+
+# ===========================================================
+#                    Route Geometries
+# ===========================================================
+def store_route_geometry(connection, route_id, geometry):
+    """
+    Stores the routed geometry of a saved route (in the caller's
+    transaction).
+    """
+
+    connection.execute(
+        "INSERT OR REPLACE INTO route_geometries (route_id, geometry) VALUES (?, ?)",
+        (route_id, _encode(geometry))
+    )
+
+def route_geometry(connection, route_id):
+    """
+    Routed geometry of a saved route, or None when only its key points
+    are known (drawn and imported routes, older routes, or routes whose
+    key points were edited since).
+    """
+
+    row = connection.execute(
+        "SELECT geometry FROM route_geometries WHERE route_id = ?", (route_id,)
+    ).fetchone()
+    return _decode(row[0]) if row else None
+
+def route_points(connection, route_id, coordinates_json):
+    """
+    The points to measure a stored route on: its routed geometry when
+    stored, else its `coordinates` column.
+
+    Returns:
+        tuple: ({'lat', 'lng'} points, whether they are the routed geometry).
+    """
+
+    geometry = route_geometry(connection, route_id)
+    if geometry is not None:
+        return geometry, True
+
+    try:
+        points = [{"lat": float(lat), "lng": float(lng)} for lat, lng in json.loads(coordinates_json)]
+    except (TypeError, ValueError):
+        points = []
+    return points, False
@@ -0,0 +1,203 @@
+"""
+Speculative prefetch of route data while the user is still editing.
+
+As soon as the planner knows the start, the end and the stops, the
+browser posts them to `/prefetch-route`. A background worker then
+fetches the routed geometry (into `route_cache`), the elevation of
+every sample `/get-route` will look up (into `elevation_cache`) and the
+country. When the user asks for the route, `/get-route` mostly hits
+warm caches, or joins the geometry call already in flight.
+
+Prefetching never gets in the way of real requests:
+    - Few worker threads (`PREFETCH_WORKERS`) with a lowered OS
+      scheduling priority, and a bounded queue (`PREFETCH_QUEUE`);
+      jobs beyond it are dropped.
+    - Each client (user or address) has one job at most. A new
+      prefetch cancels the previous one, which stops between steps.
+    - The same points are not prefetched twice within a minute.
+"""
+
+
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+from helpers import (
+    get_country_from_coords,
+    get_elevations,
+    get_realistic_route,
+    optimize_stop_order,
+    RESAMPLE_MAX_SAMPLES,
+    RESAMPLE_STEP_METERS,
+    resample_route,
+)
+from metrics import increment, log_error, timed
+
+
+
+DEFAULTS = {
+    "PREFETCH_ENABLED": True,
+    "PREFETCH_WORKERS": 1,
+    "PREFETCH_QUEUE": 8,            # Jobs waiting or running per worker process
+}
+
+PREFETCH_NICENESS = 10
+ELEVATION_CHUNK = 100               # Samples fetched between cancellation checks
+RECENT_TTL = 60
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_slots = None
+_generation = itertools.count(1)
+_current = TTLCache(ttl = 600, max_size = 4096)    # client -> generation of its latest job
+_recent = TTLCache(ttl = RECENT_TTL, max_size = 4096)
+
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job superseded by a newer prefetch of its client.
+    """
+
+
+
+# ===========================================================
+#                    Worker Pool
+# ===========================================================
+def _lower_priority():
+    """
+    Worker thread initializer: lets request threads run first when the
+    CPU is busy (Linux schedules threads individually).
+    """
+
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+def _pool(config):
+    """
+    Returns the worker pool, (re)created after a fork so that every
+    gunicorn worker gets its own threads.
+    """
+
+    global _executor, _executor_pid, _slots
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers = config["PREFETCH_WORKERS"],
+                    thread_name_prefix = "prefetch",
+                    initializer = _lower_priority
+                )
+                _slots = threading.BoundedSemaphore(config["PREFETCH_QUEUE"])
+                _executor_pid = os.getpid()
+    return _executor, _slots
+
+
+
+# ===========================================================
+#                    Jobs
+# ===========================================================
+def _check(client, generation):
+    if _current.get(client) != generation:
+        raise Cancelled()
+
+def _warm(client, generation, points, api_key, profile, optimize_order, order_metric, time_budget):
+    """
+    Runs the slow steps of `/get-route` for `points`, in the same way,
+    so that their results land in the caches `/get-route` reads.
+    """
+
+    _check(client, generation)
+    if optimize_order:
+        order, _ = optimize_stop_order(
+            points, api_key,
+            profile = profile, metric = order_metric, time_budget = time_budget
+        )
+        points = [points[i] for i in order]
+        _check(client, generation)
+
+    geometry = get_realistic_route(points, api_key, profile = profile)
+    if not geometry or len(geometry) < 2:
+        return
+
+    samples = resample_route(geometry, RESAMPLE_STEP_METERS, RESAMPLE_MAX_SAMPLES)
+    for i in range(0, len(samples), ELEVATION_CHUNK):
+        _check(client, generation)
+        get_elevations(samples[i:i + ELEVATION_CHUNK], batch_size = ELEVATION_CHUNK)
+
+    _check(client, generation)
+    get_country_from_coords(geometry[0]["lat"], geometry[0]["lng"])
+
+def _run(slots, key, client, generation, *args):
+    try:
+        with timed("prefetch"):
+            _warm(client, generation, *args)
+        increment("prefetch_jobs_total", result = "done")
+    except Cancelled:
+        _recent.pop(key)
+        increment("prefetch_jobs_total", result = "cancelled")
+    except Exception as e:
+        _recent.pop(key)
+        increment("prefetch_jobs_total", result = "failed")
+        log_error("prefetch_failed", e)
+    finally:
+        slots.release()
+
+def submit_prefetch(config, client, points, api_key, profile = "foot-walking", optimize_order = False, order_metric = "distance"):
+    """
+    Queues the warm-up of a planned route and cancels the client's
+    previous prefetch.
+
+    Args:
+        config (dict): App config with the `PREFETCH_*` settings and
+            `ROUTE_ORDER_TIME_BUDGET`.
+        client (str): Caller identity (see `rate_limit.client_key`).
+        points (list[dict]): {'lat', 'lng'} start, stops and end.
+    Returns:
+        str: 'queued', 'duplicate' (recently prefetched), 'busy' (queue
+            full) or 'disabled'.
+    """
+
+    if not config["PREFETCH_ENABLED"]:
+        return "disabled"
+
+    key = (profile, optimize_order, order_metric, tuple((p["lat"], p["lng"]) for p in points))
+    if _recent.get(key):
+        increment("prefetch_jobs_total", result = "duplicate")
+        return "duplicate"
+
+    generation = next(_generation)
+    _current.set(client, generation)
+
+    executor, slots = _pool(config)
+    if not slots.acquire(blocking = False):
+        increment("prefetch_jobs_total", result = "busy")
+        return "busy"
+
+    _recent.set(key, True)
+    executor.submit(
+        _run, slots, key, client, generation,
+        points, api_key, profile, optimize_order, order_metric,
+        config["ROUTE_ORDER_TIME_BUDGET"]
+    )
+    return "queued"
+
+def cancel_prefetch(client):
+    """
+    Cancels the client's pending prefetch (e.g. the form was cleared).
+    """
+
+    _current.pop(client)
+
+def init_prefetch(app):
+    """
+    Fills in the prefetch settings.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
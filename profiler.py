@@ -0,0 +1,251 @@
+"""
+Opt-in request profiler for the Flask app.
+
+This module includes:
+    - cProfile capture with a `.prof` dump and the top N functions logged
+    - A sampling profiler writing collapsed stacks (flamegraph.pl /
+      speedscope compatible) and speedscope JSON files
+    - Selection of requests by config (path prefixes, sample rate)
+      or by an `X-Profile` header restricted to admin users
+
+When neither `PROFILER_ENABLED` nor `PROFILER_HEADER_ENABLED` is set,
+`init_profiler` registers nothing, so disabled profiling costs nothing.
+"""
+
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, session
+
+from metrics import log_event
+
+
+
+DEFAULTS = {
+    "PROFILER_ENABLED": False,         # Profile requests selected below
+    "PROFILER_PATHS": [],              # Path prefixes to profile (empty = all)
+    "PROFILER_SAMPLE_RATE": 1.0,       # Fraction of matching requests profiled
+    "PROFILER_HEADER_ENABLED": False,  # Allow admins to request a profile with X-Profile
+    "PROFILER_MODE": "cprofile",       # "cprofile" or "sampling"
+    "PROFILER_INTERVAL": 0.001,        # Seconds between stack samples
+    "PROFILER_DIR": "profiles",
+    "PROFILER_TOP_N": 15,
+    "ADMIN_USER_IDS": [],
+}
+
+
+
+# ===========================================================
+#                    Sampling Profiler
+# ===========================================================
+class StackSampler:
+    """
+    Samples the call stack of one thread at a fixed interval
+    from a background thread.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """
+        Returns the samples in the collapsed-stack format ('a;b;c count').
+        """
+
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()
+        ) + "\n"
+
+    def speedscope(self, name):
+        """
+        Returns the samples as a speedscope 'sampled' profile.
+        """
+
+        frames = []
+        index = {}
+        samples = []
+        weights = []
+
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "route_manager profiler",
+        }
+
+    def top_functions(self, n):
+        """
+        Returns the `n` frames with the most self samples.
+        """
+
+        self_samples = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack[-1]] += count
+        return self_samples.most_common(n)
+
+
+
+# ===========================================================
+#                    Request Selection
+# ===========================================================
+def _is_admin(config):
+    return session.get("user_id") in set(config["ADMIN_USER_IDS"])
+
+def _should_profile(config):
+    if config["PROFILER_HEADER_ENABLED"] and request.headers.get("X-Profile"):
+        return _is_admin(config)
+
+    if not config["PROFILER_ENABLED"]:
+        return False
+
+    paths = config["PROFILER_PATHS"]
+    if paths and not any(request.path.startswith(prefix) for prefix in paths):
+        return False
+
+    return random.random() < config["PROFILER_SAMPLE_RATE"]
+
+
+
+# ===========================================================
+#                    Output
+# ===========================================================
+def _output_base(config):
+    os.makedirs(config["PROFILER_DIR"], exist_ok = True)
+    slug = request.path.strip("/").replace("/", "_") or "index"
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(config["PROFILER_DIR"], f"{timestamp}_{request.method}_{slug}")
+
+def _finish_cprofile(profile, config, duration):
+    base = _output_base(config)
+    profile.dump_stats(base + ".prof")
+
+    stats = pstats.Stats(profile, stream = io.StringIO())
+
+    top = [
+        {
+            "function": f"{func[2]} ({os.path.basename(func[0])}:{func[1]})",
+            "calls": values[1],
+            "self_s": round(values[2], 6),
+            "cumulative_s": round(values[3], 6),
+        }
+        for func, values in sorted(
+            stats.stats.items(), key = lambda item: item[1][3], reverse = True
+        )[:config["PROFILER_TOP_N"]]
+    ]
+
+    log_event("request_profiled", path = request.path, mode = "cprofile",
+              duration_ms = round(duration * 1000, 2), output = base + ".prof", top = top)
+
+def _finish_sampling(sampler, config, duration):
+    base = _output_base(config)
+    name = f"{request.method} {request.path}"
+
+    with open(base + ".collapsed", "w") as f:
+        f.write(sampler.collapsed())
+    with open(base + ".speedscope.json", "w") as f:
+        json.dump(sampler.speedscope(name), f)
+
+    top = [
+        {"function": frame, "self_samples": count}
+        for frame, count in sampler.top_functions(config["PROFILER_TOP_N"])
+    ]
+
+    log_event("request_profiled", path = request.path, mode = "sampling",
+              duration_ms = round(duration * 1000, 2), output = base + ".speedscope.json", top = top)
+
+
+
+# ===========================================================
+#                    Flask Integration
+# ===========================================================
+def init_profiler(app):
+    """
+    Registers the profiling hooks on `app` if profiling is enabled.
+    Reads its settings from `app.config` (see `DEFAULTS`).
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    config = app.config
+
+    if not (config["PROFILER_ENABLED"] or config["PROFILER_HEADER_ENABLED"]):
+        return
+
+    @app.before_request
+    def start_profiling():
+        if not _should_profile(config):
+            return
+
+        g.profile_start = time.perf_counter()
+        if config["PROFILER_MODE"] == "sampling":
+            g.profiler = StackSampler(threading.get_ident(), config["PROFILER_INTERVAL"])
+            g.profiler.start()
+        else:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.teardown_request
+    def stop_profiling(exception):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+
+        duration = time.perf_counter() - g.pop("profile_start")
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            _finish_sampling(profiler, config, duration)
+        else:
+            profiler.disable()
+            _finish_cprofile(profiler, config, duration)
@@ -0,0 +1,255 @@
+"""
+Rate limiting and admission control for the route computation endpoints.
+
+This module includes:
+    - Token buckets keyed by user (or client IP when logged out),
+      where a request costs tokens in proportion to its point count
+    - A global cap on in-flight route computations
+    - SQLite (shared by all workers) and in-memory backends
+    - A `rate_limited` route decorator answering 429 with Retry-After
+"""
+
+
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import current_app, jsonify, request, session
+
+from metrics import increment, log_event
+
+
+
+DEFAULTS = {
+    "RATE_LIMIT_ENABLED": True,
+    "RATE_LIMIT_BACKEND": "sqlite",          # "sqlite" or "memory"
+    "RATE_LIMIT_DATABASE": "rate_limit.db",
+    "RATE_LIMIT_RATE": 0.5,                  # Tokens refilled per second
+    "RATE_LIMIT_BURST": 30,                  # Bucket capacity
+    "RATE_LIMIT_POINTS_PER_TOKEN": 500,      # Extra token per this many points
+    "MAX_CONCURRENT_ROUTES": 8,              # In-flight computations, all workers
+    "ROUTE_SLOT_TTL": 120,                   # Seconds before a leaked slot expires
+}
+
+
+
+# ===========================================================
+#                    Backends
+# ===========================================================
+class MemoryBackend:
+    """
+    Buckets and slots kept in this process. Only correct with a
+    single worker process; used for development and tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+
+    def take(self, key, cost, rate, capacity):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost, now)
+            return 0.0
+
+    def acquire_slot(self, limit, ttl):
+        now = time.time()
+        with self._lock:
+            self._slots = {slot: expires for slot, expires in self._slots.items() if expires > now}
+            if len(self._slots) >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            self._slots[slot] = now + ttl
+            return slot
+
+    def release_slot(self, slot):
+        with self._lock:
+            self._slots.pop(slot, None)
+
+class SQLiteBackend:
+    """
+    Buckets and slots in a small SQLite file, so every gunicorn
+    worker on the host enforces the same limits. Each decision is
+    one short `BEGIN IMMEDIATE` transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rate_limit_slots (
+                slot TEXT PRIMARY KEY,
+                expires REAL NOT NULL
+            );
+        """)
+
+    def _connection(self):
+        # Per thread, and never reused across a fork (gunicorn --preload)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = 5, isolation_level = None)
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, cost, rate, capacity):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            retry_after = 0.0
+            if tokens < cost:
+                retry_after = (cost - tokens) / rate
+            else:
+                tokens -= cost
+
+            connection.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            connection.execute("COMMIT")
+            return retry_after
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def acquire_slot(self, limit, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM rate_limit_slots WHERE expires <= ?", (now,))
+            in_flight = connection.execute("SELECT COUNT(*) FROM rate_limit_slots").fetchone()[0]
+            slot = None
+            if in_flight < limit:
+                slot = uuid.uuid4().hex
+                connection.execute(
+                    "INSERT INTO rate_limit_slots (slot, expires) VALUES (?, ?)", (slot, now + ttl)
+                )
+            connection.execute("COMMIT")
+            return slot
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def release_slot(self, slot):
+        self._connection().execute("DELETE FROM rate_limit_slots WHERE slot = ?", (slot,))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Returns the backend selected by `RATE_LIMIT_BACKEND`, created on first use.
+    """
+
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = current_app.config
+                if config["RATE_LIMIT_BACKEND"] == "memory":
+                    _backend = MemoryBackend()
+                else:
+                    _backend = SQLiteBackend(config["RATE_LIMIT_DATABASE"])
+    return _backend
+
+
+
+# ===========================================================
+#                    Admission Control
+# ===========================================================
+def client_key():
+    """
+    Identifies the caller: the logged-in user, else the client address.
+    """
+
+    if "user_id" in session:
+        return f"user:{session['user_id']}"
+    return f"ip:{request.remote_addr}"
+
+def point_cost(point_count):
+    """
+    Tokens charged for a request touching `point_count` coordinates.
+    """
+
+    return 1 + point_count // current_app.config["RATE_LIMIT_POINTS_PER_TOKEN"]
+
+def _too_many(message, retry_after, reason):
+    increment("rate_limited_total", reason = reason, endpoint = (request.endpoint or "").rpartition(".")[2])
+    log_event("rate_limited", reason = reason, client = client_key(), retry_after = retry_after)
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def rate_limited(count_points):
+    """
+    Route decorator applying the token bucket and the concurrency cap.
+
+    Args:
+        count_points (callable): Returns the number of coordinates
+            in the current request, used to price it.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            config = current_app.config
+            if not config["RATE_LIMIT_ENABLED"]:
+                return f(*args, **kwargs)
+
+            cost = point_cost(count_points())
+            if cost > config["RATE_LIMIT_BURST"]:
+                return jsonify({
+                    "status": "error",
+                    "message": "Route has too many points"
+                }), 413
+
+            backend = get_backend()
+            wait = backend.take(client_key(), cost, config["RATE_LIMIT_RATE"], config["RATE_LIMIT_BURST"])
+            if wait:
+                return _too_many("Rate limit exceeded, try again later", math.ceil(wait), "rate")
+
+            slot = backend.acquire_slot(config["MAX_CONCURRENT_ROUTES"], config["ROUTE_SLOT_TTL"])
+            if slot is None:
+                return _too_many("Server busy, try again shortly", 1, "concurrency")
+
+            try:
+                return f(*args, **kwargs)
+            finally:
+                backend.release_slot(slot)
+        return decorated_function
+    return decorator
+
+def init_rate_limit(app):
+    """
+    Fills in the rate-limit settings missing from `app.config`.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
@@ -0,0 +1,336 @@
+"""
+Resilience for calls to external services (OpenRouteService,
+Nominatim, OpenTopoData).
+
+This module includes:
+    - Per-service circuit breakers: after `BREAKER_FAILURE_THRESHOLD`
+      consecutive failures a service is skipped for
+      `BREAKER_RESET_TIMEOUT` seconds, then one probe call decides
+      whether it is back. Requests fail at once instead of waiting for
+      a timeout while a service is down.
+    - A stale-while-revalidate cache: a value older than its TTL is
+      still served while one background call refreshes it.
+    - Negative caching: failures are remembered for
+      `NEGATIVE_CACHE_TTL` seconds, apart from the real values, so a
+      failure never replaces or poisons a good value.
+
+Breakers and caches live in each worker process, and the settings are
+read from the environment when a breaker is first used.
+"""
+
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+from metrics import describe, increment, log_error, log_event
+
+
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30              # Seconds a tripped breaker stays open
+NEGATIVE_CACHE_TTL = 60                 # Seconds a failure is remembered
+EXTERNAL_TIMEOUT = 10                   # Seconds before an external call gives up
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+describe("circuit_breaker_transitions_total", "Circuit breaker state changes by service and state.")
+describe("circuit_breaker_rejections_total", "Calls skipped because the service's breaker was open.")
+
+_breakers = {}
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+
+def external_timeout():
+    """
+    Seconds an external HTTP call may take (`EXTERNAL_TIMEOUT`).
+    """
+
+    return float(os.getenv("EXTERNAL_TIMEOUT", EXTERNAL_TIMEOUT))
+
+
+
+# ===========================================================
+#                    Circuit Breakers
+# ===========================================================
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a service whose breaker is open.
+    """
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of one service.
+
+    Closed: calls go through. Open: calls are rejected until
+    `reset_timeout` has passed. Half-open: one probe call goes through;
+    its success closes the breaker, its failure opens it again.
+
+    Args:
+        service (str): Name used in errors and metrics.
+        failure_threshold (int): Consecutive failures that open it.
+        reset_timeout (float): Seconds before a probe is allowed.
+    """
+
+    def __init__(self, service, failure_threshold = BREAKER_FAILURE_THRESHOLD, reset_timeout = BREAKER_RESET_TIMEOUT):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        increment("circuit_breaker_transitions_total", service = self.service, state = state)
+        log_event("circuit_breaker_state", service = self.service, state = state, failures = self.failures)
+
+    def allow(self):
+        """
+        Whether a call may go through now. While half-open, only the
+        caller that moved the breaker to half-open gets True.
+        """
+
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                return True
+        increment("circuit_breaker_rejections_total", service = self.service)
+        return False
+
+    def is_open(self):
+        """
+        Whether calls would currently be rejected (does not start a probe).
+        """
+
+        with self._lock:
+            return self.state == HALF_OPEN or (
+                self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def call(self, fn, *args, is_failure = None, **kwargs):
+        """
+        Calls `fn(*args, **kwargs)` through the breaker.
+
+        Args:
+            is_failure (callable): Optional predicate telling whether an
+                exception means the service is unhealthy (e.g. not for
+                a 404 "no route found"). Defaults to every exception.
+        Raises:
+            CircuitOpenError: The breaker is open; `fn` was not called.
+        """
+
+        if not self.allow():
+            raise CircuitOpenError(f"{self.service} is unavailable, retrying in at most {self.reset_timeout:g}s")
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+
+        self.record_success()
+        return result
+
+def get_breaker(service):
+    """
+    The circuit breaker of a service, created on first use from
+    `BREAKER_FAILURE_THRESHOLD` and `BREAKER_RESET_TIMEOUT`.
+    """
+
+    breaker = _breakers.get(service)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(service)
+            if breaker is None:
+                breaker = _breakers[service] = CircuitBreaker(
+                    service,
+                    failure_threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", BREAKER_FAILURE_THRESHOLD)),
+                    reset_timeout = float(os.getenv("BREAKER_RESET_TIMEOUT", BREAKER_RESET_TIMEOUT))
+                )
+    return breaker
+
+def breaker_states():
+    """
+    Returns:
+        dict: State of every breaker used by this worker, by service.
+    """
+
+    return {service: breaker.state for service, breaker in _breakers.items()}
+
+
+
+# ===========================================================
+#                    Stale-While-Revalidate Cache
+# ===========================================================
+def _pool():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "revalidate")
+                _executor_pid = os.getpid()
+    return _executor
+
+class StaleCache:
+    """
+    Cache of external results that serves stale values while refreshing.
+
+    A value is fresh for `ttl` seconds. Until `stale_ttl` it is still
+    returned, and the first caller to see it stale schedules a reload in
+    the background. Failed loads are kept in a separate negative cache
+    for `negative_ttl` seconds: within that time the failure is raised
+    again without calling the service. Concurrent misses of one key
+    make a single call, which the other callers wait for (e.g. a
+    `/get-route` arriving while a prefetch loads the same route).
+    Values are shared between callers and must not be modified.
+
+    Args:
+        name (str): Cache label in `cache_requests_total`.
+        ttl (float): Seconds a value is fresh.
+        stale_ttl (float): Seconds a value may be served at all.
+        negative_ttl (float): Seconds a failure is remembered.
+        max_size (int): Maximum number of values (least recently used evicted).
+    """
+
+    def __init__(self, name, ttl, stale_ttl, negative_ttl = NEGATIVE_CACHE_TTL, max_size = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.failures = TTLCache(ttl = negative_ttl, max_size = max_size)
+        self._values = OrderedDict()
+        self._refreshing = set()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None, None
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age >= self.stale_ttl:
+                del self._values[key]
+                return None, None
+            self._values.move_to_end(key)
+            return value, age < self.ttl
+
+    def _store(self, key, value):
+        with self._lock:
+            self._values[key] = (value, time.monotonic())
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last = False)
+        self.failures.pop(key)
+
+    def _call(self, key, loader):
+        try:
+            value = loader()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self.failures.set(key, e)
+            raise
+        self._store(key, value)
+        return value
+
+    def _load(self, key, loader):
+        with self._lock:
+            done = self._loading.get(key)
+            leader = done is None
+            if leader:
+                done = self._loading[key] = threading.Event()
+
+        if leader:
+            try:
+                return self._call(key, loader)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+                done.set()
+
+        # Another caller is loading this key: use its result
+        done.wait(external_timeout())
+        value, fresh = self._lookup(key)
+        if fresh is not None:
+            return value
+        failure = self.failures.get(key)
+        if failure is not None:
+            raise failure.with_traceback(None)
+        return self._call(key, loader)
+
+    def _revalidate(self, key, loader):
+        try:
+            self._load(key, loader)
+        except Exception as e:
+            log_error("revalidate_failed", e, cache = self.name)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, loader):
+        """
+        Returns the value of `key`, calling `loader()` when there is none.
+
+        Raises:
+            Exception: What `loader` raised, now or (negative cache)
+                less than `negative_ttl` seconds ago.
+        """
+
+        value, fresh = self._lookup(key)
+
+        if fresh:
+            increment("cache_requests_total", cache = self.name, result = "hit")
+            return value
+
+        if fresh is not None:
+            increment("cache_requests_total", cache = self.name, result = "stale")
+            with self._lock:
+                refresh = key not in self._refreshing and self.failures.get(key) is None
+                if refresh:
+                    self._refreshing.add(key)
+            if refresh:
+                _pool().submit(self._revalidate, key, loader)
+            return value
+
+        failure = self.failures.get(key)
+        if failure is not None:
+            increment("cache_requests_total", cache = self.name, result = "negative")
+            raise failure.with_traceback(None)
+
+        increment("cache_requests_total", cache = self.name, result = "miss")
+        return self._load(key, loader)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+        self.failures.clear()
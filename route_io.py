@@ -0,0 +1,930 @@
+"""
+Bulk import and export of routes in GPX, GeoJSON and KML formats.
+
+This module includes:
+    - Streaming parsers that yield one track at a time
+    - Archive handling (.zip with many files, .gz single files)
+    - Batched metric computation (`process_routes_batch`) and `executemany` inserts
+    - Resumable import jobs with progress tracking
+    - Streaming GeoJSON / GPX exporters over a database cursor
+    - Bulk recalculation of stored route metrics
+"""
+
+
+import codecs
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+import zipfile
+from xml.sax.saxutils import escape
+
+from metrics import log_error
+from helpers import (
+    DATABASE,
+    generate_route_image,
+    get_country_from_coords,
+    process_routes_batch,
+)
+from planning import route_points
+
+
+
+IMPORT_BATCH_SIZE = 50
+IMPORT_STALE_SECONDS = 600              # A running job not updated for this long was abandoned
+EXPORT_FETCH_SIZE = 200
+GEOJSON_CHUNK_SIZE = 64 * 1024
+XML_CHUNK_SIZE = 64 * 1024
+SUPPORTED_EXTENSIONS = {"gpx", "geojson", "json", "kml"}
+
+IMPORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    source_name TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    tracks_done INTEGER NOT NULL DEFAULT 0,
+    routes_created INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, source_hash),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+"""
+
+
+
+# ===========================================================
+#                    Schema
+# ===========================================================
+def init_import_schema(connection):
+    """
+    Creates the `import_jobs` table used to track import progress.
+    """
+
+    connection.executescript(IMPORT_SCHEMA)
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Streaming Parsers
+# ===========================================================
+def _local_name(tag):
+    """
+    Strips the XML namespace from a tag ('{ns}trkpt' -> 'trkpt').
+    """
+
+    return tag.rsplit("}", 1)[-1]
+
+class _SafeTarget:
+    """
+    Parser target building the tree with a `TreeBuilder` and recording
+    ('start' | 'end', element) events, like `iterparse`.
+
+    Documents with a DOCTYPE are refused, and with it any entity
+    declarations (exponential "billion laughs" expansion and external
+    entities). GPX and KML files never need one.
+    """
+
+    def __init__(self):
+        self._builder = ET.TreeBuilder()
+        self.events = []
+
+    def start(self, tag, attrs):
+        self.events.append(("start", self._builder.start(tag, attrs)))
+
+    def end(self, tag):
+        self.events.append(("end", self._builder.end(tag)))
+
+    def data(self, text):
+        self._builder.data(text)
+
+    def doctype(self, name, pubid, system):
+        raise ET.ParseError("DOCTYPE declarations are not allowed")
+
+    def close(self):
+        return self._builder.close()
+
+def _iter_xml_events(stream):
+    """
+    Feeds the stream to a `_SafeTarget` parser in chunks and yields its
+    events as they come.
+    """
+
+    target = _SafeTarget()
+    parser = ET.XMLParser(target = target)
+
+    for chunk in iter(lambda: stream.read(XML_CHUNK_SIZE), b""):
+        parser.feed(chunk)
+        yield from target.events
+        target.events.clear()
+
+    parser.close()
+    yield from target.events
+
+def _iter_xml_elements(stream, wanted):
+    """
+    Iteratively parses an XML stream and yields every closed element
+    whose local name is in `wanted`.
+
+    Processed elements, and the other elements outside a wanted one
+    (metadata, styles, waypoints, ...), are cleared and removed from
+    their parent, so memory stays bounded by the size of a single
+    track, not of the whole file.
+
+    Raises:
+        xml.etree.ElementTree.ParseError: Malformed XML or a DOCTYPE.
+    """
+
+    parents = []
+    open_wanted = 0
+
+    for event, elem in _iter_xml_events(stream):
+        if event == "start":
+            parents.append(elem)
+            if _local_name(elem.tag) in wanted:
+                open_wanted += 1
+            continue
+
+        parents.pop()
+        if _local_name(elem.tag) in wanted:
+            open_wanted -= 1
+            yield elem
+        elif open_wanted:
+            # Part of a wanted element, read when that one is yielded
+            continue
+
+        elem.clear()
+        # Detach the element so the tree does not grow
+        if parents:
+            parents[-1].remove(elem)
+
+def _find_text(elem, name):
+    for child in elem:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return ""
+
+def parse_gpx(stream):
+    """
+    Yields GPX tracks (`trk`) and routes (`rte`) one at a time.
+
+    Args:
+        stream (file): Binary file-like object with GPX content.
+    Yields:
+        dict: {'name': str, 'coordinates': list[{'lat': float, 'lng': float}]}
+    """
+
+    for elem in _iter_xml_elements(stream, {"trk", "rte"}):
+        points = []
+        for node in elem.iter():
+            if _local_name(node.tag) in ("trkpt", "rtept"):
+                try:
+                    points.append({
+                        "lat": float(node.get("lat")),
+                        "lng": float(node.get("lon"))
+                    })
+                except (TypeError, ValueError):
+                    continue
+
+        yield {"name": _find_text(elem, "name"), "coordinates": points}
+
+def _parse_kml_coordinates(text):
+    points = []
+    for token in text.split():
+        parts = token.split(",")
+        if len(parts) < 2:
+            continue
+        try:
+            points.append({"lat": float(parts[1]), "lng": float(parts[0])})
+        except ValueError:
+            continue
+    return points
+
+def parse_kml(stream):
+    """
+    Yields every LineString found inside KML placemarks.
+
+    Args:
+        stream (file): Binary file-like object with KML content.
+    Yields:
+        dict: {'name': str, 'coordinates': list[{'lat': float, 'lng': float}]}
+    """
+
+    for elem in _iter_xml_elements(stream, {"Placemark"}):
+        name = _find_text(elem, "name")
+        for node in elem.iter():
+            if _local_name(node.tag) != "LineString":
+                continue
+            for child in node:
+                if _local_name(child.tag) == "coordinates":
+                    yield {
+                        "name": name,
+                        "coordinates": _parse_kml_coordinates(child.text or "")
+                    }
+
+def _geojson_tracks(feature):
+    """
+    Converts a GeoJSON feature (or bare geometry) into tracks.
+    """
+
+    if feature.get("type") == "Feature":
+        geometry = feature.get("geometry") or {}
+        name = (feature.get("properties") or {}).get("name", "")
+    else:
+        geometry = feature
+        name = ""
+
+    geometry_type = geometry.get("type")
+    if geometry_type == "LineString":
+        lines = [geometry.get("coordinates", [])]
+    elif geometry_type == "MultiLineString":
+        lines = geometry.get("coordinates", [])
+    else:
+        return
+
+    for line in lines:
+        yield {
+            "name": name or "",
+            "coordinates": [
+                {"lat": float(p[1]), "lng": float(p[0])}
+                for p in line
+                if isinstance(p, list) and len(p) >= 2
+            ]
+        }
+
+_GEOJSON_STRUCTURE = re.compile(r'[][{}"]')
+_GEOJSON_STRING_END = re.compile(r'["\\]')
+
+def parse_geojson(stream, chunk_size = GEOJSON_CHUNK_SIZE):
+    """
+    Yields tracks from a GeoJSON document without loading it whole.
+
+    FeatureCollections are scanned incrementally: the stream is read in
+    chunks and the brackets of each element of the `features` array are
+    counted as the text arrives, resuming where the previous chunk left
+    off. An element is decoded once, when its brackets balance, so
+    memory is bounded by the largest feature and the time is linear in
+    the document size. Single features and bare geometries are decoded
+    directly.
+
+    Args:
+        stream (file): Binary file-like object with GeoJSON content.
+    Yields:
+        dict: {'name': str, 'coordinates': list[{'lat': float, 'lng': float}]}
+    """
+
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    features_start = re.compile(r'"features"\s*:\s*\[')
+    buffer = ""
+    eof = False
+
+    def read_more(size = chunk_size):
+        nonlocal buffer, eof
+        chunk = stream.read(size)
+        if not chunk:
+            eof = True
+            buffer += text_decoder.decode(b"", final = True)
+            return
+        buffer += text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+    # Scan state of the element at the start of `buffer`
+    scan = depth = 0
+    in_string = False
+
+    def element_end():
+        """
+        Offset just past the element at the start of `buffer`, or None
+        if it is not complete yet.
+        """
+
+        nonlocal scan, depth, in_string
+        while True:
+            if in_string:
+                match = _GEOJSON_STRING_END.search(buffer, scan)
+                if match is None:
+                    scan = len(buffer)
+                    return None
+                if match.group() == "\\":
+                    if match.end() == len(buffer):
+                        # The escaped character is in the next chunk
+                        scan = match.start()
+                        return None
+                    scan = match.end() + 1
+                    continue
+                in_string = False
+                scan = match.end()
+                continue
+
+            match = _GEOJSON_STRUCTURE.search(buffer, scan)
+            if match is None:
+                scan = len(buffer)
+                return None
+            scan = match.end()
+            char = match.group()
+            if char == '"':
+                in_string = True
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return scan
+
+    # Find the start of the features array
+    match = None
+    while match is None and not eof:
+        read_more()
+        match = features_start.search(buffer)
+
+    if match is None:
+        # Not a FeatureCollection: a single feature or geometry
+        document = json.loads(buffer) if buffer.strip() else {}
+        yield from _geojson_tracks(document)
+        return
+
+    buffer = buffer[match.end():]
+
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        while not buffer and not eof:
+            read_more()
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+
+        if not buffer or buffer.startswith("]"):
+            return
+
+        if not buffer.startswith(("{", "[")):
+            raise json.JSONDecodeError("Expected a feature object", buffer, 0)
+
+        # Reads grow while an element is incomplete, so a large feature
+        # is assembled in a logarithmic number of concatenations
+        size = chunk_size
+        end = element_end()
+        while end is None:
+            if eof:
+                raise json.JSONDecodeError("Unterminated feature", buffer, len(buffer))
+            read_more(size)
+            size *= 2
+            end = element_end()
+
+        feature = json.loads(buffer[:end])
+        buffer = buffer[end:]
+        scan = depth = 0
+        yield from _geojson_tracks(feature)
+
+PARSERS = {
+    "gpx": parse_gpx,
+    "kml": parse_kml,
+    "geojson": parse_geojson,
+    "json": parse_geojson,
+}
+
+def _extension(filename):
+    name = filename.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name.rsplit(".", 1)[-1] if "." in name else ""
+
+def iter_tracks(path, filename = None):
+    """
+    Yields every track contained in a file or archive.
+
+    `.zip` archives are walked member by member (each member is streamed
+    from the archive), `.gz` files are decompressed on the fly.
+
+    Args:
+        path (str): Path of the file on disk.
+        filename (str): Original filename, used to detect the format.
+    Yields:
+        dict: {'name': str, 'coordinates': list[dict]}
+    """
+
+    filename = filename or os.path.basename(path)
+
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                parser = PARSERS.get(_extension(member.filename))
+                if parser is None:
+                    continue
+                with archive.open(member) as stream:
+                    if member.filename.lower().endswith(".gz"):
+                        stream = gzip.GzipFile(fileobj = stream)
+                    for track in parser(stream):
+                        track["source"] = member.filename
+                        yield track
+        return
+
+    parser = PARSERS.get(_extension(filename))
+    if parser is None:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+    opener = gzip.open if filename.lower().endswith(".gz") else open
+    with opener(path, "rb") as stream:
+        for track in parser(stream):
+            track["source"] = filename
+            yield track
+
+def allowed_import_file(filename):
+    """
+    Checks whether an uploaded file can be imported.
+    """
+
+    return (
+        filename.lower().endswith(".zip") or
+        _extension(filename) in SUPPORTED_EXTENSIONS
+    )
+
+
+
+# ===========================================================
+#                    Import Jobs
+# ===========================================================
+def file_hash(path, chunk_size = 1024 * 1024):
+    """
+    Returns the SHA-256 of a file, read in chunks.
+    Used to recognise a re-submitted file and resume its import.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_or_create_job(connection, user_id, source_name, source_hash):
+    """
+    Returns the import job for (user, file), creating it if needed.
+    An existing job keeps its `tracks_done` counter so it can resume.
+    """
+
+    connection.execute(
+        """INSERT OR IGNORE INTO import_jobs
+        (user_id, source_name, source_hash) VALUES
+        (?, ?, ?)""",
+        (user_id, source_name, source_hash)
+    )
+    connection.commit()
+
+    return connection.execute(
+        "SELECT * FROM import_jobs WHERE user_id = ? AND source_hash = ?",
+        (user_id, source_hash)
+    ).fetchone()
+
+def claim_job(connection, job_id):
+    """
+    Marks a job as running unless it is done or already running, in
+    one UPDATE, so a file is never imported by two workers at once.
+    A running job not updated for `IMPORT_STALE_SECONDS` (its worker
+    died) can be claimed again.
+
+    Returns:
+        bool: True if this caller now runs the job.
+    """
+
+    claimed = connection.execute(
+        """UPDATE import_jobs SET
+        status = 'running', error = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (
+            status IN ('pending', 'failed')
+            OR (status = 'running' AND updated_at < datetime('now', ?))
+        )""",
+        (job_id, f"-{IMPORT_STALE_SECONDS} seconds")
+    ).rowcount
+    connection.commit()
+    return claimed == 1
+
+def _set_job_status(connection, job_id, status, error = None):
+    connection.execute(
+        """UPDATE import_jobs SET
+        status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?""",
+        (status, error, job_id)
+    )
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Batched Import
+# ===========================================================
+def _route_rows(batch, user_id, with_images, with_country, image_folder):
+    """
+    Computes metrics for a batch of tracks and builds `routes` rows.
+    Metrics for the whole batch come from one `process_routes_batch`
+    call, which fetches the elevations of all tracks together.
+    A map that fails to render leaves the route without an image.
+    """
+
+    metrics = process_routes_batch([track["coordinates"] for track in batch])
+
+    rows = []
+    for track, details in zip(batch, metrics):
+        coordinates = track["coordinates"]
+
+        image_filename = None
+        if with_images:
+            try:
+                image_filename = generate_route_image(
+                    validated_coords = [(c["lat"], c["lng"]) for c in coordinates],
+                    save_folder = image_folder
+                )
+            except Exception as e:
+                log_error("import_route_image_failed", e, track = track["index"])
+
+        country = None
+        if with_country:
+            country = get_country_from_coords(coordinates[0]["lat"], coordinates[0]["lng"])
+
+        rows.append((
+            user_id,
+            track["name"] or f"Imported route {track['index'] + 1}",
+            f"Imported from {track['source']}",
+            json.dumps([[round(c["lat"], 6), round(c["lng"], 6)] for c in coordinates]),
+            details["elevation_gain"],
+            details["elevation_loss"],
+            details["max_elevation"],
+            details["min_elevation"],
+            details["average_elevation"],
+            details["total_distance"],
+            image_filename,
+            country or ""
+        ))
+
+    return rows
+
+def _commit_batch(connection, job_id, rows, tracks_done):
+    """
+    Inserts a batch of routes and advances the job checkpoint
+    in the same transaction, so a crash never duplicates routes.
+    """
+
+    with connection:
+        connection.executemany(
+            """
+            INSERT INTO routes (
+                user_id, name, description, coordinates,
+                elevation_gain, elevation_loss, max_elevation,
+                min_elevation, avg_elevation, total_distance,
+                map_image_url, country
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        connection.execute(
+            """UPDATE import_jobs SET
+            tracks_done = ?,
+            routes_created = routes_created + ?,
+            status = 'running',
+            updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?""",
+            (tracks_done, len(rows), job_id)
+        )
+
+def import_routes(
+        connection,
+        user_id,
+        path,
+        filename = None,
+        batch_size = IMPORT_BATCH_SIZE,
+        with_images = False,
+        with_country = False,
+        image_folder = "static/images/routes",
+        progress = None,
+        claimed = False
+        ):
+    """
+    Imports every track of a file as a route owned by `user_id`.
+
+    Tracks are streamed from the file, processed in batches of
+    `batch_size` and inserted with `executemany`. Progress is stored in
+    `import_jobs`; importing the same file again resumes after the last
+    committed batch.
+
+    Args:
+        connection (sqlite3.Connection): Dedicated database connection.
+        user_id (int): Owner of the imported routes.
+        path (str): Path of the file on disk.
+        filename (str): Original filename (defaults to basename of `path`).
+        batch_size (int): Number of tracks per transaction.
+        with_images (bool): Whether to render a static map per route.
+        with_country (bool): Whether to reverse geocode each route. Off by
+            default: every route is one Nominatim request, which allows
+            about one per second.
+        image_folder (str): Where the static maps are saved.
+        progress (callable): Optional callback `progress(tracks_done, routes_created)`.
+        claimed (bool): Whether the caller already claimed the job
+            with `claim_job`.
+    Returns:
+        sqlite3.Row: The final state of the import job, or its current
+            state if it is already running elsewhere.
+    """
+
+    filename = filename or os.path.basename(path)
+    connection.row_factory = sqlite3.Row
+    init_import_schema(connection)
+
+    job = get_or_create_job(connection, user_id, filename, file_hash(path))
+    if job["status"] == "done" or not (claimed or claim_job(connection, job["id"])):
+        return job
+
+    job_id = job["id"]
+    skip = job["tracks_done"]
+    tracks_done = skip
+    routes_created = job["routes_created"]
+    batch = []
+
+    try:
+        for index, track in enumerate(iter_tracks(path, filename)):
+            if index < skip:
+                continue
+
+            tracks_done = index + 1
+            if len(track["coordinates"]) < 2:
+                continue
+
+            track["index"] = index
+            batch.append(track)
+
+            if len(batch) >= batch_size:
+                rows = _route_rows(batch, user_id, with_images, with_country, image_folder)
+                _commit_batch(connection, job_id, rows, tracks_done)
+                routes_created += len(rows)
+                batch = []
+                if progress:
+                    progress(tracks_done, routes_created)
+
+        rows = _route_rows(batch, user_id, with_images, with_country, image_folder) if batch else []
+        _commit_batch(connection, job_id, rows, tracks_done)
+        routes_created += len(rows)
+        if progress:
+            progress(tracks_done, routes_created)
+
+        _set_job_status(connection, job_id, "done")
+
+    except Exception as e:
+        log_error("route_import_failed", e, job_id = job_id)
+        _set_job_status(connection, job_id, "failed", str(e))
+
+    return connection.execute(
+        "SELECT * FROM import_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+
+def import_routes_file(user_id, path, filename = None, remove_after = False, **options):
+    """
+    Runs `import_routes` with its own database connection.
+    Meant to be used from a background thread or the CLI,
+    where Flask's per-request connection is not available.
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        return import_routes(connection, user_id, path, filename, **options)
+    finally:
+        connection.close()
+        if remove_after and os.path.exists(path):
+            os.remove(path)
+
+
+
+# ===========================================================
+#                    Streaming Export
+# ===========================================================
+EXPORT_QUERY = """
+    SELECT
+        routes.id, routes.name, routes.description, routes.coordinates,
+        routes.elevation_gain, routes.elevation_loss, routes.max_elevation,
+        routes.min_elevation, routes.avg_elevation, routes.total_distance,
+        routes.country, users.username
+    FROM routes
+    LEFT JOIN users ON routes.user_id = users.id
+"""
+
+EXPORT_FORMATS = {
+    "geojson": "application/geo+json",
+    "gpx": "application/gpx+xml",
+}
+
+def iter_export_rows(where = "", args = (), fetch_size = EXPORT_FETCH_SIZE):
+    """
+    Yields `routes` rows (joined with the author) for export.
+
+    Uses a dedicated connection and reads the cursor `fetch_size` rows at
+    a time, so the full result set is never held in memory. The
+    connection is closed once the generator is exhausted or discarded.
+
+    Args:
+        where (str): Optional SQL condition appended after WHERE.
+        args (tuple): Parameters for the condition.
+        fetch_size (int): Rows fetched from the cursor per step.
+    Yields:
+        sqlite3.Row
+    """
+
+    connection = sqlite3.connect(DATABASE)
+    connection.row_factory = sqlite3.Row
+
+    query = EXPORT_QUERY
+    if where:
+        query += f" WHERE {where}"
+    query += " ORDER BY routes.id"
+
+    try:
+        cursor = connection.execute(query, args)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        connection.close()
+
+def _row_points(row):
+    """
+    Decodes the stored `coordinates` column into (lat, lng) tuples.
+    Accepts both [lat, lng] pairs and {'lat', 'lng'} objects.
+    """
+
+    try:
+        coords = json.loads(row["coordinates"] or "[]")
+    except json.JSONDecodeError:
+        return []
+
+    points = []
+    for c in coords:
+        if isinstance(c, dict) and "lat" in c and "lng" in c:
+            points.append((c["lat"], c["lng"]))
+        elif isinstance(c, list) and len(c) >= 2:
+            points.append((c[0], c[1]))
+    return points
+
+def _row_properties(row):
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "author": row["username"],
+        "country": row["country"],
+        "total_distance": row["total_distance"],
+        "elevation_gain": row["elevation_gain"],
+        "elevation_loss": row["elevation_loss"],
+        "max_elevation": row["max_elevation"],
+        "min_elevation": row["min_elevation"],
+        "avg_elevation": row["avg_elevation"],
+    }
+
+def export_geojson(rows):
+    """
+    Streams rows as a GeoJSON FeatureCollection, one feature per chunk.
+
+    Args:
+        rows (iterable[sqlite3.Row]): Rows from `iter_export_rows`.
+    Yields:
+        str: Pieces of the GeoJSON document.
+    """
+
+    yield '{"type": "FeatureCollection", "features": ['
+
+    separator = ""
+    for row in rows:
+        feature = {
+            "type": "Feature",
+            "properties": _row_properties(row),
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[lng, lat] for lat, lng in _row_points(row)]
+            }
+        }
+        yield separator + json.dumps(feature)
+        separator = ","
+
+    yield "]}"
+
+def export_gpx(rows):
+    """
+    Streams rows as a GPX 1.1 document, one track per route.
+
+    Args:
+        rows (iterable[sqlite3.Row]): Rows from `iter_export_rows`.
+    Yields:
+        str: Pieces of the GPX document.
+    """
+
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="RouteAppManager" '
+        'xmlns="http://www.topografix.com/GPX/1/1">\n'
+    )
+
+    for row in rows:
+        points = "".join(
+            f'<trkpt lat="{lat}" lon="{lng}"/>'
+            for lat, lng in _row_points(row)
+        )
+        description = row["description"] or ""
+        yield (
+            f"<trk><name>{escape(row['name'] or '')}</name>"
+            f"<desc>{escape(description)}</desc>"
+            f"<src>{escape(row['username'] or '')}</src>"
+            f"<trkseg>{points}</trkseg></trk>\n"
+        )
+
+    yield "</gpx>\n"
+
+EXPORTERS = {
+    "geojson": export_geojson,
+    "gpx": export_gpx,
+}
+
+
+
+# ===========================================================
+#                    Bulk Recalculation
+# ===========================================================
+def recalculate_routes(connection, where = "", args = (), batch_size = 200, progress = None):
+    """
+    Recomputes the stored metrics of existing routes in one pass,
+    e.g. after switching elevation provider.
+
+    Routes are read `batch_size` at a time in id order (keyset paging,
+    so only one batch of coordinates is in memory), processed with
+    `process_routes_batch` and updated with `executemany`.
+    Metrics are computed on the route's routed geometry when stored
+    (see `planning.route_points`), else on its key points. Only the
+    routed geometry sets `total_distance`: straight lines between key
+    points would understate the distance `/get-route` measured.
+    Routes whose elevation lookup misses samples are left untouched.
+
+    Args:
+        connection (sqlite3.Connection): Dedicated database connection.
+        where (str): Optional SQL condition on `routes`.
+        args (tuple): Parameters for the condition.
+        batch_size (int): Routes processed per transaction.
+        progress (callable): Optional callback `progress(routes_updated)`.
+    Returns:
+        tuple: (routes updated, routes skipped for missing elevation samples).
+    """
+
+    connection.row_factory = sqlite3.Row
+    query = "SELECT id, coordinates FROM routes WHERE id > ?"
+    if where:
+        query += f" AND ({where})"
+    query += " ORDER BY id LIMIT ?"
+
+    last_id = -1
+    updated = 0
+    skipped = 0
+
+    while True:
+        rows = connection.execute(query, (last_id, *args, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+
+        chunk = [
+            (row["id"], *route_points(connection, row["id"], row["coordinates"]))
+            for row in rows
+        ]
+        chunk = [entry for entry in chunk if len(entry[1]) >= 2]
+        metrics = process_routes_batch([points for _, points, _ in chunk])
+
+        updates = [
+            (
+                m["elevation_gain"], m["elevation_loss"],
+                m["max_elevation"], m["min_elevation"],
+                m["average_elevation"], m["total_distance"] if is_routed else None,
+                route_id
+            )
+            for (route_id, _, is_routed), m in zip(chunk, metrics)
+            if not m["elevation_missing"]
+        ]
+        skipped += len(chunk) - len(updates)
+
+        with connection:
+            connection.executemany(
+                """UPDATE routes SET
+                elevation_gain = ?,
+                elevation_loss = ?,
+                max_elevation = ?,
+                min_elevation = ?,
+                avg_elevation = ?,
+                total_distance = coalesce(?, total_distance)
+                WHERE id = ?""",
+                updates
+            )
+
+        updated += len(updates)
+        if progress:
+            progress(updated)
+
+    return updated, skipped
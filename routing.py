@@ -0,0 +1,574 @@
+"""
+Offline routing over a local OpenStreetMap extract.
+
+This module includes:
+    - A streaming two-pass reader for OSM XML extracts (.osm, .osm.gz, .osm.bz2)
+    - Per-profile edge filtering and speeds for the profiles the UI
+      offers ('foot-walking', 'cycling-regular', 'driving-car')
+    - A compact graph: forward and reverse CSR arrays per profile plus
+      a grid index for snapping points to the nearest routable node
+    - A single binary graph file, loaded with mmap so the arrays are
+      shared between gunicorn workers and cost no parse time at startup
+    - Bidirectional A* (with averaged potentials) for shortest-time paths
+
+Build a graph with `flask build-routing-graph extract.osm.bz2 routing.graph`
+and enable it with ROUTING_BACKEND=local (or 'local,ors' to fall back to
+OpenRouteService when no local path is found).
+"""
+
+
+import bz2
+import gzip
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left
+from math import asin, ceil, cos, floor, radians, sin, sqrt
+
+
+
+MAGIC = b"RMGRAPH1"
+EARTH_RADIUS_M = 6_371_000.0
+GRID_CELL_DEGREES = 0.01
+SNAP_MAX_CELLS = 5            # Rings of grid cells searched when snapping (about 5 km)
+ALIGNMENT = 8
+
+# Speeds in km/h per highway type; missing types are not routable
+SPEEDS = {
+    "driving-car": {
+        "motorway": 110, "motorway_link": 60, "trunk": 90, "trunk_link": 50,
+        "primary": 70, "primary_link": 45, "secondary": 60, "secondary_link": 40,
+        "tertiary": 50, "tertiary_link": 35, "unclassified": 40, "residential": 30,
+        "living_street": 10, "service": 15, "road": 30,
+    },
+    "cycling-regular": {
+        "primary": 18, "primary_link": 18, "secondary": 18, "secondary_link": 18,
+        "tertiary": 18, "tertiary_link": 18, "unclassified": 16, "residential": 16,
+        "living_street": 12, "service": 14, "road": 15, "track": 12, "cycleway": 18,
+        "path": 12, "bridleway": 10, "footway": 6, "pedestrian": 6,
+    },
+    "foot-walking": {
+        "primary": 5, "primary_link": 5, "secondary": 5, "secondary_link": 5,
+        "tertiary": 5, "tertiary_link": 5, "unclassified": 5, "residential": 5,
+        "living_street": 5, "service": 5, "road": 5, "track": 5, "cycleway": 5,
+        "path": 5, "bridleway": 5, "footway": 5, "pedestrian": 5, "steps": 3,
+    },
+}
+PROFILES = tuple(SPEEDS)
+PROFILE_ACCESS_TAG = {"driving-car": "motor_vehicle", "cycling-regular": "bicycle", "foot-walking": "foot"}
+NO_ACCESS = {"no", "private"}
+YES_ACCESS = {"yes", "designated", "permissive"}
+
+
+
+class RoutingError(Exception):
+    """
+    Raised when no local route can be found (or no graph is loaded).
+    """
+
+
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = radians(lat1), radians(lng1), radians(lat2), radians(lng2)
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * asin(sqrt(min(1.0, a)))
+
+
+
+# ===========================================================
+#                    OSM Extract Reading
+# ===========================================================
+def _open_extract(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".pbf"):
+        raise RoutingError("PBF extracts are not supported; convert with `osmium cat extract.osm.pbf -o extract.osm`")
+    return open(path, "rb")
+
+def _iter_elements(path, tag):
+    """
+    Yields the `tag` elements ('node' or 'way') of an OSM XML file,
+    clearing everything already read so memory stays flat.
+    """
+
+    with _open_extract(path) as f:
+        context = ET.iterparse(f, events = ("start", "end"))
+        _, root = next(context)
+        for event, element in context:
+            if event != "end" or element.tag not in ("node", "way", "relation"):
+                continue
+            if element.tag == tag:
+                yield element
+            root.clear()
+
+def way_access(profile, tags):
+    """
+    Decides whether a way is routable for `profile`.
+
+    Returns:
+        tuple | None: (speed km/h, forward allowed, backward allowed),
+            or None if the profile cannot use the way.
+    """
+
+    highway = tags.get("highway")
+    speed = SPEEDS[profile].get(highway)
+    mode_access = tags.get(PROFILE_ACCESS_TAG[profile])
+
+    if speed is None:
+        if mode_access in YES_ACCESS and highway:
+            speed = min(SPEEDS[profile].values()) # e.g. foot=yes on a trunk road
+        else:
+            return None
+
+    if mode_access in NO_ACCESS:
+        return None
+    if tags.get("access") in NO_ACCESS and mode_access not in YES_ACCESS:
+        return None
+    if tags.get("area") == "yes":
+        return None
+
+    if profile == "driving-car":
+        maxspeed = tags.get("maxspeed", "")
+        if maxspeed.isdigit():
+            speed = min(speed, int(maxspeed)) or speed
+
+    forward = backward = True
+    if profile != "foot-walking":
+        oneway = tags.get("oneway")
+        if profile == "cycling-regular" and tags.get("oneway:bicycle") == "no":
+            oneway = "no"
+        implied = highway in ("motorway", "motorway_link") or tags.get("junction") == "roundabout"
+        if oneway in ("yes", "1", "true") or (implied and oneway != "no"):
+            backward = False
+        elif oneway == "-1":
+            forward = False
+
+    return speed, forward, backward
+
+def read_extract(path):
+    """
+    Reads the routable ways and the nodes they use from an OSM XML extract.
+
+    Returns:
+        tuple: (lats array, lngs array, list of (node indexes, {profile: access})).
+    """
+
+    ways = []
+    needed = set()
+
+    for element in _iter_elements(path, "way"):
+        tags = {t.get("k"): t.get("v") for t in element.iter("tag")}
+        if "highway" not in tags:
+            continue
+        access = {profile: way_access(profile, tags) for profile in PROFILES}
+        access = {profile: value for profile, value in access.items() if value}
+        if not access:
+            continue
+        refs = array("q", (int(nd.get("ref")) for nd in element.iter("nd")))
+        if len(refs) < 2:
+            continue
+        ways.append((refs, access))
+        needed.update(refs)
+
+    index = {}
+    lats = array("d")
+    lngs = array("d")
+    for element in _iter_elements(path, "node"):
+        node_id = int(element.get("id"))
+        if node_id in needed:
+            index[node_id] = len(lats)
+            lats.append(float(element.get("lat")))
+            lngs.append(float(element.get("lon")))
+
+    resolved = []
+    for refs, access in ways:
+        nodes = array("I", (index[ref] for ref in refs if ref in index))
+        if len(nodes) >= 2:
+            resolved.append((nodes, access))
+
+    return lats, lngs, resolved
+
+
+
+# ===========================================================
+#                    Graph Building
+# ===========================================================
+def _csr(node_count, sources, targets, weights):
+    """
+    Sorts an edge list by source into CSR arrays (counting sort).
+    """
+
+    offsets = array("I", [0]) * (node_count + 1)
+    for u in sources:
+        offsets[u + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+
+    position = array("I", offsets[:-1])
+    sorted_targets = array("I", [0]) * len(targets)
+    sorted_weights = array("f", [0.0]) * len(weights)
+    for u, v, w in zip(sources, targets, weights):
+        p = position[u]
+        sorted_targets[p] = v
+        sorted_weights[p] = w
+        position[u] = p + 1
+
+    return offsets, sorted_targets, sorted_weights
+
+def _grid(lats, lngs, cell = GRID_CELL_DEGREES):
+    columns = ceil(360 / cell)
+    keys = [
+        floor((lat + 90) / cell) * columns + floor((lng + 180) / cell)
+        for lat, lng in zip(lats, lngs)
+    ]
+    order = sorted(range(len(keys)), key = keys.__getitem__)
+
+    cell_keys = array("q")
+    cell_offsets = array("I")
+    for position, node in enumerate(order):
+        if not cell_keys or cell_keys[-1] != keys[node]:
+            cell_keys.append(keys[node])
+            cell_offsets.append(position)
+    cell_offsets.append(len(order))
+
+    return cell_keys, cell_offsets, array("I", order)
+
+def build_graph(extract_path, output_path):
+    """
+    Builds the routing graph file for all profiles from an OSM extract.
+
+    Returns:
+        dict: Node and per-profile edge counts.
+    """
+
+    lats, lngs, ways = read_extract(extract_path)
+
+    # Unit-sphere positions: the chord between two nodes is a cheap lower
+    # bound of their great-circle distance, used by the A* potential
+    xs, ys, zs = array("d"), array("d"), array("d")
+    for lat, lng in zip(lats, lngs):
+        lat, lng = radians(lat), radians(lng)
+        xs.append(cos(lat) * cos(lng))
+        ys.append(cos(lat) * sin(lng))
+        zs.append(sin(lat))
+
+    arrays = {"lat": lats, "lng": lngs, "x": xs, "y": ys, "z": zs}
+    header = {"nodes": len(lats), "cell_degrees": GRID_CELL_DEGREES, "profiles": {}, "arrays": {}}
+
+    for profile in PROFILES:
+        sources, targets, weights = array("I"), array("I"), array("f")
+        max_speed = 1.0
+        for nodes, access in ways:
+            if profile not in access:
+                continue
+            speed, forward, backward = access[profile]
+            meters_per_second = speed / 3.6
+            max_speed = max(max_speed, meters_per_second)
+            for u, v in zip(nodes, nodes[1:]):
+                seconds = _distance_m(lats[u], lngs[u], lats[v], lngs[v]) / meters_per_second
+                if forward:
+                    sources.append(u); targets.append(v); weights.append(seconds)
+                if backward:
+                    sources.append(v); targets.append(u); weights.append(seconds)
+
+        forward_csr = _csr(len(lats), sources, targets, weights)
+        backward_csr = _csr(len(lats), targets, sources, weights)
+        for direction, (offsets, edge_targets, edge_weights) in (("fwd", forward_csr), ("bwd", backward_csr)):
+            arrays[f"{profile}.{direction}_offsets"] = offsets
+            arrays[f"{profile}.{direction}_targets"] = edge_targets
+            arrays[f"{profile}.{direction}_weights"] = edge_weights
+        header["profiles"][profile] = {"edges": len(sources), "max_speed": max_speed}
+
+    arrays["grid_keys"], arrays["grid_offsets"], arrays["grid_nodes"] = _grid(lats, lngs)
+
+    # Lay the arrays out after the header, each aligned for mmap casting
+    position = 0
+    for name, values in arrays.items():
+        header["arrays"][name] = [position, values.typecode, len(values)]
+        position += len(values) * values.itemsize
+        position += -position % ALIGNMENT
+
+    header_bytes = json.dumps(header).encode()
+    data_start = len(MAGIC) + 4 + len(header_bytes)
+    data_start += -data_start % ALIGNMENT
+
+    partial = output_path + ".part"
+    with open(partial, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, values in arrays.items():
+            offset = header["arrays"][name][0]
+            f.write(b"\0" * (data_start + offset - f.tell()))
+            values.tofile(f)
+    os.replace(partial, output_path)
+
+    return {
+        "nodes": len(lats),
+        "edges": {profile: info["edges"] for profile, info in header["profiles"].items()},
+    }
+
+
+
+# ===========================================================
+#                    Graph Loading & Queries
+# ===========================================================
+class RoutingGraph:
+    """
+    A graph file mapped into memory. Arrays are read-only memoryviews
+    over the mapping, so loading is O(1) and pages are shared between
+    processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise RoutingError(f"{path} is not a routing graph file")
+        (header_length,) = struct.unpack_from("<I", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._mmap[start:start + header_length])
+        data_start = start + header_length
+        data_start += -data_start % ALIGNMENT
+
+        view = memoryview(self._mmap)
+        self.arrays = {}
+        for name, (offset, typecode, length) in self.header["arrays"].items():
+            itemsize = array(typecode).itemsize
+            begin = data_start + offset
+            self.arrays[name] = view[begin:begin + length * itemsize].cast(typecode)
+
+        self.lat = self.arrays["lat"]
+        self.lng = self.arrays["lng"]
+        self.x, self.y, self.z = self.arrays["x"], self.arrays["y"], self.arrays["z"]
+        self.cell = self.header["cell_degrees"]
+        self.columns = ceil(360 / self.cell)
+
+    @property
+    def profiles(self):
+        return tuple(self.header["profiles"])
+
+    def _edges(self, profile, direction):
+        return (
+            self.arrays[f"{profile}.{direction}_offsets"],
+            self.arrays[f"{profile}.{direction}_targets"],
+            self.arrays[f"{profile}.{direction}_weights"],
+        )
+
+    def nearest_node(self, lat, lng, profile):
+        """
+        Returns the closest node that has edges in `profile`, searching
+        grid cells in growing rings around the point.
+        """
+
+        fwd_offsets = self.arrays[f"{profile}.fwd_offsets"]
+        bwd_offsets = self.arrays[f"{profile}.bwd_offsets"]
+        keys = self.arrays["grid_keys"]
+        cell_offsets = self.arrays["grid_offsets"]
+        nodes = self.arrays["grid_nodes"]
+
+        row = floor((lat + 90) / self.cell)
+        column = floor((lng + 180) / self.cell)
+        best, best_distance = None, float("inf")
+
+        for ring in range(SNAP_MAX_CELLS + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(column - ring, column + ring + 1):
+                    if max(abs(r - row), abs(c - column)) != ring:
+                        continue
+                    key = r * self.columns + c
+                    i = bisect_left(keys, key)
+                    if i == len(keys) or keys[i] != key:
+                        continue
+                    for node in nodes[cell_offsets[i]:cell_offsets[i + 1]]:
+                        if fwd_offsets[node] == fwd_offsets[node + 1] and bwd_offsets[node] == bwd_offsets[node + 1]:
+                            continue
+                        distance = _distance_m(lat, lng, self.lat[node], self.lng[node])
+                        if distance < best_distance:
+                            best, best_distance = node, distance
+            # Anything in a further ring is at least `ring` cells away
+            if best is not None and best_distance < ring * self.cell * 111_000 * cos(radians(lat)):
+                break
+
+        if best is None:
+            raise RoutingError("No routable road near the requested point")
+        return best
+
+    def shortest_path(self, source, target, profile):
+        """
+        Bidirectional A* between two nodes.
+
+        Both searches run Dijkstra on edge weights reduced by the averaged
+        potential p(v) = (h_target(v) - h_source(v)) / 2, which is
+        consistent for both directions, so the usual bidirectional
+        stopping rule applies. h is the chord distance divided by the
+        profile's top speed, a lower bound of the travel time.
+
+        Returns:
+            list[int]: Node indexes from `source` to `target`.
+        """
+
+        if source == target:
+            return [source]
+
+        X, Y, Z = self.x, self.y, self.z
+        sx, sy, sz = X[source], Y[source], Z[source]
+        tx, ty, tz = X[target], Y[target], Z[target]
+        scale = EARTH_RADIUS_M / (2 * self.header["profiles"][profile]["max_speed"])
+        potentials = {}
+
+        def potential(v):
+            p = potentials.get(v)
+            if p is None:
+                x, y, z = X[v], Y[v], Z[v]
+                to_target = sqrt((x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2)
+                to_source = sqrt((x - sx) ** 2 + (y - sy) ** 2 + (z - sz) ** 2)
+                p = potentials[v] = (to_target - to_source) * scale
+            return p
+
+        searches = [
+            (self._edges(profile, "fwd"), {source: 0.0}, {source: -1}, [(0.0, source)], 1),
+            (self._edges(profile, "bwd"), {target: 0.0}, {target: -1}, [(0.0, target)], -1),
+        ]
+        settled = (set(), set())
+        best, meeting = float("inf"), None
+
+        while searches[0][3] and searches[1][3]:
+            if searches[0][3][0][0] + searches[1][3][0][0] >= best:
+                break
+
+            side = 0 if searches[0][3][0][0] <= searches[1][3][0][0] else 1
+            (offsets, targets, weights), dist, parent, heap, sign = searches[side]
+            other_dist = searches[1 - side][1]
+
+            d, u = heapq.heappop(heap)
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+
+            p_u = sign * potential(u)
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                reduced = weights[i] - p_u + sign * potential(v)
+                nd = d + max(reduced, 0.0)
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+                    if v in other_dist and nd + other_dist[v] < best:
+                        best, meeting = nd + other_dist[v], v
+
+        if meeting is None:
+            raise RoutingError("No route found between the requested points")
+
+        forward_parent, backward_parent = searches[0][2], searches[1][2]
+        path = []
+        node = meeting
+        while node != -1:
+            path.append(node)
+            node = forward_parent[node]
+        path.reverse()
+        node = backward_parent[meeting]
+        while node != -1:
+            path.append(node)
+            node = backward_parent[node]
+        return path
+
+    def travel_times(self, nodes, profile):
+        """
+        Travel times between all pairs of `nodes`, with one Dijkstra per
+        source that stops once every other node is settled.
+
+        Returns:
+            list[list[float]]: Seconds from nodes[i] to nodes[j]
+                (inf where no path exists).
+        """
+
+        offsets, targets, weights = self._edges(profile, "fwd")
+        index = {}
+        for i, node in enumerate(nodes):
+            index.setdefault(node, []).append(i)
+
+        matrix = []
+        for source in nodes:
+            row = [float("inf")] * len(nodes)
+            remaining = len(index)
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = set()
+            while heap and remaining:
+                d, u = heapq.heappop(heap)
+                if u in settled:
+                    continue
+                settled.add(u)
+                if u in index:
+                    for j in index[u]:
+                        row[j] = d
+                    remaining -= 1
+                for i in range(offsets[u], offsets[u + 1]):
+                    v = targets[i]
+                    nd = d + weights[i]
+                    if nd < dist.get(v, float("inf")):
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+            matrix.append(row)
+
+        return matrix
+
+    def matrix(self, points, profile = "foot-walking"):
+        """
+        Travel-time matrix between {'lat', 'lng'} points (seconds).
+        """
+
+        if profile not in self.header["profiles"]:
+            raise RoutingError(f"Profile {profile} is not in the routing graph")
+
+        return self.travel_times([self.nearest_node(p["lat"], p["lng"], profile) for p in points], profile)
+
+    def route(self, points, profile = "foot-walking"):
+        """
+        Routes through `points` in order.
+
+        Args:
+            points (list[dict]): {'lat', 'lng'} start, waypoints and end.
+            profile (str): One of `PROFILES`.
+        Returns:
+            list[dict]: {'lat', 'lng'} points along the route.
+        """
+
+        if profile not in self.header["profiles"]:
+            raise RoutingError(f"Profile {profile} is not in the routing graph")
+
+        nodes = [self.nearest_node(p["lat"], p["lng"], profile) for p in points]
+        path = []
+        for source, target in zip(nodes, nodes[1:]):
+            leg = self.shortest_path(source, target, profile)
+            path.extend(leg[1:] if path else leg)
+
+        return [{"lat": self.lat[n], "lng": self.lng[n]} for n in path]
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+def load_graph(path):
+    """
+    Returns the graph at `path`, mapping it on first use.
+    """
+
+    graph = _graphs.get(path)
+    if graph is None:
+        with _graphs_lock:
+            graph = _graphs.get(path)
+            if graph is None:
+                if not os.path.exists(path):
+                    raise RoutingError(f"Routing graph {path} not found")
+                graph = _graphs[path] = RoutingGraph(path)
+    return graph
@@ -0,0 +1,400 @@
+"""
+Incremental route editing.
+
+Each route's stored points are split into segments (vertex i to
+vertex i + 1). For every segment we keep its length and the summary of
+the elevation samples taken along it. Those summaries add up exactly to
+the route's metrics. An edit (moved, inserted or removed vertices)
+therefore only resamples the segments next to the changed vertices.
+The route aggregates are then rebuilt from the stored summaries.
+
+When the route has a routed geometry (see planning.py), its first edit
+measures each segment along the routed path between the two key
+points, so untouched segments keep their routed length and elevation.
+Segments whose elevation samples could not all be looked up are not
+stored, and leave the route's elevation metrics as they were.
+
+This module includes:
+    - The `route_segments` table, with triggers that drop the stored
+      segments whenever a route's coordinates change by other means
+    - Building segment summaries and aggregating them into metrics
+    - Applying a vertex diff to a stored route
+"""
+
+
+import json
+
+from helpers import (
+    get_elevations,
+    haversine,
+    known_elevations,
+    RESAMPLE_MAX_SAMPLES,
+    RESAMPLE_STEP_METERS,
+    resample_route,
+)
+from planning import route_geometry
+
+
+
+SEGMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS route_segments (
+    route_id INTEGER PRIMARY KEY,
+    step_meters REAL NOT NULL,
+    segments TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS route_segments_on_delete
+AFTER DELETE ON routes
+BEGIN
+    DELETE FROM route_segments WHERE route_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_segments_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    DELETE FROM route_segments WHERE route_id = OLD.id;
+END;
+"""
+
+# Fields of one stored segment, in order
+LENGTH, GAIN, LOSS, MIN, MAX, ELEVATION_SUM, SAMPLES, END_ELEVATION = range(8)
+
+MAX_CHANGES = 1000
+
+
+
+class InvalidEdit(Exception):
+    """
+    Raised when a diff does not apply to the stored route.
+    """
+
+class EditConflict(Exception):
+    """
+    Raised when the route changed while the edit was being computed.
+    """
+
+
+
+def init_segment_schema(connection):
+    """
+    Creates the `route_segments` table and its invalidation triggers.
+    """
+
+    connection.executescript(SEGMENT_SCHEMA)
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Segment Summaries
+# ===========================================================
+def route_step(coordinates):
+    """
+    Sampling step for a route, chosen like `process_route_internal`
+    does, so that long routes stay within `RESAMPLE_MAX_SAMPLES`.
+    """
+
+    total = sum(haversine(a, b) for a, b in zip(coordinates, coordinates[1:])) * 1000
+    return max(RESAMPLE_STEP_METERS, total / max(RESAMPLE_MAX_SAMPLES - 1, 1))
+
+def _path_length(path):
+    return sum(haversine(a, b) for a, b in zip(path, path[1:])) * 1000
+
+def split_geometry(geometry, coordinates):
+    """
+    Cuts a routed geometry into one path per key point segment. Each
+    inner key point is matched to the nearest geometry point after the
+    previous match, since routing snaps waypoints to the network.
+
+    Args:
+        geometry (list[dict]): Routed {'lat', 'lng'} points.
+        coordinates (list[dict]): The route's key points.
+    Returns:
+        list[list[dict]]: Path of every segment, in order.
+    """
+
+    cuts = [0]
+    for point in coordinates[1:-1]:
+        start = cuts[-1]
+        cuts.append(min(
+            range(start, len(geometry)),
+            key = lambda i: haversine(geometry[i], point)
+        ))
+    cuts.append(len(geometry) - 1)
+
+    return [geometry[a:b + 1] for a, b in zip(cuts, cuts[1:])]
+
+def build_segments(paths, step_meters):
+    """
+    Computes the summaries of the given segments, fetching the
+    elevations of all their samples in one `get_elevations` call.
+
+    Args:
+        paths (list[list[dict]]): {'lat', 'lng'} points along each segment,
+            usually just its start and end.
+        step_meters (float): Distance between elevation samples.
+    Returns:
+        tuple: (list of segment summaries, number of samples looked up,
+            samples without an elevation per segment).
+    """
+
+    samples = [resample_route(path, step_meters, max_samples = 1_000_000) for path in paths]
+    flat = [point for segment in samples for point in segment]
+    get_elevations(flat, batch_size = 100)
+
+    segments = []
+    missing = []
+    for path, points in zip(paths, samples):
+        elevations, segment_missing = known_elevations(points)
+        missing.append(segment_missing)
+        gain = loss = 0.0
+        for previous, current in zip(elevations, elevations[1:]):
+            if current > previous:
+                gain += current - previous
+            else:
+                loss += previous - current
+
+        # The end point belongs to the next segment, except for the last one
+        segments.append([
+            round(_path_length(path), 3),
+            round(gain, 3),
+            round(loss, 3),
+            min(elevations),
+            max(elevations),
+            round(sum(elevations[:-1]), 3),
+            len(elevations) - 1,
+            elevations[-1],
+        ])
+
+    return segments, len(flat), missing
+
+def aggregate(segments):
+    """
+    Combines segment summaries into the route metrics returned by
+    `process_route_internal`.
+    """
+
+    if not segments:
+        return {
+            "total_distance": 0,
+            "elevation_gain": 0,
+            "elevation_loss": 0,
+            "max_elevation": 0,
+            "min_elevation": 0,
+            "average_elevation": 0
+        }
+
+    elevation_sum = sum(s[ELEVATION_SUM] for s in segments) + segments[-1][END_ELEVATION]
+    sample_count = sum(s[SAMPLES] for s in segments) + 1
+
+    return {
+        "total_distance": round(sum(s[LENGTH] for s in segments) / 1000, 2),
+        "elevation_gain": round(sum(s[GAIN] for s in segments), 2),
+        "elevation_loss": round(sum(s[LOSS] for s in segments), 2),
+        "max_elevation": round(max(s[MAX] for s in segments), 2),
+        "min_elevation": round(min(s[MIN] for s in segments), 2),
+        "average_elevation": round(elevation_sum / sample_count, 2)
+    }
+
+
+
+# ===========================================================
+#                    Diffs
+# ===========================================================
+def _point(change):
+    try:
+        lat, lng = float(change["lat"]), float(change["lng"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidEdit("Each inserted or moved vertex needs numeric 'lat' and 'lng'")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise InvalidEdit("Vertex out of range")
+    return {"lat": lat, "lng": lng}
+
+def apply_changes(coordinates, segments, changes):
+    """
+    Applies a list of changes in order. Each index refers to the route
+    as left by the previous change. Segments touching a changed vertex
+    are replaced by None, which marks them for recomputation.
+
+    Changes:
+        {"op": "move", "index": i, "lat": .., "lng": ..}
+        {"op": "insert", "index": i, "lat": .., "lng": ..}  (before vertex i; i = len appends)
+        {"op": "remove", "index": i}
+    """
+
+    coordinates = list(coordinates)
+    segments = list(segments)
+
+    for change in changes:
+        op = change.get("op") if isinstance(change, dict) else None
+        index = change.get("index") if isinstance(change, dict) else None
+        n = len(coordinates)
+
+        if not isinstance(index, int) or isinstance(index, bool):
+            raise InvalidEdit("Each change needs an integer 'index'")
+
+        if op == "move":
+            if not 0 <= index < n:
+                raise InvalidEdit(f"Vertex {index} does not exist")
+            coordinates[index] = _point(change)
+            if index > 0:
+                segments[index - 1] = None
+            if index < n - 1:
+                segments[index] = None
+
+        elif op == "insert":
+            if not 0 <= index <= n:
+                raise InvalidEdit(f"Cannot insert at {index}")
+            coordinates.insert(index, _point(change))
+            if n == 0:
+                continue
+            if 0 < index < n:
+                segments[index - 1] = None
+            segments.insert(min(index, len(segments)), None)
+
+        elif op == "remove":
+            if not 0 <= index < n:
+                raise InvalidEdit(f"Vertex {index} does not exist")
+            del coordinates[index]
+            if n == 1:
+                continue
+            if index == 0:
+                del segments[0]
+            elif index == n - 1:
+                del segments[-1]
+            else:
+                del segments[index]
+                segments[index - 1] = None
+
+        else:
+            raise InvalidEdit("'op' must be 'move', 'insert' or 'remove'")
+
+    if len(coordinates) < 2:
+        raise InvalidEdit("A route needs at least two points")
+
+    return coordinates, segments
+
+def edit_route_geometry(connection, route_id, user_id, changes, expected_points = None):
+    """
+    Applies `changes` to a stored route and updates its coordinates and
+    metrics. Only the segments next to changed vertices are resampled.
+    The first edit of a route builds all its segments once, along its
+    routed geometry when one is stored.
+
+    The elevation metrics are only updated when every segment's samples
+    were found; segments with missing samples are stored as None, to be
+    recomputed by the next edit.
+
+    Args:
+        connection (sqlite3.Connection): Database connection.
+        route_id (int): Route to edit.
+        user_id (int): Owner; other users' routes are not found.
+        changes (list[dict]): See `apply_changes`.
+        expected_points (int): Optional point count the client based the
+            diff on; a mismatch raises `EditConflict`.
+    Returns:
+        dict | None: New metrics plus 'points', 'recomputed_segments',
+            'elevation_samples' and 'elevation_missing' (without the
+            elevation metrics when samples were missing), or None if the
+            route was not found.
+    """
+
+    if not isinstance(changes, list) or not changes:
+        raise InvalidEdit("Expected a non-empty 'changes' list")
+    if len(changes) > MAX_CHANGES:
+        raise InvalidEdit(f"At most {MAX_CHANGES} changes per request")
+
+    row = connection.execute(
+        """SELECT routes.coordinates, route_segments.step_meters, route_segments.segments
+        FROM routes
+        LEFT JOIN route_segments ON route_segments.route_id = routes.id
+        WHERE routes.id = ? AND routes.user_id = ?""",
+        (route_id, user_id)
+    ).fetchone()
+
+    if row is None:
+        return None
+
+    stored_json, step_meters, segments_json = row
+    coordinates = [{"lat": lat, "lng": lng} for lat, lng in json.loads(stored_json)]
+
+    if expected_points is not None and expected_points != len(coordinates):
+        raise EditConflict("The route has changed since it was loaded")
+
+    paths = {}
+    if segments_json is None:
+        # First incremental edit: every segment is computed once
+        geometry = route_geometry(connection, route_id)
+        if geometry and len(coordinates) >= 2:
+            step_meters = route_step(geometry)
+            paths = dict(enumerate(split_geometry(geometry, coordinates)))
+            segments = [None] * len(paths)
+        else:
+            step_meters = route_step(coordinates)
+            segments = [None] * max(len(coordinates) - 1, 0)
+    else:
+        segments = json.loads(segments_json)
+
+    # Unchanged segments keep their routed path
+    segments = [
+        segment if segment is not None else paths.get(i)
+        for i, segment in enumerate(segments)
+    ]
+    coordinates, segments = apply_changes(coordinates, segments, changes)
+
+    dirty = [i for i, segment in enumerate(segments) if segment is None or isinstance(segment[0], dict)]
+    built, sample_count, missing = build_segments(
+        [segments[i] or [coordinates[i], coordinates[i + 1]] for i in dirty], step_meters
+    )
+    for i, segment in zip(dirty, built):
+        segments[i] = segment
+
+    metrics = aggregate(segments)
+    elevation_missing = sum(missing)
+    if elevation_missing:
+        for i, segment_missing in zip(dirty, missing):
+            if segment_missing:
+                segments[i] = None
+        elevation = [None] * 5
+    else:
+        elevation = [
+            metrics["elevation_gain"], metrics["elevation_loss"], metrics["max_elevation"],
+            metrics["min_elevation"], metrics["average_elevation"]
+        ]
+
+    new_json = json.dumps([[c["lat"], c["lng"]] for c in coordinates])
+
+    # Optimistic check: the UPDATE only applies if nobody changed the route meanwhile
+    with connection:
+        cursor = connection.execute(
+            """UPDATE routes SET
+            coordinates = ?,
+            total_distance = ?,
+            elevation_gain = coalesce(?, elevation_gain),
+            elevation_loss = coalesce(?, elevation_loss),
+            max_elevation = coalesce(?, max_elevation),
+            min_elevation = coalesce(?, min_elevation),
+            avg_elevation = coalesce(?, avg_elevation)
+            WHERE id = ? AND user_id = ? AND coordinates = ?""",
+            (new_json, metrics["total_distance"], *elevation, route_id, user_id, stored_json)
+        )
+        if cursor.rowcount == 0:
+            raise EditConflict("The route has changed since it was loaded")
+
+        # After the UPDATE, whose trigger dropped the old segments
+        connection.execute(
+            "INSERT OR REPLACE INTO route_segments (route_id, step_meters, segments) VALUES (?, ?, ?)",
+            (route_id, step_meters, json.dumps(segments, separators = (",", ":")))
+        )
+
+    if elevation_missing:
+        metrics = {"total_distance": metrics["total_distance"]}
+
+    return {
+        **metrics,
+        "points": len(coordinates),
+        "recomputed_segments": len(dirty),
+        "elevation_samples": sample_count,
+        "elevation_missing": elevation_missing,
+    }
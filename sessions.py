@@ -0,0 +1,197 @@
+"""
+Server-side sessions shared by all workers.
+
+This module includes:
+    - A stable secret key (from `SECRET_KEY` or a key file created
+      once), so every worker and every restart signs cookies alike
+    - A Flask `SessionInterface` keeping session data in SQLite,
+      with only a random, signed session id in the cookie
+    - Session id rotation on login (against session fixation)
+"""
+
+
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+
+CLEANUP_PROBABILITY = 0.01 # Share of writes that also purge expired sessions
+
+
+
+# ===========================================================
+#                    Secret Key
+# ===========================================================
+def load_secret_key(path):
+    """
+    Returns `SECRET_KEY` from the environment, or the key stored in
+    `path`, creating it on first start. The file is created atomically,
+    so workers starting together all read the same key.
+    """
+
+    key = os.getenv("SECRET_KEY")
+    if key:
+        return key
+
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.01) # Another worker is still writing it
+        raise RuntimeError(f"Secret key file {path} is empty")
+
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key
+
+
+
+# ===========================================================
+#                    Session Store
+# ===========================================================
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    Session data loaded from the store. `modified` is set on any change.
+    """
+
+    def __init__(self, initial = None, sid = None, expires = None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.previous_sid = None
+        self.modified = False
+
+    def rotate(self):
+        """
+        Moves the data to a new session id; call after logging in.
+        """
+
+        self.previous_sid = self.previous_sid or self.sid
+        self.sid = None
+        self.modified = True
+
+class SQLiteSessionInterface(SessionInterface):
+    """
+    Stores sessions in a SQLite file, one row per session id.
+    Rows are written only when the session changes, or when less than
+    half of its lifetime is left.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        connection.commit()
+
+    def _connection(self):
+        # Per thread, and never reused across a fork (gunicorn --preload)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = 5)
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt = "server-session")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSideSession()
+
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return ServerSideSession()
+
+        row = self._connection().execute(
+            "SELECT data, expires FROM sessions WHERE id = ? AND expires > ?", (sid, time.time())
+        ).fetchone()
+        if row is None:
+            return ServerSideSession()
+
+        return ServerSideSession(self.serializer.loads(row[0]), sid = sid, expires = row[1])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        connection = self._connection()
+
+        if session.previous_sid:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session.previous_sid,))
+            connection.commit()
+
+        if not session:
+            if session.sid:
+                connection.execute("DELETE FROM sessions WHERE id = ?", (session.sid,))
+                connection.commit()
+            if session.modified:
+                response.delete_cookie(name, domain = domain, path = path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        stale = session.expires is None or session.expires - now < lifetime / 2
+        if not (session.modified or session.sid is None or stale):
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+
+        connection.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+            (session.sid, self.serializer.dumps(dict(session)), now + lifetime)
+        )
+        if random.random() < CLEANUP_PROBABILITY:
+            connection.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+        connection.commit()
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires = self.get_expiration_time(app, session),
+            httponly = self.get_cookie_httponly(app),
+            domain = domain,
+            path = path,
+            secure = self.get_cookie_secure(app),
+            samesite = self.get_cookie_samesite(app),
+        )
+        response.vary.add("Cookie")
+
+def init_sessions(app):
+    """
+    Sets a stable secret key and installs the SQLite session store.
+    """
+
+    app.secret_key = load_secret_key(app.config.get("SECRET_KEY_FILE", ".secret_key"))
+    app.session_interface = SQLiteSessionInterface(app.config.get("SESSION_DATABASE", "sessions.db"))
@@ -0,0 +1,508 @@
+"""
+Geometry fingerprints for similar and duplicate route detection.
+
+A route is resampled every `SAMPLE_STEP_METERS` and reduced to the set
+of geohash cells (about 150 m wide) it passes through. That cell set is
+independent of vertex density and of small GPS noise. Its MinHash
+signature estimates the Jaccard similarity between two routes, and
+locality-sensitive hashing (bands of the signature) finds the candidate
+routes without comparing against every stored route.
+
+This module includes:
+    - Geohash cells and MinHash signatures
+    - The `route_fingerprints` / `route_lsh` index, kept in step with
+      `routes` by triggers and a small queue of routes to (re)index
+    - A background thread per worker draining that queue, so requests
+      only read the index
+    - Similar-route lookups
+    - Recently computed route metrics, reused for near-identical routes
+    - Removal of route images that duplicates may share
+"""
+
+
+import hashlib
+import json
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+from background import BackgroundJob
+from helpers import resample_route
+from metrics import increment, timed
+
+
+
+GEOHASH_BITS = 35               # Geohash precision 7: cells of about 153 x 153 m
+SAMPLE_STEP_METERS = 50
+MAX_SAMPLES = 20_000
+SIGNATURE_SIZE = 96
+LSH_BANDS = 32                  # 32 bands x 3 rows: candidates from ~30% similarity
+LSH_ROWS = SIGNATURE_SIZE // LSH_BANDS
+MAX_CANDIDATES = 200
+SIMILAR_THRESHOLD = 0.5
+DUPLICATE_THRESHOLD = 0.8       # Warn that the route probably exists already
+REUSE_THRESHOLD = 0.9           # Reuse the metrics and image computed for a near-identical route
+COMPUTED_ROUTES_SIZE = 256      # Computed routes remembered per worker
+INDEX_BATCH_SIZE = 20           # Routes fingerprinted per write transaction
+                                # (~3 ms per 10 km of route, ~0.2 s for 600 km)
+
+DEFAULTS = {
+    "FINGERPRINT_INDEX_INTERVAL": 30,       # Seconds between queue checks; 0 disables the thread
+}
+
+# Routed geometry when stored, else the key points (both JSON [[lat, lng], ...])
+INDEXED_POINTS = "coalesce(route_geometries.geometry, routes.coordinates)"
+
+MERSENNE_PRIME = (1 << 61) - 1
+MASK_64 = (1 << 64) - 1
+
+FINGERPRINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS route_fingerprints (
+    route_id INTEGER PRIMARY KEY,
+    cell_count INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS route_lsh (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    route_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, route_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS route_lsh_route ON route_lsh (route_id);
+
+CREATE TABLE IF NOT EXISTS fingerprint_queue (
+    route_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS fingerprints_on_insert
+AFTER INSERT ON routes
+BEGIN
+    INSERT OR IGNORE INTO fingerprint_queue (route_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS fingerprints_on_geometry
+AFTER INSERT ON route_geometries
+BEGIN
+    INSERT OR IGNORE INTO fingerprint_queue (route_id) VALUES (NEW.route_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS fingerprints_on_update
+AFTER UPDATE OF coordinates ON routes
+WHEN NEW.coordinates IS NOT OLD.coordinates
+BEGIN
+    DELETE FROM route_fingerprints WHERE route_id = OLD.id;
+    DELETE FROM route_lsh WHERE route_id = OLD.id;
+    INSERT OR IGNORE INTO fingerprint_queue (route_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS fingerprints_on_delete
+AFTER DELETE ON routes
+BEGIN
+    DELETE FROM route_fingerprints WHERE route_id = OLD.id;
+    DELETE FROM route_lsh WHERE route_id = OLD.id;
+    DELETE FROM fingerprint_queue WHERE route_id = OLD.id;
+END;
+"""
+
+
+
+def _permutations():
+    """
+    Fixed (a, b) pairs for h(x) = (a * x + b) mod p, derived from a
+    constant seed so signatures stay comparable across processes.
+    """
+
+    pairs = []
+    for i in range(SIGNATURE_SIZE):
+        digest = hashlib.blake2b(f"route-minhash-{i}".encode(), digest_size = 16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        pairs.append((a % (MERSENNE_PRIME - 1) + 1, b % MERSENNE_PRIME))
+    return pairs
+
+PERMUTATIONS = _permutations()
+
+def init_fingerprint_schema(connection):
+    """
+    Creates the fingerprint index and queues the routes not indexed yet.
+    """
+
+    connection.executescript(FINGERPRINT_SCHEMA)
+    connection.execute(
+        """INSERT OR IGNORE INTO fingerprint_queue (route_id)
+        SELECT id FROM routes WHERE id NOT IN (SELECT route_id FROM route_fingerprints)"""
+    )
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Fingerprints
+# ===========================================================
+def _spread(value):
+    """
+    Moves bit i of a value below 2^18 to bit 2i.
+    """
+
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+LNG_BITS = (GEOHASH_BITS + 1) // 2
+LAT_BITS = GEOHASH_BITS // 2
+
+def _grid(lat, lng):
+    """
+    Column and row of a point on the geohash grid.
+    """
+
+    column = min(int((lng + 180.0) / 360.0 * (1 << LNG_BITS)), (1 << LNG_BITS) - 1)
+    row = min(int((lat + 90.0) / 180.0 * (1 << LAT_BITS)), (1 << LAT_BITS) - 1)
+    return column, row
+
+def _interleave(column, row):
+    # Longitude takes the first (highest) bit, so the lowest one too when the count is odd
+    if GEOHASH_BITS % 2:
+        return _spread(column) | (_spread(row) << 1)
+    return (_spread(column) << 1) | _spread(row)
+
+def geohash_cell(lat, lng):
+    """
+    Integer geohash: the bits of the base32 geohash string, i.e.
+    longitude and latitude bisections interleaved, longitude first.
+    """
+
+    return _interleave(*_grid(lat, lng))
+
+def route_cells(coordinates):
+    """
+    Geohash cells of a route resampled every `SAMPLE_STEP_METERS`.
+
+    Args:
+        coordinates (list): {'lat', 'lng'} dicts or [lat, lng] pairs.
+    """
+
+    points = [
+        c if isinstance(c, dict) else {"lat": c[0], "lng": c[1]}
+        for c in coordinates
+    ]
+    if not points:
+        return set()
+
+    samples = resample_route(points, SAMPLE_STEP_METERS, max_samples = MAX_SAMPLES)
+    # Consecutive samples mostly share a cell: interleave the distinct ones only
+    return {_interleave(*grid) for grid in {_grid(p["lat"], p["lng"]) for p in samples}}
+
+def _mix(value):
+    """
+    splitmix64 finalizer, spreading nearby cell numbers over 64 bits.
+    """
+
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+def minhash(cells):
+    """
+    MinHash signature of a cell set (`SIGNATURE_SIZE` minimums).
+    """
+
+    hashed = [_mix(cell) for cell in cells]
+    if not hashed:
+        return [MERSENNE_PRIME] * SIGNATURE_SIZE
+    return [min([(a * h + b) % MERSENNE_PRIME for h in hashed]) for a, b in PERMUTATIONS]
+
+def fingerprint(coordinates):
+    """
+    Returns:
+        tuple: (signature list, number of cells).
+    """
+
+    cells = route_cells(coordinates)
+    return minhash(cells), len(cells)
+
+def band_buckets(signature):
+    """
+    One bucket key per LSH band (signed 64-bit, to fit SQLite integers).
+    """
+
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = array("Q", signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]).tobytes()
+        digest = hashlib.blake2b(rows, digest_size = 8).digest()
+        buckets.append((band, struct.unpack("<q", digest)[0]))
+    return buckets
+
+def similarity(signature_a, signature_b):
+    """
+    Estimated Jaccard similarity of the two routes' cell sets.
+    """
+
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / SIGNATURE_SIZE
+
+
+
+# ===========================================================
+#                    Index
+# ===========================================================
+def _store(connection, route_id, signature, cell_count):
+    connection.execute(
+        "INSERT OR REPLACE INTO route_fingerprints (route_id, cell_count, signature) VALUES (?, ?, ?)",
+        (route_id, cell_count, array("Q", signature).tobytes())
+    )
+    connection.execute("DELETE FROM route_lsh WHERE route_id = ?", (route_id,))
+    connection.executemany(
+        "INSERT OR IGNORE INTO route_lsh (band, bucket, route_id) VALUES (?, ?, ?)",
+        [(band, bucket, route_id) for band, bucket in band_buckets(signature)]
+    )
+
+def index_fingerprints(connection, limit = INDEX_BATCH_SIZE):
+    """
+    Fingerprints the queued routes (new or with changed coordinates).
+
+    A route is fingerprinted on its routed geometry when stored (see
+    planning.py), like the geometry `/get-route` looks up, and on its
+    key points otherwise. Signatures are computed outside the write
+    transaction. A route whose points changed meanwhile stays queued
+    for the next call.
+
+    Returns:
+        int: Number of routes indexed.
+    """
+
+    if connection.in_transaction:
+        connection.commit()
+
+    rows = connection.execute(
+        f"""SELECT routes.id, {INDEXED_POINTS} FROM fingerprint_queue
+        JOIN routes ON routes.id = fingerprint_queue.route_id
+        LEFT JOIN route_geometries ON route_geometries.route_id = routes.id
+        LIMIT ?""",
+        (limit,)
+    ).fetchall()
+    if not rows:
+        return 0
+
+    computed = []
+    with timed("route_fingerprint"):
+        for route_id, coordinates_json in rows:
+            try:
+                coordinates = json.loads(coordinates_json)
+            except (TypeError, ValueError):
+                coordinates = []
+            computed.append((route_id, coordinates_json, *fingerprint(coordinates)))
+
+    indexed = 0
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for route_id, coordinates_json, signature, cell_count in computed:
+            current = connection.execute(
+                f"""SELECT {INDEXED_POINTS} FROM routes
+                LEFT JOIN route_geometries ON route_geometries.route_id = routes.id
+                WHERE routes.id = ?""",
+                (route_id,)
+            ).fetchone()
+            if current is None or current[0] != coordinates_json:
+                continue
+            _store(connection, route_id, signature, cell_count)
+            connection.execute("DELETE FROM fingerprint_queue WHERE route_id = ?", (route_id,))
+            indexed += 1
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    increment("route_fingerprints_indexed_total", indexed)
+    return indexed
+
+def find_similar(connection, signature, threshold = SIMILAR_THRESHOLD, limit = 10, exclude = None):
+    """
+    Routes whose estimated similarity to `signature` reaches `threshold`.
+
+    Only routes sharing at least one LSH bucket are compared, so the
+    cost depends on the number of near matches, not on the table size.
+
+    Returns:
+        list[dict]: {'route_id', 'name', 'similarity'}, most similar first.
+    """
+
+    buckets = band_buckets(signature)
+    values = ", ".join("(?, ?)" for _ in buckets)
+    rows = connection.execute(
+        f"""WITH wanted (band, bucket) AS (VALUES {values})
+        SELECT route_lsh.route_id, count(*) AS hits
+        FROM wanted
+        JOIN route_lsh ON route_lsh.band = wanted.band AND route_lsh.bucket = wanted.bucket
+        GROUP BY route_lsh.route_id
+        ORDER BY hits DESC
+        LIMIT ?""",
+        [v for pair in buckets for v in pair] + [MAX_CANDIDATES]
+    ).fetchall()
+
+    candidates = [row[0] for row in rows if row[0] != exclude]
+    if not candidates:
+        return []
+
+    placeholders = ", ".join("?" for _ in candidates)
+    matches = []
+    for route_id, name, blob in connection.execute(
+        f"""SELECT route_fingerprints.route_id, routes.name, route_fingerprints.signature
+        FROM route_fingerprints
+        JOIN routes ON routes.id = route_fingerprints.route_id
+        WHERE route_fingerprints.route_id IN ({placeholders})""",
+        candidates
+    ):
+        score = similarity(signature, array("Q", blob))
+        if score >= threshold:
+            matches.append({"route_id": route_id, "name": name, "similarity": round(score, 3)})
+
+    matches.sort(key = lambda m: (-m["similarity"], m["route_id"]))
+    return matches[:limit]
+
+def similar_to_route(connection, route_id, threshold = SIMILAR_THRESHOLD, limit = 10):
+    """
+    Similar routes of a stored route, or None if it is not indexed yet.
+    """
+
+    row = connection.execute(
+        "SELECT signature FROM route_fingerprints WHERE route_id = ?", (route_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return find_similar(connection, list(array("Q", row[0])), threshold, limit, exclude = route_id)
+
+
+
+# ===========================================================
+#                    Background Indexer
+# ===========================================================
+def _index_pending(connection, interval):
+    while index_fingerprints(connection):
+        pass
+
+indexer = BackgroundJob("fingerprint-index", _index_pending)
+
+def request_indexing():
+    """
+    Wakes this worker's indexer after routes were created or edited,
+    instead of waiting for its next check. Never blocks.
+    """
+
+    indexer.wake()
+
+def init_similarity(app, database):
+    """
+    Fills in the fingerprint settings and starts the indexer with the
+    first request of each worker.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    indexer.init_app(app, database, app.config["FINGERPRINT_INDEX_INTERVAL"])
+
+
+
+# ===========================================================
+#                    Computed Routes
+# ===========================================================
+class ComputedRoutes:
+    """
+    Metrics and map images `/get-route` computed for recent routes,
+    found by the same LSH bands as the stored index.
+
+    Only results computed here are reused: the metrics stored with a
+    route are sent by the client and may not match its coordinates.
+    Both sides are full routed geometries, never a route's key points.
+    When full, the least recently used entry is evicted.
+
+    Args:
+        max_size (int): Maximum number of routes remembered.
+    """
+
+    def __init__(self, max_size = COMPUTED_ROUTES_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()   # key -> (signature, buckets, details)
+        self._buckets = {}              # (band, bucket) -> keys
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def add(self, signature, details):
+        buckets = band_buckets(signature)
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (list(signature), buckets, dict(details))
+            for bucket in buckets:
+                self._buckets.setdefault(bucket, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def find(self, signature, threshold = REUSE_THRESHOLD):
+        """
+        Returns:
+            dict: A copy of the details of the most similar route
+                reaching `threshold`, or None.
+        """
+
+        with self._lock:
+            candidates = set()
+            for bucket in band_buckets(signature):
+                candidates |= self._buckets.get(bucket, set())
+
+            best, best_score = None, threshold
+            for key in candidates:
+                score = similarity(signature, self._entries[key][0])
+                if score >= best_score:
+                    best, best_score = key, score
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            return dict(self._entries[best][2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        _, buckets, _ = self._entries.pop(key)
+        for bucket in buckets:
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+
+
+# ===========================================================
+#                    Shared Images
+# ===========================================================
+def remove_route_image(connection, filename, folder):
+    """
+    Deletes a route's map image unless another route still uses it
+    (duplicates reuse the image of the route they match).
+    """
+
+    if not filename:
+        return
+
+    in_use = connection.execute(
+        "SELECT 1 FROM routes WHERE map_image_url = ? LIMIT 1", (filename,)
+    ).fetchone()
+    if in_use:
+        return
+
+    image_path = os.path.join(folder, filename)
+    if os.path.exists(image_path):
+        os.remove(image_path)
@@ -0,0 +1,118 @@
+"""
+Startup cost of the app: when the heavy libraries are imported and how
+much memory a worker takes.
+
+`create_app` does not import the routing, rendering and HTTP libraries
+(`HEAVY_MODULES`); the functions using them import them on first use,
+so a worker that only serves pages never loads them.
+
+Under `gunicorn --preload` the app is built once in the master and the
+workers are forked from it, sharing its memory copy-on-write. Setting
+`PRELOAD_MODULES=1` then imports the heavy libraries before the fork as
+well, so all workers share one copy of them instead of each loading its
+own on first use (see wsgi.py for the garbage collector side).
+
+This module includes:
+    - Preloading of the lazily imported libraries
+    - Memory usage of the process (RSS, and PSS / shared / private on Linux)
+    - Startup time and memory gauges for `/metrics`
+"""
+
+
+import importlib
+import os
+import sys
+
+from metrics import describe, log_event, set_gauge
+
+
+
+HEAVY_MODULES = (
+    "requests",             # Nominatim and OpenTopoData calls
+    "openrouteservice",     # Routing API client
+    "staticmap",            # Route map images
+    "PIL.Image",            # Avatars and heatmap PNGs
+    "PIL.ImageOps",
+)
+
+describe("app_startup_seconds", "Time create_app took to build the app in this process.")
+describe("process_resident_memory_bytes", "Resident memory of this worker.")
+describe("process_proportional_memory_bytes", "Memory of this worker with shared pages split among the processes sharing them (Linux).")
+describe("process_shared_memory_bytes", "Resident memory this worker shares with other processes, e.g. its gunicorn master (Linux).")
+describe("process_private_memory_bytes", "Resident memory only this worker uses (Linux).")
+describe("heavy_modules_loaded", "How many of the lazily imported libraries this worker has loaded.")
+
+
+
+def preload_modules():
+    """
+    Imports every lazily imported library now.
+    """
+
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+def loaded_modules():
+    """
+    The lazily imported libraries this process has loaded so far.
+    """
+
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+def memory_usage():
+    """
+    Memory of this process in bytes.
+
+    Returns:
+        dict: 'rss', 'pss', 'shared' and 'private' from
+            /proc/self/smaps_rollup, or only 'rss' (the peak) where
+            that file does not exist.
+    """
+
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == "kB":
+                    fields[name] = int(parts[0]) * 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss": peak if sys.platform == "darwin" else peak * 1024}
+
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+def record_process_metrics():
+    """
+    Updates the memory gauges of this worker (called by `/metrics`).
+    """
+
+    usage = memory_usage()
+    set_gauge("process_resident_memory_bytes", usage["rss"])
+    if "pss" in usage:
+        set_gauge("process_proportional_memory_bytes", usage["pss"])
+        set_gauge("process_shared_memory_bytes", usage["shared"])
+        set_gauge("process_private_memory_bytes", usage["private"])
+    set_gauge("heavy_modules_loaded", len(loaded_modules()))
+
+def record_startup(seconds):
+    """
+    Records how long building the app took, and logs it with the
+    memory used at that point.
+    """
+
+    set_gauge("app_startup_seconds", round(seconds, 4))
+    log_event(
+        "app_started",
+        pid = os.getpid(),
+        startup_ms = round(seconds * 1000, 1),
+        rss_mb = round(memory_usage()["rss"] / 2 ** 20, 1),
+        heavy_modules = loaded_modules()
+    )
@@ -13,6 +13,10 @@
 
 
 
+import { routeCoordinates } from "./geometry.js";
+
+
+
 document.addEventListener("DOMContentLoaded", () =>
   {
     const form = document.getElementById("create-route-form");
@@ -26,19 +30,20 @@ document.addEventListener("DOMContentLoaded", () =>
         return;
       }
       
-      // Parse coordinates if stored as a JSON string
-      if (typeof route_data.coordinates === "string") 
+      // Decode the stored geometry (encoded polyline or legacy JSON string)
+      try 
       {
-        try 
+        if (typeof route_data.coordinates === "string" && !route_data.coordinates_format) 
         {
           route_data.coordinates = JSON.parse(route_data.coordinates);
-        } 
-        catch (e) 
-        {
-          console.error("Invalid coordinates format");
-          event.preventDefault();
-          return;
         }
+        route_data.coordinates = routeCoordinates(route_data);
+      } 
+      catch (e) 
+      {
+        console.error("Invalid coordinates format");
+        event.preventDefault();
+        return;
       }
   
       const keyPoints = route_data.keyPoints || route_data.coordinates;
@@ -57,6 +62,7 @@ document.addEventListener("DOMContentLoaded", () =>
       document.getElementById("minElevation").value = route_data.min_elevation || "";
       document.getElementById("avgElevation").value = route_data.average_elevation || "";
       document.getElementById("mapImageUrl").value = route_data.map_image_url || "";
+      document.getElementById("routeToken").value = route_data.route_token || "";
       document.getElementById("country").value = route_data.country || "";
       
       // Clear route data from sessionStorage after submission
@@ -3,15 +3,20 @@
  * input fields. It converts textual locations into coordinates 
  * using geocoding, places markers, and renders the route on the map.
  *
+ * Once start and end are filled in, the route is prefetched in the
+ * background so that planning it takes less time.
+ *
  * Dependencies:
  *    - geocodeAddress()      : Converts address strings into lat/lng.
  *    - drawRoute(), clearRoute(): Route management.
+ *    - prefetchRoute(), cancelPrefetch(): Background route prefetch.
  *    - setSubmitLoadingState(): Manages UI loading state.
  ********************************************************************/
 
 
 import { geocodeAddress } from "./geocoder.js";
 import { drawRoute, clearRoute } from "./route_manager.js";
+import { prefetchRoute, cancelPrefetch } from "./prefetch.js";
 import { setSubmitLoadingState } from "./ui_handlers.js";
 
 
@@ -25,11 +30,64 @@ document.querySelectorAll("[data-mode]").forEach((btn) =>
     selected_mode = btn.getAttribute("data-mode");
     document.querySelectorAll("[data-mode]").forEach(b => b.classList.remove("bg-gray-200"));
     btn.classList.add("bg-gray-200");
+    schedulePrefetch();
   });
 });
 
 
 const waypoint_container = document.getElementById("waypoints-container");
+let prefetch_sequence = 0;
+
+
+
+/**
+ * Reads the start, waypoint and end addresses from the form.
+ * @returns {Array<string>} Non-empty addresses in order, or [] without start and end.
+ */
+const readAddresses = () => 
+{
+  const from = document.getElementById("from-input").value.trim();
+  const to = document.getElementById("to-input").value.trim();
+
+  const waypoint_inputs = waypoint_container.querySelectorAll(".waypoint-input");
+  const waypoints = Array.from(waypoint_inputs)
+    .map(input => input.value.trim())
+    .filter(val => val);
+
+  return from && to ? [from, ...waypoints, to] : [];
+};
+
+
+
+/**
+ * Geocodes the addresses entered so far and prefetches their route.
+ * Geocoding results are cached, so the submit does not repeat them.
+ * Answers arriving after a newer edit are ignored.
+ */
+const schedulePrefetch = async () => 
+{
+  const sequence = ++prefetch_sequence;
+  const addresses = readAddresses();
+
+  if (!addresses.length) 
+  {
+    cancelPrefetch();
+    return;
+  }
+
+  const geocoded = await Promise.all(addresses.map(address => geocodeAddress(address)));
+  if (sequence !== prefetch_sequence || geocoded.some(result => !result)) return;
+
+  const optimize_order = document.getElementById("optimize-order-input")?.checked || false;
+  prefetchRoute(
+    geocoded.map(location => ({ lat: location.lat, lng: location.lng })),
+    selected_mode,
+    optimize_order
+  );
+};
+
+// Inputs fire "change" when left after an edit, also for waypoints added later
+document.getElementById("route-form")?.addEventListener("change", schedulePrefetch);
 
 
 
@@ -47,24 +105,19 @@ export const handleFormSubmit = async (e) =>
   e.preventDefault();
 
   const form = e.target;
-  const from = document.getElementById("from-input").value.trim();
-  const to = document.getElementById("to-input").value.trim();
+  const all_addresses = readAddresses();
 
-  const waypoint_inputs = waypoint_container.querySelectorAll(".waypoint-input");
-  const waypoints = Array.from(waypoint_inputs)
-    .map(input => input.value.trim())
-    .filter(val => val);
+  const optimize_order = document.getElementById("optimize-order-input")?.checked || false;
 
   const submit_btn = form.querySelector('button[type="submit"]');
 
-  if (!from || !to) return;
+  if (!all_addresses.length) return;
 
   setSubmitLoadingState(submit_btn, true);
   clearRoute();
 
   try 
   {
-    const all_addresses = [from, ...waypoints, to];
     const geocoded = await Promise.all(all_addresses.map(address => geocodeAddress(address)));
 
     if (geocoded.some(result => !result)) 
@@ -82,18 +135,19 @@ export const handleFormSubmit = async (e) =>
       key_points.slice(1, -1),  // waypoints only (excludes start and end points)
       "geocoded",
       selected_mode,
-      key_points
+      key_points,
+      optimize_order
     );
 
+    // drawRoute stores the key points in visiting order (reordered when optimized)
     const route_data = JSON.parse(sessionStorage.getItem("routeData"));
-    route_data.keyPoints = key_points;
-    sessionStorage.setItem("routeData", JSON.stringify(route_data));
+    const ordered_points = (route_data && route_data.keyPoints) || key_points;
 
 
     const coordinatesInput = form.querySelector('input[name="coordinates"]');
     if (coordinatesInput) 
     {
-      coordinatesInput.value = JSON.stringify(key_points);
+      coordinatesInput.value = JSON.stringify(ordered_points);
     }
 
     form.reset();
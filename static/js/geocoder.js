@@ -16,13 +16,37 @@
 
 
 
+// Results by address, so the prefetch and the final submit geocode once
+const geocode_cache = new Map();
+
+
+
 /**
  * Geocodes a given address string to latitude/longitude using Nominatim.
+ * Results (and requests in flight) are remembered per address for the
+ * page's lifetime; failed lookups are not.
  * @param {string} address - The address to geocode.
  * @returns {Promise<{lat: number, lng: number, display_name: string} | null>}
  * The geocoded result or null if not found or error.
  */
-export const geocodeAddress = async (address) => 
+export const geocodeAddress = (address) => 
+  {
+    if (!geocode_cache.has(address)) 
+    {
+      const lookup = lookupAddress(address).then((result) => 
+      {
+        if (!result) geocode_cache.delete(address);
+        return result;
+      });
+      geocode_cache.set(address, lookup);
+    }
+
+    return geocode_cache.get(address);
+  };
+
+
+
+const lookupAddress = async (address) => 
   {
     try 
     {
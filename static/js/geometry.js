@@ -0,0 +1,90 @@
+/********************************************************************
+ * Decoding of the compact route geometry formats returned by
+ * `/get-route` (see geometry.py).
+ *
+ * Exported Functions:
+ *   - decodePolyline: Decodes an encoded polyline into [lat, lng] pairs.
+ *   - routeLatLngs: Returns a route's geometry as [lat, lng] pairs.
+ *   - routeCoordinates: Returns a route's geometry as {lat, lng} objects.
+ ********************************************************************/
+
+
+
+/**
+ * Decodes a Google encoded polyline.
+ *
+ * @param {string} encoded - The encoded polyline.
+ * @param {number} precision - Decimal places used when encoding.
+ * @returns {Array} Array of [lat, lng] pairs.
+ */
+export const decodePolyline = (encoded, precision = 5) =>
+{
+  const factor = Math.pow(10, precision);
+  const points = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+
+  while (index < encoded.length)
+  {
+    const deltas = [];
+    for (let i = 0; i < 2; i++)
+    {
+      let shift = 0;
+      let result = 0;
+      let byte;
+      do
+      {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+    }
+    lat += deltas[0];
+    lng += deltas[1];
+    points.push([lat / factor, lng / factor]);
+  }
+
+  return points;
+};
+
+
+/**
+ * Returns the geometry of a `/get-route` response as [lat, lng] pairs,
+ * whatever format it was sent in.
+ *
+ * @param {Object} route_data - The `/get-route` response.
+ * @returns {Array} Array of [lat, lng] pairs.
+ */
+export const routeLatLngs = (route_data) =>
+{
+  const coordinates = route_data.coordinates;
+
+  switch (route_data.coordinates_format)
+  {
+    case "polyline":
+      return decodePolyline(coordinates);
+    case "flat":
+    {
+      const points = [];
+      for (let i = 0; i < coordinates.length; i += 2)
+      {
+        points.push([coordinates[i], coordinates[i + 1]]);
+      }
+      return points;
+    }
+    default:
+      return coordinates.map((coord) => [coord.lat, coord.lng]);
+  }
+};
+
+
+/**
+ * Returns the geometry of a `/get-route` response as {lat, lng} objects.
+ *
+ * @param {Object} route_data - The `/get-route` response.
+ * @returns {Array} Array of {lat, lng} objects.
+ */
+export const routeCoordinates = (route_data) =>
+  routeLatLngs(route_data).map(([lat, lng]) => ({ lat, lng }));
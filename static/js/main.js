@@ -6,17 +6,20 @@
 *
 * Modules used:
 *   - initMap: Initializes the base Leaflet map
+*   - addRoutesOverlay: Adds the "All routes" and heatmap overlays
 *   - handleFormSubmit: Handles form submission logic
 *   - clearRoute: Clears existing drawn routes from the map
+*   - cancelPrefetch: Stops the background prefetch of a cleared route
 *   - DrawingManager: Manages draw tools for route creation
 *   - injectCustomDrawStyles: Adds custom CSS for draw controls
 *   - leaflet_custom_controls.js: Registers custom Leaflet controls
  ********************************************************************/
 
 
-import { initMap } from "./map_manager.js";
+import { initMap, addRoutesOverlay } from "./map_manager.js";
 import { handleFormSubmit } from "./form_handler.js";
 import { clearRoute } from "./route_manager.js";
+import { cancelPrefetch } from "./prefetch.js";
 import { DrawingManager } from "./drawing_manager.js";
 import "./leaflet_custom_controls.js";
 import { injectCustomDrawStyles } from "./inject_styles.js";
@@ -26,6 +29,7 @@ import { injectCustomDrawStyles } from "./inject_styles.js";
 document.addEventListener("DOMContentLoaded", async () => 
 {
   const map = await initMap();
+  addRoutesOverlay(map);
 
   const drawn_items = new L.FeatureGroup();
   map.addLayer(drawn_items);
@@ -46,6 +50,7 @@ document.addEventListener("DOMContentLoaded", async () =>
     clearRoute(DrawingManager.drawn_items);
     document.getElementById("from-input").value = "";
     document.getElementById("to-input").value = "";
+    cancelPrefetch();
 
     window.validateForm(document.getElementById("route-form"));
     DrawingManager.cleanupDrawing();
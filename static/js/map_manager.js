@@ -4,11 +4,19 @@
  *
  * References:
  *   - Leaflet Quick Start Guide: https://leafletjs.com/examples/quick-start/
+ *   - Leaflet.VectorGrid: https://github.com/Leaflet/Leaflet.VectorGrid
  ********************************************************************/
 
 
 
 let map = null;
+let routes_overlay = null;
+let heatmap_overlay = null;
+
+const ROUTE_TILES_URL = "/tiles/{z}/{x}/{y}.mvt";
+const ROUTE_TILES_MAX_ZOOM = 16;
+const HEATMAP_TILES_URL = "/heatmap/{z}/{x}/{y}.png";
+const HEATMAP_MAX_ZOOM = 14;
 
 
 
@@ -78,4 +86,59 @@ export const initMap = () => {
  * Returns:
  *    L.Map|null – The Leaflet map object, or null if map is uninitialized.
  ********************************************************************/
-export const getMap = () => map;
\ No newline at end of file
+export const getMap = () => map;
+
+
+
+/********************************************************************
+ * Adds a layer control with two overlays, both off by default:
+ *    - "All routes": every stored route, drawn on canvas from the
+ *      `/tiles/{z}/{x}/{y}.mvt` vector tiles (needs VectorGrid), so
+ *      thousands of routes stay smooth; clicking a line links to it.
+ *    - "Popular areas": the route density heatmap from
+ *      `/heatmap/{z}/{x}/{y}.png`.
+ *
+ * Parameters:
+ *    map (L.Map) – The map to add the layer control to.
+ *
+ * Returns:
+ *    L.Control.Layers – The layer control.
+ ********************************************************************/
+export const addRoutesOverlay = (map) => {
+  const overlays = {};
+
+  if (L.vectorGrid)
+  {
+    routes_overlay = L.vectorGrid.protobuf(ROUTE_TILES_URL, {
+      rendererFactory: L.canvas.tile,
+      maxNativeZoom: ROUTE_TILES_MAX_ZOOM,
+      interactive: true,
+      vectorTileLayerStyles: {
+        routes: { color: "#7c3aed", weight: 2, opacity: 0.7 },
+      },
+    });
+
+    routes_overlay.on("click", (e) => {
+      const properties = e.layer.properties;
+      const link = document.createElement("a");
+      link.href = `/route/${properties.id}`;
+      link.textContent = properties.name;
+
+      const popup = document.createElement("div");
+      popup.appendChild(link);
+      if (properties.distance_km) popup.append(` · ${properties.distance_km} km`);
+
+      L.popup().setLatLng(e.latlng).setContent(popup).openOn(map);
+    });
+
+    overlays["All routes"] = routes_overlay;
+  }
+
+  heatmap_overlay = L.tileLayer(HEATMAP_TILES_URL, {
+    maxNativeZoom: HEATMAP_MAX_ZOOM,
+    opacity: 0.8,
+  });
+  overlays["Popular areas"] = heatmap_overlay;
+
+  return L.control.layers(null, overlays).addTo(map);
+};
@@ -0,0 +1,77 @@
+/********************************************************************
+ * Speculative prefetch of the route being planned.
+ *
+ * While the user is still filling in the form, the key points are
+ * posted to `/prefetch-route` so the server can fetch the routed
+ * geometry and elevations in the background. The final `/get-route`
+ * call then mostly hits warm caches.
+ *
+ * Exported Functions:
+ *   - prefetchRoute: Schedules a prefetch (debounced, latest wins).
+ *   - cancelPrefetch: Drops the scheduled prefetch and the server's job.
+ ********************************************************************/
+
+
+
+const PREFETCH_DELAY_MS = 500;
+
+let prefetch_timer = null;
+let prefetch_controller = null;
+let last_body = null;
+
+
+
+/**
+ * Schedules a prefetch of the route through `key_points`. Calls made
+ * within PREFETCH_DELAY_MS replace each other, an unchanged request is
+ * not sent again, and a request still in flight is aborted (the server
+ * cancels the previous job on its own).
+ *
+ * @param {Array} key_points - {lat, lng} start, waypoints and end.
+ * @param {string} mode - Travel mode (e.g., "foot-walking").
+ * @param {boolean} optimize_order - Whether the stops will be reordered.
+ */
+export const prefetchRoute = (key_points, mode, optimize_order = false) =>
+{
+  clearTimeout(prefetch_timer);
+
+  const body = JSON.stringify({ coordinates: key_points, mode, optimize_order });
+  if (body === last_body) return;
+
+  prefetch_timer = setTimeout(async () =>
+  {
+    if (prefetch_controller) prefetch_controller.abort();
+    prefetch_controller = new AbortController();
+    last_body = body;
+
+    try
+    {
+      await fetch("/prefetch-route", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body,
+        signal: prefetch_controller.signal
+      });
+    }
+    catch (error)
+    {
+      // A prefetch only saves time; failures are not shown to the user
+      if (error.name !== "AbortError") last_body = null;
+    }
+  }, PREFETCH_DELAY_MS);
+};
+
+
+
+/**
+ * Cancels any scheduled prefetch and asks the server to stop its job.
+ */
+export const cancelPrefetch = () =>
+{
+  clearTimeout(prefetch_timer);
+  if (prefetch_controller) prefetch_controller.abort();
+  if (last_body === null) return;
+
+  last_body = null;
+  fetch("/prefetch-route", { method: "DELETE" }).catch(() => {});
+};
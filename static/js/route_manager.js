@@ -11,11 +11,13 @@
  * Dependencies:
  *   - map_manager.js: Provides access to the shared Leaflet map instance.
  *   - storage.js: Handles session storage for route data.
+ *   - geometry.js: Decodes the compact geometry returned by the backend.
  ********************************************************************/
 
 
 import { getMap } from "./map_manager.js";
 import { setItem } from "./storage.js";
+import { routeLatLngs } from "./geometry.js";
 
 
 let current_route_polyline = null;
@@ -27,14 +29,18 @@ let route_type = null;
  * Draws a route on the map using provided coordinates and stores the result.
  * Sends the coordinates to the `/get-route` endpoint and uses the response
  * to draw a Leaflet polyline. Also stores the response data in session storage.
+ * The geometry is requested as an encoded polyline and stored that way,
+ * which keeps both the response and the stored route several times smaller.
  *
  * @param {Array} coordinates - Array of coordinate objects for the route (start, waypoints, end).
  * @param {Array} waypoints - Array of waypoint coordinate objects (excluding start/end).
  * @param {string} type - Route type ("geocoded" or "drawn").
  * @param {string} mode - Travel mode (e.g., "foot-walking").
  * @param {Array|null} key_points - Optional array of key points for the route.
+ * @param {boolean} optimize_order - Lets the backend reorder the stops between
+ *   start and end; the key points are then stored in the new visiting order.
  */
-export const drawRoute = async (coordinates, waypoints, type = "geocoded", mode = "foot-walking", key_points = null) => 
+export const drawRoute = async (coordinates, waypoints, type = "geocoded", mode = "foot-walking", key_points = null, optimize_order = false) => 
 {
   try 
   {
@@ -45,7 +51,9 @@ export const drawRoute = async (coordinates, waypoints, type = "geocoded", mode
         coordinates, 
         waypoints,
         mode,
-        type
+        type,
+        optimize_order,
+        geometry_format: "polyline"
       }),
     });
 
@@ -53,13 +61,15 @@ export const drawRoute = async (coordinates, waypoints, type = "geocoded", mode
 
     if (key_points) 
     {
-    route_data.keyPoints = key_points;
+      route_data.keyPoints = route_data.waypoint_order
+        ? route_data.waypoint_order.map((i) => key_points[i])
+        : key_points;
     }
 
     const map = getMap();
     
     current_route_polyline = L.polyline(
-      route_data.coordinates.map((coord) => [coord.lat, coord.lng]),
+      routeLatLngs(route_data),
       { color: "#3b82f6" }
     ).addTo(map);
     map.fitBounds(current_route_polyline.getBounds());
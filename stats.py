@@ -0,0 +1,257 @@
+"""
+Materialized route statistics.
+
+Totals per user, per country and for the whole site (route count,
+kilometres, climb and descent) are kept in the `route_stats` table.
+Triggers on `routes` update it in the same transaction as every insert,
+update or delete, so reading a total costs one primary-key lookup
+instead of a `GROUP BY` over all routes.
+
+This module includes:
+    - The summary table and its maintenance triggers
+    - A reconciler that recomputes the totals from `routes` and fixes
+      any drift (e.g. rows changed with triggers disabled). It runs
+      from a background thread in at most one worker per interval,
+      and from `flask reconcile-stats`.
+    - Read helpers for the dashboard endpoints
+"""
+
+
+import time
+
+from background import BackgroundJob
+from metrics import increment, log_event
+
+
+
+DEFAULTS = {
+    "STATS_RECONCILE_INTERVAL": 3600,       # Seconds between reconciliations; 0 disables
+}
+
+FIELDS = ("route_count", "total_distance", "elevation_gain", "elevation_loss")
+TOLERANCE = 1e-6
+
+# Adds (sign = '+') or removes (sign = '-') one route row (NEW or OLD) from all scopes
+_APPLY_ROUTE = """
+    INSERT INTO route_stats (scope, key, route_count, total_distance, elevation_gain, elevation_loss)
+    VALUES
+        ('user', CAST({row}.user_id AS TEXT), {sign}1,
+            {sign}coalesce(CAST({row}.total_distance AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_gain AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_loss AS REAL), 0)),
+        ('country', coalesce({row}.country, ''), {sign}1,
+            {sign}coalesce(CAST({row}.total_distance AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_gain AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_loss AS REAL), 0)),
+        ('global', '', {sign}1,
+            {sign}coalesce(CAST({row}.total_distance AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_gain AS REAL), 0),
+            {sign}coalesce(CAST({row}.elevation_loss AS REAL), 0))
+    ON CONFLICT (scope, key) DO UPDATE SET
+        route_count = route_count + excluded.route_count,
+        total_distance = total_distance + excluded.total_distance,
+        elevation_gain = elevation_gain + excluded.elevation_gain,
+        elevation_loss = elevation_loss + excluded.elevation_loss;
+"""
+
+STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS route_stats (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    route_count INTEGER NOT NULL DEFAULT 0,
+    total_distance REAL NOT NULL DEFAULT 0,
+    elevation_gain REAL NOT NULL DEFAULT 0,
+    elevation_loss REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE TABLE IF NOT EXISTS route_stats_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    reconciled_at REAL NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS route_stats_on_insert
+AFTER INSERT ON routes
+BEGIN
+    {_APPLY_ROUTE.format(row = "NEW", sign = "+")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_stats_on_update
+AFTER UPDATE OF user_id, country, total_distance, elevation_gain, elevation_loss ON routes
+BEGIN
+    {_APPLY_ROUTE.format(row = "OLD", sign = "-")}
+    {_APPLY_ROUTE.format(row = "NEW", sign = "+")}
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_stats_on_delete
+AFTER DELETE ON routes
+BEGIN
+    {_APPLY_ROUTE.format(row = "OLD", sign = "-")}
+END;
+"""
+
+# The truth the summary table must match
+_ACTUAL_STATS = """
+SELECT '{scope}', {key},
+    count(*),
+    coalesce(sum(coalesce(CAST(total_distance AS REAL), 0)), 0),
+    coalesce(sum(coalesce(CAST(elevation_gain AS REAL), 0)), 0),
+    coalesce(sum(coalesce(CAST(elevation_loss AS REAL), 0)), 0)
+FROM routes
+{group_by}
+"""
+
+ACTUAL_STATS_QUERIES = (
+    _ACTUAL_STATS.format(scope = "user", key = "CAST(user_id AS TEXT)", group_by = "GROUP BY user_id"),
+    _ACTUAL_STATS.format(scope = "country", key = "coalesce(country, '')", group_by = "GROUP BY coalesce(country, '')"),
+    _ACTUAL_STATS.format(scope = "global", key = "''", group_by = ""),
+)
+
+
+
+def init_stats_schema(connection):
+    """
+    Creates the summary table and triggers. The first time, the totals
+    are computed from the routes already stored.
+    """
+
+    connection.executescript(STATS_SCHEMA)
+    created = connection.execute(
+        "INSERT OR IGNORE INTO route_stats_meta (id, reconciled_at) VALUES (1, 0)"
+    ).rowcount
+    connection.commit()
+    if created:
+        reconcile_stats(connection)
+
+
+
+# ===========================================================
+#                    Reconciliation
+# ===========================================================
+def reconcile_stats(connection):
+    """
+    Recomputes every total from `routes` and corrects the rows that
+    drifted, inside one write transaction so no route changes meanwhile.
+
+    Returns:
+        int: Number of summary rows corrected.
+    """
+
+    if connection.in_transaction:
+        connection.commit()
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        actual = {}
+        for query in ACTUAL_STATS_QUERIES:
+            for scope, key, *values in connection.execute(query):
+                actual[(scope, str(key))] = values
+
+        stored = {
+            (scope, key): values
+            for scope, key, *values in connection.execute(
+                "SELECT scope, key, route_count, total_distance, elevation_gain, elevation_loss FROM route_stats"
+            )
+        }
+
+        corrected = 0
+        for key in stored.keys() | actual.keys():
+            expected = actual.get(key, [0, 0.0, 0.0, 0.0])
+            current = stored.get(key)
+            if current is not None and all(abs(a - b) <= TOLERANCE * max(1.0, abs(a)) for a, b in zip(expected, current)):
+                continue
+            corrected += 1
+            if expected[0] == 0:
+                connection.execute("DELETE FROM route_stats WHERE scope = ? AND key = ?", key)
+            else:
+                connection.execute(
+                    """INSERT OR REPLACE INTO route_stats
+                    (scope, key, route_count, total_distance, elevation_gain, elevation_loss)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                    (*key, *expected)
+                )
+
+        connection.execute("UPDATE route_stats_meta SET reconciled_at = ? WHERE id = 1", (time.time(),))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    increment("stats_reconciled_total")
+    increment("stats_drift_rows_total", corrected)
+    log_event("stats_reconciled", corrected = corrected)
+    return corrected
+
+def reconcile_if_due(connection, interval):
+    """
+    Reconciles unless another worker did so in the last `interval`
+    seconds. The timestamp is claimed atomically, so one worker runs it.
+    """
+
+    claimed = connection.execute(
+        "UPDATE route_stats_meta SET reconciled_at = ? WHERE id = 1 AND reconciled_at < ?",
+        (time.time(), time.time() - interval)
+    ).rowcount
+    connection.commit()
+    return reconcile_stats(connection) if claimed else None
+
+reconciler = BackgroundJob("stats-reconcile", reconcile_if_due)
+
+def init_stats(app, database):
+    """
+    Fills in the statistics settings and starts the reconciler with
+    the first request of each worker.
+    """
+
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    reconciler.init_app(app, database, app.config["STATS_RECONCILE_INTERVAL"])
+
+
+
+# ===========================================================
+#                    Reading
+# ===========================================================
+def _as_dict(row):
+    route_count, total_distance, elevation_gain, elevation_loss = row
+    return {
+        "route_count": route_count,
+        "total_distance": round(total_distance, 2),
+        "elevation_gain": round(elevation_gain, 2),
+        "elevation_loss": round(elevation_loss, 2),
+        "average_distance": round(total_distance / route_count, 2) if route_count else 0,
+    }
+
+def get_stats(connection, scope, key = ""):
+    """
+    Totals of one user (key = user id), country (key = name, '' for
+    unknown) or of the whole site.
+
+    Returns:
+        dict: route_count, total_distance (km), elevation_gain and
+            elevation_loss (m), average_distance (km). Zeros if none.
+    """
+
+    row = connection.execute(
+        """SELECT route_count, total_distance, elevation_gain, elevation_loss
+        FROM route_stats WHERE scope = ? AND key = ?""",
+        (scope, str(key))
+    ).fetchone()
+    return _as_dict(tuple(row) if row else (0, 0.0, 0.0, 0.0))
+
+def list_stats(connection, scope, order_by = "route_count", limit = 100):
+    """
+    The largest entries of a scope (e.g. countries by route count).
+    """
+
+    if order_by not in FIELDS:
+        raise ValueError(f"order_by must be one of {', '.join(FIELDS)}")
+
+    rows = connection.execute(
+        f"""SELECT key, route_count, total_distance, elevation_gain, elevation_loss
+        FROM route_stats WHERE scope = ? AND route_count > 0
+        ORDER BY {order_by} DESC LIMIT ?""",
+        (scope, limit)
+    ).fetchall()
+    return [{"key": row[0], **_as_dict(tuple(row[1:]))} for row in rows]
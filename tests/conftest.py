@@ -0,0 +1,50 @@
+"""
+Test fixtures: the app built with `TestingConfig` on a copy of the
+bundled database, so tests never change `route_manager.db`.
+"""
+
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix = "route_tests_")
+
+# Read when config.py and helpers.py are imported, so set before `import app`
+shutil.copy(os.path.join(ROOT, "route_manager.db"), os.path.join(WORKDIR, "route_manager.db"))
+os.environ["DATABASE_PATH"] = os.path.join(WORKDIR, "route_manager.db")
+os.environ["SESSION_DATABASE"] = os.path.join(WORKDIR, "sessions.db")
+os.environ["RATE_LIMIT_DATABASE"] = os.path.join(WORKDIR, "rate_limit.db")
+os.environ["TILE_CACHE_DIR"] = os.path.join(WORKDIR, "tile_cache")
+os.environ["SECRET_KEY"] = "test"
+os.environ["LOG_LEVEL"] = "CRITICAL"
+
+from app import create_app
+
+
+
+@pytest.fixture
+def app():
+    return create_app("testing")
+
+@pytest.fixture
+def database():
+    connection = sqlite3.connect(os.environ["DATABASE_PATH"])
+    connection.row_factory = sqlite3.Row
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def user_id(database):
+    return database.execute("SELECT id FROM users ORDER BY id LIMIT 1").fetchone()["id"]
+
+@pytest.fixture
+def client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
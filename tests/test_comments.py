@@ -0,0 +1,36 @@
+"""
+Comment edit and delete redirects.
+"""
+
+
+import pytest
+
+
+
+@pytest.fixture
+def comment(database, user_id):
+    route_id = database.execute("SELECT id FROM routes ORDER BY id LIMIT 1").fetchone()["id"]
+    comment_id = database.execute(
+        "INSERT INTO comments (route_id, user_id, comment) VALUES (?, ?, ?)",
+        (route_id, user_id, "Nice route")
+    ).lastrowid
+    database.commit()
+    return route_id, comment_id
+
+def test_delete_comment_redirects_to_route(client, database, comment):
+    route_id, comment_id = comment
+
+    response = client.post(f"/route/{route_id}/comment/{comment_id}/delete")
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == f"/route/{route_id}"
+    assert database.execute("SELECT 1 FROM comments WHERE id = ?", (comment_id,)).fetchone() is None
+
+def test_empty_comment_edit_redirects_to_edit_form(client, database, comment):
+    route_id, comment_id = comment
+
+    response = client.post(f"/route/{route_id}/comment/{comment_id}/edit", data = {"comment": "  "})
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == f"/route/{route_id}/comment/{comment_id}/edit"
+    assert database.execute("SELECT comment FROM comments WHERE id = ?", (comment_id,)).fetchone()["comment"] == "Nice route"
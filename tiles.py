@@ -0,0 +1,513 @@
+"""
+Vector tiles of all stored routes.
+
+`/tiles/{z}/{x}/{y}.mvt` serves Mapbox Vector Tiles (spec v2) with one
+'routes' layer of line features, so the map can show every route
+without sending their full coordinates to the browser.
+
+This module includes:
+    - An R*Tree of route bounding boxes, kept up to date by triggers
+    - Per-zoom simplification (radial distance + Douglas-Peucker) and
+      clipping of route lines to the buffered tile
+    - A hand-written protobuf encoder for the tile format
+    - A gzipped on-disk tile cache. Triggers on `routes` queue the
+      bounds of every created, edited or deleted route, and the queued
+      areas are removed from the cache before the next tile is served,
+      by whichever worker serves it.
+"""
+
+
+import gzip
+import json
+import os
+import struct
+import tempfile
+from math import atan, cos, degrees, floor, log, pi, radians, sinh, tan
+
+from cache import TTLCache
+from metrics import increment, timed
+
+
+
+EXTENT = 4096                       # Tile coordinate space (spec default)
+BUFFER = 64                         # Extra tile units drawn around the edges
+SIMPLIFY_TOLERANCE = EXTENT / 512   # Half a pixel on a 256 px tile
+MAX_LATITUDE = 85.0511287798
+TILE_MAX_ZOOM = 16
+LAYER_NAME = "routes"
+GEOMETRY_CACHE_TTL = 600
+
+TILE_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS route_bounds USING rtree(
+    route_id, min_lng, max_lng, min_lat, max_lat
+);
+
+CREATE TABLE IF NOT EXISTS tile_invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    min_lng REAL NOT NULL,
+    max_lng REAL NOT NULL,
+    min_lat REAL NOT NULL,
+    max_lat REAL NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS route_tiles_on_insert
+AFTER INSERT ON routes
+BEGIN
+    INSERT INTO route_bounds (route_id, min_lng, max_lng, min_lat, max_lat)
+    SELECT NEW.id,
+        min(json_extract(value, '$[1]')), max(json_extract(value, '$[1]')),
+        min(json_extract(value, '$[0]')), max(json_extract(value, '$[0]'))
+    FROM json_each(CASE WHEN json_valid(NEW.coordinates) THEN NEW.coordinates ELSE '[]' END)
+    HAVING count(*) > 0;
+
+    INSERT INTO tile_invalidations (min_lng, max_lng, min_lat, max_lat)
+    SELECT min_lng, max_lng, min_lat, max_lat FROM route_bounds WHERE route_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_tiles_on_update
+AFTER UPDATE OF coordinates, name, total_distance, country ON routes
+BEGIN
+    INSERT INTO tile_invalidations (min_lng, max_lng, min_lat, max_lat)
+    SELECT min_lng, max_lng, min_lat, max_lat FROM route_bounds WHERE route_id = OLD.id;
+
+    DELETE FROM route_bounds WHERE route_id = OLD.id;
+
+    INSERT INTO route_bounds (route_id, min_lng, max_lng, min_lat, max_lat)
+    SELECT NEW.id,
+        min(json_extract(value, '$[1]')), max(json_extract(value, '$[1]')),
+        min(json_extract(value, '$[0]')), max(json_extract(value, '$[0]'))
+    FROM json_each(CASE WHEN json_valid(NEW.coordinates) THEN NEW.coordinates ELSE '[]' END)
+    HAVING count(*) > 0;
+
+    INSERT INTO tile_invalidations (min_lng, max_lng, min_lat, max_lat)
+    SELECT min_lng, max_lng, min_lat, max_lat FROM route_bounds WHERE route_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS route_tiles_on_delete
+AFTER DELETE ON routes
+BEGIN
+    INSERT INTO tile_invalidations (min_lng, max_lng, min_lat, max_lat)
+    SELECT min_lng, max_lng, min_lat, max_lat FROM route_bounds WHERE route_id = OLD.id;
+
+    DELETE FROM route_bounds WHERE route_id = OLD.id;
+END;
+"""
+
+# Routes stored before the triggers existed
+BACKFILL_BOUNDS = """
+INSERT INTO route_bounds (route_id, min_lng, max_lng, min_lat, max_lat)
+SELECT routes.id,
+    min(json_extract(point.value, '$[1]')), max(json_extract(point.value, '$[1]')),
+    min(json_extract(point.value, '$[0]')), max(json_extract(point.value, '$[0]'))
+FROM routes, json_each(CASE WHEN json_valid(routes.coordinates) THEN routes.coordinates ELSE '[]' END) AS point
+WHERE routes.id NOT IN (SELECT route_id FROM route_bounds)
+GROUP BY routes.id
+"""
+
+# Simplified world-space lines per (route, zoom), shared by the tiles a route crosses
+geometry_cache = TTLCache(GEOMETRY_CACHE_TTL, max_size = 20_000)
+
+
+
+def init_tile_schema(connection):
+    """
+    Creates the bounds index, the invalidation queue and their triggers,
+    and indexes routes that were stored before them.
+    """
+
+    connection.executescript(TILE_SCHEMA)
+    connection.execute(BACKFILL_BOUNDS)
+    connection.commit()
+
+
+
+# ===========================================================
+#                    Tile Coordinates
+# ===========================================================
+def valid_tile(z, x, y, max_zoom = TILE_MAX_ZOOM):
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def _world(lat, lng, zoom):
+    """
+    Web Mercator position in tile units (EXTENT per tile) at `zoom`.
+    """
+
+    size = EXTENT * 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lng + 180.0) / 360.0 * size
+    y = (1.0 - log(tan(radians(lat)) + 1.0 / cos(radians(lat))) / pi) / 2.0 * size
+    return x, y
+
+def _lng(x, zoom):
+    return x / (EXTENT * 2 ** zoom) * 360.0 - 180.0
+
+def _lat(y, zoom):
+    return degrees(atan(sinh(pi * (1.0 - 2.0 * y / (EXTENT * 2 ** zoom)))))
+
+def tile_bounds(z, x, y, buffer = BUFFER):
+    """
+    (min_lng, max_lng, min_lat, max_lat) of a tile, grown by `buffer` tile units.
+    """
+
+    left, right = x * EXTENT - buffer, (x + 1) * EXTENT + buffer
+    top, bottom = y * EXTENT - buffer, (y + 1) * EXTENT + buffer
+    return _lng(left, z), _lng(right, z), _lat(bottom, z), _lat(top, z)
+
+def tile_range(bounds, z, buffer = BUFFER):
+    """
+    Inclusive (x0, x1, y0, y1) range of the tiles at `z` whose buffered
+    area touches `bounds`.
+    """
+
+    min_lng, max_lng, min_lat, max_lat = bounds
+    left, bottom = _world(min_lat, min_lng, z)
+    right, top = _world(max_lat, max_lng, z)
+    last = 2 ** z - 1
+    return (
+        max(0, floor((left - buffer) / EXTENT)), min(last, floor((right + buffer) / EXTENT)),
+        max(0, floor((top - buffer) / EXTENT)), min(last, floor((bottom + buffer) / EXTENT)),
+    )
+
+
+
+# ===========================================================
+#                    Line Processing
+# ===========================================================
+def _segment_distance_sq(p, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return (p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return (p[0] - a[0] - t * dx) ** 2 + (p[1] - a[1] - t * dy) ** 2
+
+def simplify(points, tolerance):
+    """
+    Drops points closer than `tolerance` to the previous kept one, then
+    runs Douglas-Peucker (iteratively) on what is left.
+    """
+
+    if len(points) < 3:
+        return points
+
+    tolerance_sq = tolerance * tolerance
+    radial = [points[0]]
+    for point in points[1:-1]:
+        last = radial[-1]
+        if (point[0] - last[0]) ** 2 + (point[1] - last[1]) ** 2 > tolerance_sq:
+            radial.append(point)
+    radial.append(points[-1])
+
+    keep = [False] * len(radial)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(radial) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, farthest_sq = None, tolerance_sq
+        for i in range(first + 1, last):
+            distance_sq = _segment_distance_sq(radial[i], radial[first], radial[last])
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = i, distance_sq
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(radial, keep) if kept]
+
+def _clip_segment(x1, y1, x2, y2, low, high):
+    """
+    Liang-Barsky clipping of a segment to the square [low, high]².
+    """
+
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - low), (dx, high - x1), (-dy, y1 - low), (dy, high - y1)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        r = q / p
+        if p < 0:
+            if r > t1:
+                return None
+            t0 = max(t0, r)
+        else:
+            if r < t0:
+                return None
+            t1 = min(t1, r)
+    return (x1 + t0 * dx, y1 + t0 * dy), (x1 + t1 * dx, y1 + t1 * dy)
+
+def clip_line(points, low, high):
+    """
+    Clips a line to a square, returning the parts that fall inside.
+    """
+
+    parts, current = [], []
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        clipped = _clip_segment(x1, y1, x2, y2, low, high)
+        if clipped is None:
+            if current:
+                parts.append(current)
+                current = []
+            continue
+        start, end = clipped
+        if current and current[-1] != start:
+            parts.append(current)
+            current = []
+        if not current:
+            current.append(start)
+        current.append(end)
+        if end != (x2, y2):
+            parts.append(current)
+            current = []
+    if current:
+        parts.append(current)
+    return parts
+
+def mercator_line(coordinates):
+    """
+    Projects [lat, lng] pairs to Web Mercator in [0, 1]²; positions at
+    any zoom are these scaled by EXTENT * 2 ** zoom.
+    """
+
+    half_radians, quarter_turn, turn = pi / 360.0, pi / 4, 2 * pi
+    try:
+        line = [
+            ((lng + 180.0) / 360.0, 0.5 - log(tan(quarter_turn + lat * half_radians)) / turn)
+            for lat, lng in coordinates
+        ]
+    except (ValueError, ZeroDivisionError):
+        line = None
+
+    if line is None or any(abs(lat) > MAX_LATITUDE for lat, _ in coordinates):
+        # Rare: points beyond Web Mercator's limits are clamped first
+        line = mercator_line([(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)), lng) for lat, lng in coordinates])
+    return line
+
+def _route_world_line(route_id, coordinates_json, zoom):
+    """
+    The simplified Web Mercator line of a route at `zoom`. The parsed
+    and projected line is cached per route and the simplified one per
+    route and zoom, both keyed on the stored coordinates so edits miss.
+    """
+
+    version = hash(coordinates_json)
+    key = (route_id, zoom, version)
+    line = geometry_cache.get(key)
+    if line is None:
+        projected = geometry_cache.get((route_id, version))
+        if projected is None:
+            try:
+                projected = mercator_line(json.loads(coordinates_json))
+            except (TypeError, ValueError):
+                projected = []
+            geometry_cache.set((route_id, version), projected)
+        size = EXTENT * 2 ** zoom
+        line = simplify([(x * size, y * size) for x, y in projected], SIMPLIFY_TOLERANCE)
+        geometry_cache.set(key, line)
+    return line
+
+
+
+# ===========================================================
+#                    Protobuf Encoding
+# ===========================================================
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+def _bytes_field(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+def _packed(field, values):
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+def _value(value):
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode())
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return _key(5, 0) + _varint(value)
+    return _key(3, 1) + struct.pack("<d", float(value))
+
+def _line_geometry(parts):
+    """
+    MoveTo/LineTo commands for a (multi)line, with zigzag-encoded deltas
+    from a cursor that carries over between parts.
+    """
+
+    commands = []
+    cx = cy = 0
+    for part in parts:
+        for i, (x, y) in enumerate(part):
+            if i == 0:
+                commands.append(1 | (1 << 3))
+            elif i == 1:
+                commands.append(2 | ((len(part) - 1) << 3))
+            commands.append(_zigzag(x - cx))
+            commands.append(_zigzag(y - cy))
+            cx, cy = x, y
+    return commands
+
+def encode_layer(name, features):
+    """
+    Encodes one layer of line features.
+
+    Args:
+        name (str): Layer name.
+        features (list[tuple]): (id, properties dict, list of integer
+            point lists in tile coordinates).
+    Returns:
+        bytes: The layer message, wrapped as a Tile field.
+    """
+
+    keys, values = {}, {}
+    body = [_key(15, 0) + _varint(2), _bytes_field(1, name.encode())]
+
+    for feature_id, properties, parts in features:
+        tags = []
+        for k, v in properties.items():
+            if v is None:
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v).__name__, v), len(values)))
+        feature = (
+            _key(1, 0) + _varint(feature_id)
+            + _packed(2, tags)
+            + _key(3, 0) + _varint(2)   # LINESTRING
+            + _packed(4, _line_geometry(parts))
+        )
+        body.append(_bytes_field(2, feature))
+
+    body.extend(_bytes_field(3, k.encode()) for k in keys)
+    body.extend(_bytes_field(4, _value(v)) for _, v in values)
+    body.append(_key(5, 0) + _varint(EXTENT))
+
+    return _bytes_field(3, b"".join(body))
+
+
+
+# ===========================================================
+#                    Rendering & Cache
+# ===========================================================
+def render_tile(connection, z, x, y):
+    """
+    Builds the MVT bytes of one tile from the routes crossing it.
+    """
+
+    min_lng, max_lng, min_lat, max_lat = tile_bounds(z, x, y)
+    rows = connection.execute(
+        """SELECT routes.id, routes.name, routes.total_distance, routes.country, routes.coordinates
+        FROM route_bounds
+        JOIN routes ON routes.id = route_bounds.route_id
+        WHERE route_bounds.max_lng >= ? AND route_bounds.min_lng <= ?
+        AND route_bounds.max_lat >= ? AND route_bounds.min_lat <= ?
+        ORDER BY routes.id""",
+        (min_lng, max_lng, min_lat, max_lat)
+    ).fetchall()
+
+    origin_x, origin_y = x * EXTENT, y * EXTENT
+    features = []
+    for route_id, name, total_distance, country, coordinates_json in rows:
+        line = [(px - origin_x, py - origin_y) for px, py in _route_world_line(route_id, coordinates_json, z)]
+        parts = []
+        for part in clip_line(line, -BUFFER, EXTENT + BUFFER):
+            points = []
+            for px, py in part:
+                point = (round(px), round(py))
+                if not points or points[-1] != point:
+                    points.append(point)
+            if len(points) >= 2:
+                parts.append(points)
+        if parts:
+            features.append((route_id, {"id": route_id, "name": name, "distance_km": total_distance, "country": country}, parts))
+
+    return encode_layer(LAYER_NAME, features) if features else b""
+
+def _tile_path(cache_dir, z, x, y):
+    return os.path.join(cache_dir, str(z), str(x), f"{y}.mvt.gz")
+
+def _invalidation_sequence(connection):
+    row = connection.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'tile_invalidations'"
+    ).fetchone()
+    return row[0] if row else 0
+
+def apply_invalidations(connection, cache_dir):
+    """
+    Deletes the cached tiles touched by queued route changes and
+    empties the queue.
+    """
+
+    rows = connection.execute(
+        "SELECT id, min_lng, max_lng, min_lat, max_lat FROM tile_invalidations ORDER BY id"
+    ).fetchall()
+    if not rows:
+        return 0
+
+    removed = 0
+    zooms = [int(name) for name in os.listdir(cache_dir) if name.isdigit()] if os.path.isdir(cache_dir) else []
+    for z in zooms:
+        zoom_dir = os.path.join(cache_dir, str(z))
+        columns = [int(name) for name in os.listdir(zoom_dir) if name.isdigit()]
+        for _, *bounds in rows:
+            x0, x1, y0, y1 = tile_range(bounds, z)
+            for x in columns:
+                if not x0 <= x <= x1:
+                    continue
+                column_dir = os.path.join(zoom_dir, str(x))
+                for name in os.listdir(column_dir):
+                    tile_y = name.split(".", 1)[0]
+                    if tile_y.isdigit() and y0 <= int(tile_y) <= y1:
+                        try:
+                            os.remove(os.path.join(column_dir, name))
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+
+    connection.execute("DELETE FROM tile_invalidations WHERE id <= ?", (rows[-1][0],))
+    connection.commit()
+    increment("tile_cache_invalidated_total", removed)
+    return removed
+
+def get_tile(connection, z, x, y, cache_dir):
+    """
+    Returns the gzipped MVT bytes of a tile, from the disk cache when
+    possible.
+
+    A tile rendered while a route changed is served but not cached, so
+    a concurrent edit can never leave a stale tile on disk.
+    """
+
+    apply_invalidations(connection, cache_dir)
+
+    path = _tile_path(cache_dir, z, x, y)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        increment("cache_requests_total", cache = "tiles", result = "hit")
+        return data
+    except FileNotFoundError:
+        increment("cache_requests_total", cache = "tiles", result = "miss")
+
+    sequence = _invalidation_sequence(connection)
+    with timed("render_tile", zoom = z):
+        data = gzip.compress(render_tile(connection, z, x, y), mtime = 0)
+
+    if _invalidation_sequence(connection) == sequence:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), suffix = ".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    return data
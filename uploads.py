@@ -0,0 +1,241 @@
+"""
+Profile picture upload pipeline.
+
+This module includes:
+    - Streaming of the upload to a temporary file with a size cap
+    - Validation by content sniffing (magic bytes and Pillow),
+      not by the user-supplied file extension
+    - Downscaling and re-encoding to a fixed square avatar size
+    - Content-hash file names, so identical uploads share one file
+      and names never collide
+    - A small worker pool to do the image work off the request thread
+
+Pillow is imported on the first upload (see startup.py).
+"""
+
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import DATABASE, invalidate_user
+from metrics import log_error, timed
+
+
+
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+AVATAR_MAX_PIXELS = 40_000_000      # Refuse decompression bombs
+AVATAR_SIZE = 256                   # Pixels per side
+AVATAR_FORMAT = "WEBP"
+AVATAR_EXTENSION = "webp"
+DEFAULT_AVATAR = "static/images/users/default_profile_image.png"
+CHUNK_SIZE = 64 * 1024
+
+SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"\xff\xd8\xff": "JPEG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+}
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+
+class InvalidImage(Exception):
+    """
+    Raised when an upload is too large or is not a supported image.
+    """
+
+
+
+# ===========================================================
+#                    Receiving
+# ===========================================================
+def sniff_image_type(header):
+    """
+    Identifies an image from its first bytes.
+
+    Args:
+        header (bytes): At least the first 12 bytes of the file.
+    Returns:
+        str | None: 'PNG', 'JPEG', 'GIF', 'WEBP' or None.
+    """
+
+    for signature, kind in SIGNATURES.items():
+        if header.startswith(signature):
+            return kind
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+def receive_upload(file, max_bytes = AVATAR_MAX_BYTES):
+    """
+    Streams an uploaded file to a temporary file, checking its size
+    and type as it goes.
+
+    Args:
+        file (FileStorage): The uploaded file.
+        max_bytes (int): Largest accepted size.
+    Returns:
+        tuple: (temporary file path, sha256 hex digest of the content).
+    Raises:
+        InvalidImage: If the file is too large or not an image.
+    """
+
+    from PIL import Image
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix = "avatar_")
+
+    try:
+        with os.fdopen(fd, "wb") as out:
+            first = True
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first and not sniff_image_type(chunk[:12]):
+                    raise InvalidImage("File is not a PNG, JPEG, GIF or WebP image.")
+                first = False
+                size += len(chunk)
+                if size > max_bytes:
+                    raise InvalidImage(f"Image is larger than {max_bytes // (1024 * 1024)} MB.")
+                digest.update(chunk)
+                out.write(chunk)
+
+        if size == 0:
+            raise InvalidImage("Uploaded file is empty.")
+
+        # Reads only the header, so this stays cheap on the request thread
+        with Image.open(path) as image:
+            width, height = image.size
+        if width * height > AVATAR_MAX_PIXELS:
+            raise InvalidImage("Image dimensions are too large.")
+
+    except InvalidImage:
+        os.remove(path)
+        raise
+    except (OSError, Image.DecompressionBombError) as e:
+        os.remove(path)
+        raise InvalidImage("Image could not be read.") from e
+
+    return path, digest.hexdigest()
+
+
+
+# ===========================================================
+#                    Processing
+# ===========================================================
+def avatar_path(folder, content_hash):
+    """
+    Returns the file path of the avatar for a content hash.
+    """
+
+    return os.path.join(folder, f"{content_hash}.{AVATAR_EXTENSION}").replace("\\", "/")
+
+def process_avatar(source_path, content_hash, folder):
+    """
+    Decodes the upload, crops it to a square and writes the avatar.
+    Skips the work if this content was processed before.
+
+    Returns:
+        str: Path of the avatar, as stored in `users.profile_picture`.
+    """
+
+    from PIL import Image, ImageOps
+
+    path = avatar_path(folder, content_hash)
+    try:
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(folder, exist_ok = True)
+        with timed("avatar_process"):
+            with Image.open(source_path) as image:
+                image = ImageOps.exif_transpose(image)
+                image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+                avatar = ImageOps.fit(image, (AVATAR_SIZE, AVATAR_SIZE), Image.Resampling.LANCZOS)
+                partial = path + ".part"
+                avatar.save(partial, AVATAR_FORMAT, quality = 85, method = 4)
+                os.replace(partial, path)
+        return path
+
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage("Image could not be processed.") from e
+    finally:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+def _pool():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "avatar")
+                _executor_pid = os.getpid()
+    return _executor
+
+def submit_avatar(source_path, content_hash, folder):
+    """
+    Queues `process_avatar` on the worker pool.
+
+    Returns:
+        Future: Resolves to the stored avatar path.
+    """
+
+    return _pool().submit(process_avatar, source_path, content_hash, folder)
+
+def set_avatar_when_done(future, user_id, previous):
+    """
+    Stores the avatar on the user once `future` finishes, using its
+    own database connection (the request may be long gone).
+    """
+
+    def done(future):
+        try:
+            avatar = future.result()
+        except Exception as e:
+            log_error("avatar_processing_failed", e, user_id = user_id)
+            return
+
+        connection = sqlite3.connect(DATABASE)
+        try:
+            connection.execute("UPDATE users SET profile_picture = ? WHERE id = ?", (avatar, user_id))
+            connection.commit()
+            invalidate_user(user_id)
+            if previous != avatar:
+                remove_avatar(connection, previous)
+        finally:
+            connection.close()
+
+    future.add_done_callback(done)
+
+
+
+# ===========================================================
+#                    Cleanup
+# ===========================================================
+def remove_avatar(connection, path):
+    """
+    Deletes an avatar's file unless it is the default picture or
+    another user still uses the same (content-hashed) file.
+    """
+
+    if not path or path == DEFAULT_AVATAR:
+        return
+
+    in_use = connection.execute(
+        "SELECT 1 FROM users WHERE profile_picture = ? LIMIT 1", (path,)
+    ).fetchone()
+    if in_use:
+        return
+
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,28 @@
+"""
+WSGI entry point:
+
+    gunicorn --preload --workers 4 wsgi:app
+
+With `--preload` the app is built once in the gunicorn master and the
+workers are forked from it, sharing its memory copy-on-write (add
+`PRELOAD_MODULES=1` to share the heavy libraries too, see startup.py).
+
+Python writes to an object's memory whenever the garbage collector
+scans it, which would copy most shared pages into every worker. The
+collector is therefore paused while the app is built, and everything
+built is moved out of its reach (`gc.freeze`) before the workers fork.
+Without `--preload` each worker runs this module itself, where the
+freeze only spares the collector from scanning long-lived objects.
+"""
+
+
+import gc
+
+gc.disable()
+
+from app import create_app
+
+app = create_app()
+
+gc.freeze()
+gc.enable()